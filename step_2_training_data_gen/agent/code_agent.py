@@ -10,6 +10,7 @@ from agent.script_utils.ui_apis import CodeConfig, CodeStatus, Verifier, regener
 from agent.script_utils.bug_processor import BugProcessorV3
 from agent.script_utils.solution_generator import SolutionGenerator
 from agent.script_utils.api_doc import ApiDoc
+from agent.script_utils.doc_registry import doc_registry
 from agent.script_utils.err import XPathError
 
 
@@ -98,7 +99,8 @@ class CodeAgent():
       raise ValueError(f'Unknown doc path: {doc_path}')
 
     self.app_name = app_name
-    self.doc = ApiDoc(doc_path)
+    # the doc is shared with the agents of other tasks, the fork keeps the xpaths fixed in this run
+    self.doc = doc_registry.get_api_doc(doc_path, app_name).fork()
     self.save_dir = save_path
     if not os.path.exists(self.save_dir):
       os.makedirs(self.save_dir)
@@ -135,6 +137,8 @@ class CodeAgent():
       # 'name': self.task_name,
     }
     runtime = []
+    # the reset before the task, the resets before retries are added as they happen
+    reset_times = self.env.pop_reset_times()
     
     app_doc = self.doc
     err = None
@@ -209,7 +213,8 @@ class CodeAgent():
         runtime.append({
             'total': t2 - t0,
             'solution': t1 - t0,
-            'execution': t2 - t1
+            'execution': t2 - t1,
+            'reset': reset_times + self.env.pop_reset_times()
         })
         break
       except Exception as e:
@@ -221,6 +226,9 @@ class CodeAgent():
         error_path = os.path.join(self.save_path, f'error.json')
         tools.dump_json_file(error_path, error_info)
         err = e
+    if not done:
+      # a failed task has no timing of a successful run, only the times of its resets
+      runtime.append({'reset': reset_times + self.env.pop_reset_times()})
     
     result = {
       'is_completed': done,
@@ -4,6 +4,7 @@ import logging
 import re
 import shlex
 from .adapter import Adapter
+from .adb_transport import ADBCommandSentException, ADBTransportException, get_default_transport
 import time
 try:
     from shlex import quote # Python 3
@@ -33,11 +34,12 @@ class ADB(Adapter):
     RO_SECURE_PROPERTY = 'ro.secure'
     RO_DEBUGGABLE_PROPERTY = 'ro.debuggable'
 
-    def __init__(self, device=None):
+    def __init__(self, device=None, use_transport=True):
         """
         initiate a ADB connection from serial no
         the serial no should be in output of `adb devices`
         :param device: instance of Device
+        :param use_transport: talk to the adb server through pooled sockets instead of spawning adb processes
         :return:
         """
         self.logger = logging.getLogger(self.__class__.__name__)
@@ -47,6 +49,7 @@ class ADB(Adapter):
         self.device = device
 
         self.cmd_prefix = ['adb', "-s", device.serial]
+        self.transport = get_default_transport() if use_transport else None
 
     def run_cmd(self, extra_args):
         """
@@ -66,13 +69,38 @@ class ADB(Adapter):
 
         self.logger.debug('command:')
         self.logger.debug(args)
-        r = subprocess.check_output(args).strip()
+        r = self.__run_cmd_via_transport(extra_args)
+        if r is None:
+            r = subprocess.check_output(args).strip()
         if not isinstance(r, str):
             r = r.decode()
         self.logger.debug('return:')
         self.logger.debug(r)
         return r
 
+    def __run_cmd_via_transport(self, extra_args):
+        """
+        run an adb command through the pooled adb server connection
+        @param extra_args: arguments to run in adb
+        @return: output of adb command, None if the command has to go through the adb binary
+        """
+        if self.transport is None or not extra_args:
+            return None
+        try:
+            if extra_args[0] == 'shell' and len(extra_args) > 1:
+                r, exit_code = self.transport.shell(self.device.serial, " ".join(extra_args[1:]))
+                if exit_code != 0:
+                    raise subprocess.CalledProcessError(exit_code, self.cmd_prefix + extra_args, output=r)
+                return r.strip()
+            if extra_args == ['get-state']:
+                return self.transport.get_state(self.device.serial).strip()
+        except ADBCommandSentException as e:
+            # the command may have run, running it again through the adb binary could repeat e.g. a tap or pm clear
+            raise ADBException("adb transport failed after sending %s: %s" % (extra_args, e))
+        except ADBTransportException as e:
+            self.logger.debug("adb transport failed, falling back to adb binary: %s" % e)
+        return None
+
     def shell(self, extra_args):
         """
         run an `adb shell` command
@@ -89,6 +117,29 @@ class ADB(Adapter):
         shell_extra_args = ['shell'] + [ quote(arg) for arg in extra_args ]
         return self.run_cmd(shell_extra_args)
 
+    def exec_out(self, extra_args):
+        """
+        run an `adb exec-out` command, the raw output is not decoded nor stripped
+        @param extra_args:
+        @return: bytes, output of the command
+        """
+        if isinstance(extra_args, str):
+            extra_args = shlex.split(extra_args)
+        if not isinstance(extra_args, list):
+            msg = "invalid arguments: %s\nshould be list or str, %s given" % (extra_args, type(extra_args))
+            self.logger.warning(msg)
+            raise ADBException(msg)
+
+        command = " ".join([quote(arg) for arg in extra_args])
+        if self.transport is not None:
+            try:
+                return self.transport.open_service(self.device.serial, "exec:%s" % command)
+            except ADBCommandSentException as e:
+                raise ADBException("adb transport failed after sending %s: %s" % (command, e))
+            except ADBTransportException as e:
+                self.logger.debug("adb transport failed, falling back to adb binary: %s" % e)
+        return subprocess.check_output(self.cmd_prefix + ["exec-out", command])
+
     def check_connectivity(self):
         """
         check if adb is connected
@@ -107,6 +158,8 @@ class ADB(Adapter):
         """
         disconnect adb
         """
+        if self.transport is not None:
+            self.transport.close(self.device.serial)
         print("[CONNECTION] %s is disconnected" % self.__class__.__name__)
 
     def get_property(self, property_name):
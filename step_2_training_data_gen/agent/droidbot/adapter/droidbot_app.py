@@ -4,6 +4,7 @@ import subprocess
 import time
 import json
 import struct
+import threading
 import traceback
 from .adapter import Adapter
 
@@ -52,6 +53,10 @@ class DroidBotAppConn(Adapter):
 
         self.sock = None
         self.last_acc_event = None
+        # every accessibility event means the window or its content changed
+        self.last_acc_event_time = None
+        self.acc_event_count = 0
+        self.__acc_event_cond = threading.Condition()
         self.enable_accessibility_hard = device.enable_accessibility_hard
         self.ignore_ad = device.ignore_ad
         if self.ignore_ad:
@@ -159,6 +164,10 @@ class DroidBotAppConn(Adapter):
                 self.logger.warning("Invalid data before packet head: " + message[:acc_event_idx])
             body = json.loads(message[acc_event_idx + len("AccEvent >>> "):])
             self.last_acc_event = body
+            with self.__acc_event_cond:
+                self.last_acc_event_time = time.monotonic()
+                self.acc_event_count += 1
+                self.__acc_event_cond.notify_all()
             return
 
         rotation_idx = message.find("rotation >>> ")
@@ -171,6 +180,35 @@ class DroidBotAppConn(Adapter):
         self.logger.warning("Unhandled message from droidbot app: " + message)
         raise DroidBotAppConnException()
 
+    def wait_for_idle(self, idle_time, timeout, settle_time=0):
+        """
+        wait until no accessibility event has been received for idle_time seconds, counted from now.
+        the first event after an action may come later than idle_time, so until an event is received
+        the UI is only considered idle after settle_time seconds without events
+        :param idle_time: seconds without events for the UI to be considered idle
+        :param timeout: maximum seconds to wait
+        :param settle_time: seconds without any event since the call for the UI to be considered idle
+        :return: True if the UI became idle, False on timeout or if the app is not connected
+        """
+        if not self.connected:
+            return False
+        start_time = time.monotonic()
+        deadline = start_time + timeout
+        with self.__acc_event_cond:
+            while self.connected:
+                last_event_time = self.last_acc_event_time
+                if last_event_time is None or last_event_time < start_time:
+                    idle_at = start_time + max(idle_time, settle_time)
+                else:
+                    idle_at = last_event_time + idle_time
+                now = time.monotonic()
+                if now >= idle_at:
+                    return True
+                if now >= deadline:
+                    return False
+                self.__acc_event_cond.wait(min(idle_at, deadline) - now)
+        return False
+
     def check_connectivity(self):
         """
         check if droidbot app is connected
@@ -0,0 +1,228 @@
+# A stand-in for the adb server that ADBTransport can be pointed at without a device or an adb binary:
+#   python -m agent.droidbot.adapter.fake_adb_server
+# It serves host-serial:<serial>:features, host-serial:<serial>:get-state, host:transport:<serial>,
+# shell,v2,raw:, shell: and exec:, the device commands are run with the local sh.
+import logging
+import socket
+import socketserver
+import struct
+import subprocess
+import threading
+import types
+
+from .adb import ADB, ADBException
+from .adb_transport import ADBCommandSentException, ADBTransport, \
+    SHELL_ID_STDIN, SHELL_ID_STDOUT, SHELL_ID_STDERR, SHELL_ID_EXIT, SHELL_ID_CLOSE_STDIN
+
+FAKE_SERIAL = "emulator-5554"
+FAKE_FEATURES = ("shell_v2", "cmd")
+
+
+class FakeADBServer(object):
+    """
+    a threaded fake adb server on a free local port
+    """
+
+    def __init__(self, serial=FAKE_SERIAL, features=FAKE_FEATURES, chunk_size=None):
+        """
+        :param serial: the serial of the only device
+        :param features: the features reported for the device, without shell_v2 the device is a legacy one
+        :param chunk_size: split the output into packets of at most chunk_size bytes, e.g. 1 to split the exit marker
+        """
+        self.serial = serial
+        self.features = features
+        self.chunk_size = chunk_size
+        # the shell sessions are closed when they have received this many command lines in total, before running it
+        self.drop_after_commands = None
+        # the command lines received by the shell sessions and the commands of the one-shot services
+        self.commands = []
+        self.__lock = threading.Lock()
+        self.__session_socks = []
+        self.__server = None
+
+    @property
+    def port(self):
+        return self.__server.server_address[1]
+
+    def start(self):
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                try:
+                    server._handle(self.request)
+                except (EOFError, socket.error):
+                    # the client closed the connection
+                    pass
+
+        self.__server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.__server.daemon_threads = True
+        threading.Thread(target=self.__server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.close_sessions()
+        self.__server.shutdown()
+        self.__server.server_close()
+
+    def close_sessions(self):
+        """
+        close the open shell sessions, as a restart of the adb server does
+        """
+        with self.__lock:
+            socks, self.__session_socks = self.__session_socks, []
+        for sock in socks:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def _handle(self, sock):
+        request = _read_request(sock)
+        if request == "host-serial:%s:features" % self.serial:
+            return _write_okay(sock, ",".join(self.features))
+        if request == "host-serial:%s:get-state" % self.serial:
+            return _write_okay(sock, "device")
+        if request != "host:transport:%s" % self.serial:
+            return _write_fail(sock, "device '%s' not found" % request.split(":")[-1])
+        sock.sendall(b"OKAY")
+
+        request = _read_request(sock)
+        if request == "shell,v2,raw:" and "shell_v2" in self.features:
+            sock.sendall(b"OKAY")
+            return self._run_shell_session(sock)
+        if request.startswith("shell:") or request.startswith("exec:"):
+            sock.sendall(b"OKAY")
+            command = request.split(":", 1)[1]
+            self.commands.append(command)
+            sock.sendall(subprocess.run(["sh", "-c", command], stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT).stdout)
+            return
+        _write_fail(sock, "unknown service %s" % request)
+
+    def _run_shell_session(self, sock):
+        with self.__lock:
+            self.__session_socks.append(sock)
+        process = subprocess.Popen(["sh"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        write_lock = threading.Lock()
+
+        def pump(stream, packet_id):
+            for data in iter(lambda: stream.read1(65536), b""):
+                chunk_size = self.chunk_size or len(data)
+                for i in range(0, len(data), chunk_size):
+                    with write_lock:
+                        _write_packet(sock, packet_id, data[i:i + chunk_size])
+
+        pumps = [threading.Thread(target=pump, args=(process.stdout, SHELL_ID_STDOUT), daemon=True),
+                 threading.Thread(target=pump, args=(process.stderr, SHELL_ID_STDERR), daemon=True)]
+        for thread in pumps:
+            thread.start()
+        try:
+            while True:
+                packet_id, data = _read_packet(sock)
+                if packet_id == SHELL_ID_CLOSE_STDIN:
+                    process.stdin.close()
+                    for thread in pumps:
+                        thread.join()
+                    with write_lock:
+                        _write_packet(sock, SHELL_ID_EXIT, bytes([process.wait() & 0xff]))
+                    return
+                if packet_id != SHELL_ID_STDIN:
+                    continue
+                with self.__lock:
+                    self.commands.append(data.decode())
+                    drop = self.drop_after_commands is not None and len(self.commands) >= self.drop_after_commands
+                if drop:
+                    sock.shutdown(socket.SHUT_RDWR)
+                    return
+                process.stdin.write(data)
+                process.stdin.flush()
+        finally:
+            if process.poll() is None:
+                process.kill()
+
+
+def _read_exactly(sock, length):
+    buf = b""
+    while len(buf) < length:
+        pkt = sock.recv(length - len(buf))
+        if not pkt:
+            raise EOFError()
+        buf += pkt
+    return buf
+
+
+def _read_request(sock):
+    return _read_exactly(sock, int(_read_exactly(sock, 4), 16)).decode()
+
+
+def _write_okay(sock, message):
+    message = message.encode()
+    sock.sendall(b"OKAY" + b"%04x" % len(message) + message)
+
+
+def _write_fail(sock, message):
+    message = message.encode()
+    sock.sendall(b"FAIL" + b"%04x" % len(message) + message)
+
+
+def _read_packet(sock):
+    packet_id, length = struct.unpack("<BI", _read_exactly(sock, 5))
+    return packet_id, _read_exactly(sock, length)
+
+
+def _write_packet(sock, packet_id, data):
+    sock.sendall(struct.pack("<BI", packet_id, len(data)) + data)
+
+
+def check_transport():
+    """
+    run ADBTransport and the ADB adapter against the fake server
+    """
+    server = FakeADBServer(chunk_size=1).start()
+    transport = ADBTransport(port=server.port)
+    try:
+        assert transport.get_features(FAKE_SERIAL) == set(FAKE_FEATURES)
+        assert transport.get_state(FAKE_SERIAL) == "device"
+
+        # the marker and the exit code arrive one byte per packet, stderr is not part of the output
+        assert transport.shell(FAKE_SERIAL, "echo hello; echo oops >&2") == (b"hello\n", 0)
+        assert transport.shell(FAKE_SERIAL, "printf 'no newline'; exit 3") == (b"no newline", 3)
+        assert transport.shell(FAKE_SERIAL, "printf '__droidbot_eoc_'") == (b"__droidbot_eoc_", 0)
+
+        # an idle session of a restarted adb server is not used, the command runs once on a new session
+        server.close_sessions()
+        del server.commands[:]
+        assert transport.shell(FAKE_SERIAL, "echo again") == (b"again\n", 0)
+        assert len(server.commands) == 1
+
+        # a session that is lost after the command was sent is not retried through the adb binary
+        adb = ADB(types.SimpleNamespace(serial=FAKE_SERIAL), use_transport=False)
+        adb.transport = transport
+        assert adb.shell("echo ok") == "ok"
+        server.drop_after_commands = len(server.commands) + 1
+        try:
+            adb.shell(["input", "tap", "1", "2"])
+            raise AssertionError("the lost command did not fail")
+        except ADBException as e:
+            assert isinstance(e.__context__, ADBCommandSentException)
+        assert len(server.commands) == server.drop_after_commands
+    finally:
+        transport.close()
+        server.stop()
+
+    legacy_server = FakeADBServer(features=("cmd",)).start()
+    transport = ADBTransport(port=legacy_server.port)
+    try:
+        # legacy devices run one-shot shell: services without an exit code
+        assert transport.shell(FAKE_SERIAL, "echo legacy; exit 3") == (b"legacy\n", 0)
+        assert transport.open_service(FAKE_SERIAL, "exec:printf raw") == b"raw"
+    finally:
+        transport.close()
+        legacy_server.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    check_transport()
+    print("the adb transport works with the fake adb server")
@@ -1,6 +1,6 @@
 import logging
 import os
-import hashlib
+from .app_cache import get_default_app_cache, get_file_hashes
 from .intent import Intent
 
 
@@ -9,10 +9,11 @@ class App(object):
     this class describes an app
     """
 
-    def __init__(self, app_path, output_dir=None):
+    def __init__(self, app_path, output_dir=None, metadata_cache=None):
         """
         create an App instance
         :param app_path: local file path of app
+        :param metadata_cache: AppMetadataCache to read the apk metadata from, the default cache if None
         :return:
         """
         assert app_path is not None
@@ -25,17 +26,30 @@ class App(object):
             if not os.path.isdir(output_dir):
                 os.makedirs(output_dir)
 
-        from androguard.core.apk import APK
-        # from androguard.core.bytecodes.apk import APK
-        self.apk = APK(self.app_path)
-        self.package_name = self.apk.get_package()
-        self.app_name = self.apk.get_app_name()
-        self.main_activity = self.apk.get_main_activity()
-        self.permissions = self.apk.get_permissions()
-        self.activities = self.apk.get_activities()
+        if metadata_cache is None:
+            metadata_cache = get_default_app_cache()
+        metadata = metadata_cache.get(self.app_path)
+        self.__apk = None
+        self.package_name = metadata["package_name"]
+        self.app_name = metadata["app_name"]
+        self.main_activity = metadata["main_activity"]
+        self.permissions = metadata["permissions"]
+        self.activities = metadata["activities"]
+        self.__broadcasts = metadata["broadcasts"]
         self.possible_broadcasts = self.get_possible_broadcasts()
         self.dumpsys_main_activity = None
-        self.hashes = self.get_hashes()
+        self.hashes = metadata["hashes"]
+
+    @property
+    def apk(self):
+        """
+        the androguard APK, only parsed when accessed
+        """
+        if self.__apk is None:
+            from androguard.core.apk import APK
+            # from androguard.core.bytecodes.apk import APK
+            self.__apk = APK(self.app_path)
+        return self.__apk
 
     def get_package_name(self):
         """
@@ -88,15 +102,9 @@ class App(object):
 
     def get_possible_broadcasts(self):
         possible_broadcasts = set()
-        for receiver in self.apk.get_receivers():
-            intent_filters = self.apk.get_intent_filters('receiver', receiver)
-            actions = intent_filters['action'] if 'action' in intent_filters else []
-            categories = intent_filters['category'] if 'category' in intent_filters else []
-            categories.append(None)
-            for action in actions:
-                for category in categories:
-                    intent = Intent(prefix='broadcast', action=action, category=category)
-                    possible_broadcasts.add(intent)
+        for action, category in self.__broadcasts:
+            intent = Intent(prefix='broadcast', action=action, category=category)
+            possible_broadcasts.add(intent)
         return possible_broadcasts
 
     def get_hashes(self, block_size=2 ** 8):
@@ -105,15 +113,4 @@ class App(object):
         hashes of APK input file
         @param block_size:
         """
-        md5 = hashlib.md5()
-        sha1 = hashlib.sha1()
-        sha256 = hashlib.sha256()
-        f = open(self.app_path, 'rb')
-        while True:
-            data = f.read(block_size)
-            if not data:
-                break
-            md5.update(data)
-            sha1.update(data)
-            sha256.update(data)
-        return [md5.hexdigest(), sha1.hexdigest(), sha256.hexdigest()]
+        return get_file_hashes(self.app_path, block_size)
@@ -0,0 +1,183 @@
+# An on-disk cache of the metadata App reads from an apk, so that androguard only parses each apk once.
+# Pre-warm it for a directory of apks with:
+#   python -m agent.droidbot.app_cache evaluation/llama_touch/apks
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+
+# bump when the cached fields change
+APP_CACHE_VERSION = 1
+DEFAULT_APP_CACHE_DIR = os.environ.get("DROIDBOT_APP_CACHE_DIR",
+                                       os.path.join(os.path.expanduser("~"), ".cache", "droidbot", "apps"))
+HASH_BLOCK_SIZE = 2 ** 20
+
+
+def get_file_hashes(file_path, block_size=HASH_BLOCK_SIZE):
+    """
+    calculate the MD5, SHA-1 and SHA-256 hashes of a file in one pass
+    :return: [md5, sha1, sha256], hex digests
+    """
+    md5 = hashlib.md5()
+    sha1 = hashlib.sha1()
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while True:
+            data = f.read(block_size)
+            if not data:
+                break
+            md5.update(data)
+            sha1.update(data)
+            sha256.update(data)
+    return [md5.hexdigest(), sha1.hexdigest(), sha256.hexdigest()]
+
+
+def parse_apk_metadata(app_path, hashes=None):
+    """
+    parse an apk with androguard
+    :param app_path: local file path of the apk
+    :param hashes: the hashes of the apk if already known
+    :return: dict of the metadata used by App
+    """
+    from androguard.core.apk import APK
+    apk = APK(app_path)
+    broadcasts = []
+    for receiver in apk.get_receivers():
+        intent_filters = apk.get_intent_filters('receiver', receiver)
+        actions = intent_filters['action'] if 'action' in intent_filters else []
+        categories = intent_filters['category'] if 'category' in intent_filters else []
+        categories.append(None)
+        for action in actions:
+            for category in categories:
+                if [action, category] not in broadcasts:
+                    broadcasts.append([action, category])
+    return {
+        "version": APP_CACHE_VERSION,
+        "package_name": apk.get_package(),
+        "app_name": apk.get_app_name(),
+        "main_activity": apk.get_main_activity(),
+        "permissions": list(apk.get_permissions()),
+        "activities": list(apk.get_activities()),
+        "broadcasts": broadcasts,
+        "hashes": hashes if hashes is not None else get_file_hashes(app_path),
+    }
+
+
+class AppMetadataCache(object):
+    """
+    apk metadata stored as json files in cache_dir.
+    Entries are found by path, size and mtime first, and by the content hash when the file was copied or touched.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_APP_CACHE_DIR):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _get_stat_key(app_path):
+        stat = os.stat(app_path)
+        key = "%s|%d|%d" % (os.path.abspath(app_path), stat.st_size, stat.st_mtime_ns)
+        return hashlib.md5(key.encode()).hexdigest()
+
+    def _get_entry_path(self, kind, key):
+        return os.path.join(self.cache_dir, kind, "%s.json" % key)
+
+    def _load(self, kind, key):
+        entry_path = self._get_entry_path(kind, key)
+        if not os.path.exists(entry_path):
+            return None
+        try:
+            with open(entry_path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError) as e:
+            self.logger.warning("ignoring broken app cache entry %s: %s" % (entry_path, e))
+            return None
+        if entry.get("version") != APP_CACHE_VERSION:
+            return None
+        return entry
+
+    def _store(self, kind, key, entry):
+        entry_path = self._get_entry_path(kind, key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        # write to a temp file first, parallel workers may read the entry at the same time
+        temp_path = "%s.%d.%d.tmp" % (entry_path, os.getpid(), threading.get_ident())
+        with open(temp_path, "w") as f:
+            json.dump(entry, f)
+        os.replace(temp_path, entry_path)
+
+    def get(self, app_path):
+        """
+        get the metadata of an apk, parsing it only if it is not cached yet
+        :param app_path: local file path of the apk
+        :return: dict, see parse_apk_metadata
+        """
+        stat_key = self._get_stat_key(app_path)
+        stat_entry = self._load("by_stat", stat_key)
+        if stat_entry is not None:
+            metadata = self._load("by_content", stat_entry["sha256"])
+            if metadata is not None:
+                self.hits += 1
+                return metadata
+
+        hashes = get_file_hashes(app_path)
+        metadata = self._load("by_content", hashes[2])
+        if metadata is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.logger.info("parsing %s" % app_path)
+            metadata = parse_apk_metadata(app_path, hashes)
+            self._store("by_content", hashes[2], metadata)
+        self._store("by_stat", stat_key, {"version": APP_CACHE_VERSION, "sha256": hashes[2]})
+        return metadata
+
+    def prewarm(self, apk_dir):
+        """
+        cache the metadata of all apks under a directory
+        :return: list of the apk paths
+        """
+        apk_paths = []
+        for root, _, file_names in os.walk(apk_dir):
+            for file_name in sorted(file_names):
+                if not file_name.lower().endswith(".apk"):
+                    continue
+                apk_path = os.path.join(root, file_name)
+                try:
+                    metadata = self.get(apk_path)
+                    print("%s: %s" % (apk_path, metadata["package_name"]))
+                    apk_paths.append(apk_path)
+                except Exception as e:
+                    self.logger.warning("failed to cache %s: %s" % (apk_path, e))
+        return apk_paths
+
+
+_default_app_cache = None
+
+
+def get_default_app_cache():
+    global _default_app_cache
+    if _default_app_cache is None:
+        _default_app_cache = AppMetadataCache()
+    return _default_app_cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-warm the apk metadata cache for a directory of apks.")
+    parser.add_argument("apk_dir", help="directory searched recursively for .apk files, e.g. BASE_APKS_PATH")
+    parser.add_argument("-c", "--cache_dir", default=DEFAULT_APP_CACHE_DIR,
+                        help="cache directory, default: %s (env DROIDBOT_APP_CACHE_DIR)" % DEFAULT_APP_CACHE_DIR)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    cache = AppMetadataCache(args.cache_dir)
+    apk_paths = cache.prewarm(args.apk_dir)
+    print("%d apks cached in %s (%d parsed, %d already cached)" %
+          (len(apk_paths), args.cache_dir, cache.misses, cache.hits))
+
+
+if __name__ == "__main__":
+    main()
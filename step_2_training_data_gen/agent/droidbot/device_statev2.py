@@ -36,7 +36,7 @@ class DeviceState(object):
         self.text_representation = self.get_text_representation()
         self.possible_events = None
         if self.device is not None:
-            self.width = device.get_width(refresh=True)
+            self.width = device.get_width(refresh=False)
             self.height = device.get_height(refresh=False)
             self.is_popup = self.is_popup_window()
             self.parent_state = None
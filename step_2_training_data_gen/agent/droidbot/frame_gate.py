@@ -0,0 +1,83 @@
+import io
+import logging
+
+# side of the grayscale thumbnail that frames are compared on, a cell covers about 17x38 pixels of a 1080x2400 screen
+FRAME_THUMBNAIL_SIZE = 64
+# absolute difference (0-255) of any thumbnail cell above which the screen is considered changed.
+# a small change, e.g. a checked checkbox or a new line of text, changes a few cells by 30 or more,
+# the jpeg noise of an unchanged screen changes them by 1 or 2
+FRAME_DIFF_THRESHOLD = 8
+
+
+class FrameDiffGate(object):
+    """
+    a cheap check of whether the screen changed since the last accepted state,
+    so that the view hierarchy is only fetched and parsed again when the pixels changed
+    """
+
+    def __init__(self, thumbnail_size=FRAME_THUMBNAIL_SIZE, threshold=FRAME_DIFF_THRESHOLD):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.thumbnail_size = thumbnail_size
+        self.threshold = threshold
+        # number of hierarchy dumps skipped and performed
+        self.skipped = 0
+        self.performed = 0
+        self.__last_frame = None
+        self.__last_thumbnail = None
+
+    def get_thumbnail(self, frame):
+        """
+        decode a frame into a small grayscale thumbnail
+        :param frame: bytes, an encoded image
+        :return: PIL.Image.Image
+        """
+        from PIL import Image
+        image = Image.open(io.BytesIO(frame))
+        # let the jpeg decoder downscale while decoding
+        image.draft("L", (self.thumbnail_size * 8, self.thumbnail_size * 8))
+        return image.convert("L").resize((self.thumbnail_size, self.thumbnail_size), Image.BILINEAR)
+
+    def is_changed(self, frame):
+        """
+        compare a frame with the frame of the last accepted state
+        :param frame: bytes or None
+        :return: True if the screen changed or if it cannot be told
+        """
+        if frame is None or self.__last_thumbnail is None:
+            return True
+        if frame is self.__last_frame:
+            return False
+        from PIL import ImageChops
+        try:
+            thumbnail = self.get_thumbnail(frame)
+        except Exception as e:
+            self.logger.warning("failed to decode frame: %s" % e)
+            return True
+        # the largest cell difference, a mean over the screen hides a small change
+        diff = ImageChops.difference(thumbnail, self.__last_thumbnail).getextrema()[1]
+        return diff > self.threshold
+
+    def accept(self, frame):
+        """
+        remember the frame that the latest state was acquired on
+        :param frame: bytes or None
+        """
+        self.performed += 1
+        self.__last_frame = frame
+        self.__last_thumbnail = None
+        if frame is None:
+            return
+        try:
+            self.__last_thumbnail = self.get_thumbnail(frame)
+        except Exception as e:
+            self.logger.warning("failed to decode frame: %s" % e)
+
+    def skip(self):
+        self.skipped += 1
+
+    def reset(self):
+        self.__last_frame = None
+        self.__last_thumbnail = None
+
+    def get_counters(self):
+        return {"skipped": self.skipped, "performed": self.performed}
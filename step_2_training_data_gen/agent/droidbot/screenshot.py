@@ -0,0 +1,102 @@
+import io
+import os
+import threading
+from datetime import datetime
+
+
+class Screenshot(object):
+    """
+    a screenshot of the device, captured into memory on first access and written to disk only when a path is needed
+    """
+
+    def __init__(self, device, tag=None):
+        """
+        :param device: instance of Device
+        :param tag: str, used to name the image file, the current time by default
+        """
+        self.device = device
+        if tag is None:
+            tag = datetime.now().strftime("%Y-%m-%d_%H%M%S")
+        self.tag = tag
+        self.__data = None
+        self.__format = None
+        self.__path = None
+        self.__lock = threading.Lock()
+
+    def capture(self):
+        """
+        capture the screen if it has not been captured yet
+        :return: bytes, the encoded image
+        """
+        with self.__lock:
+            if self.__data is None:
+                self.__data, self.__format = self.device.capture_screenshot()
+        return self.__data
+
+    @property
+    def data(self):
+        return self.capture()
+
+    @property
+    def format(self):
+        """
+        "png" for screencap, "jpg" for minicap frames
+        """
+        self.capture()
+        return self.__format
+
+    @property
+    def path(self):
+        """
+        the image file in the temp dir of the device output, written on first access
+        """
+        if self.__path is None:
+            self.__path = self.save()
+        return self.__path
+
+    def get_image(self, max_size=None):
+        """
+        decode the screenshot
+        :param max_size: if given, downscale the image so that its longer side is at most max_size
+        :return: PIL.Image.Image
+        """
+        from PIL import Image
+        image = Image.open(io.BytesIO(self.data))
+        if max_size is not None:
+            image.thumbnail((max_size, max_size))
+        return image
+
+    def save(self, image_path=None, name=None, image_format=None, max_size=None, quality=85):
+        """
+        write the screenshot to a file
+        :param image_path: directory of the image, <output_dir>/temp by default
+        :param name: file name without extension, screen_<tag> by default
+        :param image_format: "png" or "jpg", None to keep the captured format
+        :param max_size: if given, downscale the image so that its longer side is at most max_size
+        :param quality: jpeg quality, only used when the image is re-encoded
+        :return: path of the image file
+        """
+        local_image_dir = image_path if image_path is not None else os.path.join(self.device.output_dir, "temp")
+        if not os.path.exists(local_image_dir):
+            os.makedirs(local_image_dir)
+
+        image_format = image_format if image_format is not None else self.format
+        image_name = "%s.%s" % (name if name is not None else "screen_%s" % self.tag, image_format)
+        local_image_path = os.path.join(local_image_dir, image_name)
+
+        if image_format == self.format and max_size is None:
+            with open(local_image_path, 'wb') as local_image_file:
+                local_image_file.write(self.data)
+        else:
+            image = self.get_image(max_size=max_size)
+            if image_format == "jpg":
+                image.convert("RGB").save(local_image_path, "JPEG", quality=quality)
+            else:
+                image.save(local_image_path, "PNG")
+        return local_image_path
+
+    def __fspath__(self):
+        return self.path
+
+    def __str__(self):
+        return self.path
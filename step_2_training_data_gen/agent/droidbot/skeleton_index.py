@@ -0,0 +1,96 @@
+import collections
+import threading
+
+# skeletons whose screen was looked up, by skeleton hash
+SCREEN_CACHE_SIZE = 1024
+# a screen is only identified by its common structure if it has more tags than this
+MIN_COMMON_COUNT = 3
+
+
+def get_path_keys(skeleton):
+    """
+    key each node under the first top-level tag by its path from that tag, i.e. the tags and the child positions.
+    HTMLSkeleton.extract_common_skeleton pairs the children by position and keeps a pair if the tags are equal, so
+    the common structure of two skeletons has one tag for every key they share, and count() of it is the number of
+    shared keys less the top-level tag.
+    :param skeleton: HTMLSkeleton
+    :return: set of int
+    """
+    if not skeleton.root[3]:
+        return set()
+    top = skeleton.root[3][0]
+    keys = set()
+    stack = [(hash((top[1],)), top)]
+    while stack:
+        key, node = stack.pop()
+        keys.add(key)
+        for position, child in enumerate(node[3]):
+            stack.append((hash((key, position, child[1])), child))
+    return keys
+
+
+class SkeletonIndex(object):
+    """
+    finds the screen whose skeleton has the largest common structure with a skeleton, like comparing the skeleton
+    with extract_common_skeleton to the skeleton of every screen, but from an inverted index of the path keys of
+    the screens, so that only the screens that share a structure with the skeleton are counted
+    """
+
+    def __init__(self, min_count=MIN_COMMON_COUNT, cache_size=SCREEN_CACHE_SIZE):
+        self.min_count = min_count
+        self.cache_size = cache_size
+        self.screen_names = []
+        # path key -> ids of the screens with the key, in the order the screens were added
+        self.postings = {}
+        # skeleton hash -> screen name, least recently used first. the index may be shared by threads, see
+        # doc_registry, so the cache is locked
+        self.cache = collections.OrderedDict()
+        self.cache_lock = threading.Lock()
+
+    def add(self, screen_name, skeleton):
+        """
+        :param screen_name: str
+        :param skeleton: HTMLSkeleton of the screen
+        """
+        screen_id = len(self.screen_names)
+        self.screen_names.append(screen_name)
+        for key in get_path_keys(skeleton):
+            self.postings.setdefault(key, []).append(screen_id)
+        self.cache.clear()
+
+    def get_common_counts(self, skeleton):
+        """
+        :param skeleton: HTMLSkeleton
+        :return: dict, screen id -> count() of the common structure of the skeleton and the screen,
+            screens without a common structure are left out
+        """
+        counts = collections.Counter()
+        for key in get_path_keys(skeleton):
+            counts.update(self.postings.get(key, ()))
+        # the top-level tag is not counted
+        return {screen_id: count - 1 for screen_id, count in counts.items() if count > 1}
+
+    def find(self, skeleton):
+        """
+        :param skeleton: HTMLSkeleton
+        :return: the name of the first screen with the largest common structure if it has more than min_count tags,
+            otherwise None
+        """
+        with self.cache_lock:
+            if skeleton.hash in self.cache:
+                self.cache.move_to_end(skeleton.hash)
+                return self.cache[skeleton.hash]
+
+        screen_name = None
+        best_count, best_id = self.min_count, None
+        for screen_id, count in self.get_common_counts(skeleton).items():
+            if count > best_count or (count == best_count and best_id is not None and screen_id < best_id):
+                best_count, best_id = count, screen_id
+        if best_id is not None:
+            screen_name = self.screen_names[best_id]
+
+        with self.cache_lock:
+            self.cache[skeleton.hash] = screen_name
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return screen_name
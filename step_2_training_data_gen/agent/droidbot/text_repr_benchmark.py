@@ -0,0 +1,152 @@
+# Time DeviceState.get_text_representation on recorded states, i.e. the states/state_*.json files droidbot writes.
+#   python -m agent.droidbot.text_repr_benchmark ../step_1_doc_generation/data
+# Without recorded states, synthetic long list screens are used.
+import argparse
+import copy
+import glob
+import json
+import os
+import statistics
+import time
+
+from .device_state import DeviceState
+
+DEFAULT_STATES_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "..", "..",
+                                                  "step_1_doc_generation", "data"))
+# view properties DeviceState derives and stores in the views, they are dropped so that every run starts from scratch
+DERIVED_VIEW_KEYS = ('signature', 'content_free_signature', 'view_str', 'view_structure', 'bound_box', 'depth',
+                     'allowed_actions', 'status', 'local_id', 'full_desc', 'desc')
+SYNTHETIC_ROWS = (50, 200, 1000)
+# wrapper layouts between the root and the list, as on a typical app screen
+SYNTHETIC_WRAPPER_DEPTH = 12
+
+
+def load_recorded_states(states_dir):
+    """
+    :param states_dir: directory searched recursively for states/state_*.json
+    :return: list of (name, state dict)
+    """
+    states = []
+    pattern = os.path.join(states_dir, "**", "states", "state_*.json")
+    for state_path in sorted(glob.glob(pattern, recursive=True)):
+        with open(state_path) as f:
+            state = json.load(f)
+        if state.get("views"):
+            states.append((os.path.relpath(state_path, states_dir), state))
+    return states
+
+
+def make_list_screen(num_rows, wrapper_depth=SYNTHETIC_WRAPPER_DEPTH):
+    """
+    make the state of a screen with a long list, each row is a clickable layout with an icon, two texts and a checkbox
+    :return: state dict in the format of DeviceState.to_dict
+    """
+    views = []
+
+    def add_view(parent, class_name, bounds, **properties):
+        view = {'temp_id': len(views), 'parent': parent, 'children': [], 'class': class_name,
+                'resource_id': None, 'text': None, 'content_description': None, 'bounds': bounds,
+                'visible': True, 'enabled': True, 'checked': False, 'selected': False, 'clickable': False,
+                'checkable': False, 'long_clickable': False, 'scrollable': False, 'editable': False,
+                'package': 'com.example.list'}
+        view.update(properties)
+        if parent >= 0:
+            views[parent]['children'].append(view['temp_id'])
+        views.append(view)
+        return view['temp_id']
+
+    screen = [[0, 0], [1080, 2400]]
+    parent = add_view(-1, 'android.widget.FrameLayout', screen)
+    for i in range(wrapper_depth):
+        parent = add_view(parent, 'android.widget.LinearLayout', screen, resource_id='com.example.list:id/wrapper_%d' % i)
+    add_view(parent, 'android.view.View', [[0, 2274], [1080, 2400]], resource_id='android:id/navigationBarBackground')
+    toolbar = add_view(parent, 'android.view.ViewGroup', [[0, 63], [1080, 210]], resource_id='com.example.list:id/toolbar')
+    add_view(toolbar, 'android.widget.ImageButton', [[0, 63], [147, 210]], clickable=True,
+             content_description='Open navigation drawer')
+    add_view(toolbar, 'android.widget.TextView', [[189, 101], [404, 172]], text='Items')
+    add_view(toolbar, 'android.widget.EditText', [[450, 80], [900, 190]], clickable=True, editable=True,
+             text='Search items')
+    recycler = add_view(parent, 'androidx.recyclerview.widget.RecyclerView', [[0, 210], [1080, 2274]],
+                        resource_id='com.example.list:id/list', scrollable=True)
+    for row in range(num_rows):
+        top = 210 + row * 150
+        visible = top < 2274
+        item = add_view(recycler, 'android.widget.LinearLayout', [[0, top], [1080, top + 150]],
+                        resource_id='com.example.list:id/item', clickable=True, long_clickable=True,
+                        visible=visible)
+        add_view(item, 'android.widget.ImageView', [[20, top + 20], [130, top + 130]],
+                 content_description='Avatar' if row % 3 else None, visible=visible)
+        texts = add_view(item, 'android.widget.LinearLayout', [[150, top], [900, top + 150]], visible=visible)
+        add_view(texts, 'android.widget.TextView', [[150, top + 10], [900, top + 80]], text='Item %d' % row,
+                 resource_id='com.example.list:id/title', visible=visible)
+        add_view(texts, 'android.widget.TextView', [[150, top + 80], [900, top + 140]],
+                 text='Details of item %d, ' % row * 4, visible=visible)
+        add_view(item, 'android.widget.CheckBox', [[950, top + 40], [1030, top + 110]], checkable=True,
+                 checked=row % 2 == 0, visible=visible)
+    return {'tag': 'list_%d' % num_rows, 'foreground_activity': 'com.example.list/.MainActivity',
+            'activity_stack': ['com.example.list/.MainActivity'], 'background_services': [], 'views': views}
+
+
+def clean_views(views):
+    views = copy.deepcopy(views)
+    for view in views:
+        for key in DERIVED_VIEW_KEYS:
+            view.pop(key, None)
+    return views
+
+
+def get_max_depth(views):
+    max_depth = 0
+    for view in views:
+        depth = 0
+        parent = view.get('parent', -1)
+        while parent is not None and 0 <= parent < len(views):
+            depth += 1
+            parent = views[parent].get('parent', -1)
+        max_depth = max(max_depth, depth)
+    return max_depth
+
+
+def time_text_representation(state, repeat):
+    """
+    :return: list of seconds, one per run, each on a fresh DeviceState
+    """
+    times = []
+    for _ in range(repeat):
+        device_state = DeviceState(None, clean_views(state['views']), state.get('foreground_activity'),
+                                   state.get('activity_stack'), state.get('background_services'),
+                                   tag=state.get('tag'))
+        start_time = time.perf_counter()
+        device_state.get_text_representation()
+        times.append(time.perf_counter() - start_time)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time DeviceState.get_text_representation on recorded states.")
+    parser.add_argument("states_dir", nargs="?", default=DEFAULT_STATES_DIR,
+                        help="directory searched recursively for states/state_*.json, default: %(default)s")
+    parser.add_argument("-n", "--repeat", type=int, default=5, help="runs per state, the median is reported")
+    parser.add_argument("--synthetic", type=int, nargs="*", default=None, metavar="ROWS",
+                        help="also time synthetic list screens with these numbers of rows, default: %s"
+                             % " ".join(map(str, SYNTHETIC_ROWS)))
+    args = parser.parse_args()
+
+    states = load_recorded_states(args.states_dir)
+    if not states:
+        print("no recorded states in %s, using synthetic list screens" % args.states_dir)
+    if args.synthetic is not None or not states:
+        for num_rows in args.synthetic or SYNTHETIC_ROWS:
+            states.append(("synthetic list, %d rows" % num_rows, make_list_screen(num_rows)))
+
+    total = 0
+    print("%8s %6s %10s  %s" % ("views", "depth", "median ms", "state"))
+    for name, state in states:
+        median = statistics.median(time_text_representation(state, args.repeat))
+        total += median
+        print("%8d %6d %10.2f  %s" % (len(state['views']), get_max_depth(state['views']), median * 1000, name))
+    print("%d states, %.1f ms in total" % (len(states), total * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import copy
+import re
+
+from lxml import etree
+
+from .device_state import get_compiled_xpath
+
+# //*[@resource_id='...' and text()='...'], the XPath form most API docs use
+SIMPLE_XPATH_RE = re.compile(r"//(\*|[A-Za-z_][\w.-]*)\[(.*)\]", re.DOTALL)
+CONDITION_RE = re.compile(r"""\s*(?:@([A-Za-z_][\w.-]*)|(text)\(\))\s*=\s*(?:'([^']*)'|"([^"]*)")\s*""")
+AND_RE = re.compile(r"and\b")
+
+
+def parse_simple_xpath(xpath):
+    """
+    parse an XPath that selects the elements by equality predicates joined with "and"
+    :param xpath: str, e.g. //*[@resource_id='menu_search' and text()='Search']
+    :return: (tag, frozenset of conditions), a condition is ('@<attribute>', value) or ('text()', value),
+        None if the XPath has another form
+    """
+    if not isinstance(xpath, str):
+        return None
+    m = SIMPLE_XPATH_RE.fullmatch(xpath.strip())
+    if not m:
+        return None
+    tag, predicate = m.group(1), m.group(2)
+    conditions = set()
+    pos = 0
+    while True:
+        condition = CONDITION_RE.match(predicate, pos)
+        if not condition:
+            return None
+        attribute, text, single_quoted, double_quoted = condition.groups()
+        value = single_quoted if single_quoted is not None else double_quoted
+        conditions.add(('@' + attribute, value) if attribute else ('text()', value))
+        pos = condition.end()
+        if pos == len(predicate):
+            return tag, frozenset(conditions)
+        and_match = AND_RE.match(predicate, pos)
+        if not and_match:
+            return None
+        pos = and_match.end()
+
+
+class XPathIndex(object):
+    """
+    finds which of many XPaths select something in a tree, e.g. which APIs of a doc screen are on the current screen.
+    XPaths of the form //tag[@attribute='value' and text()='value'] are put in an inverted index of their conditions
+    and answered in one pass over the tree, other XPaths are evaluated with lxml.
+    """
+
+    def __init__(self, xpaths):
+        """
+        :param xpaths: iterable of str
+        """
+        # (condition) -> list of query ids
+        self.index = {}
+        # query id -> (tag, number of conditions, list of the XPaths with these conditions)
+        self.queries = []
+        self.complex_xpaths = []
+        query_ids = {}
+        for xpath in dict.fromkeys(xpaths):
+            parsed = parse_simple_xpath(xpath)
+            if parsed is None or not parsed[1]:
+                self.complex_xpaths.append(xpath)
+                continue
+            query_id = query_ids.get(parsed)
+            if query_id is None:
+                query_id = query_ids[parsed] = len(self.queries)
+                tag, conditions = parsed
+                self.queries.append((tag, len(conditions), []))
+                for condition in conditions:
+                    self.index.setdefault(condition, []).append(query_id)
+            self.queries[query_id][2].append(xpath)
+
+    def match(self, root, elements_only=True):
+        """
+        :param root: the root of an lxml tree, e.g. ElementTree.lxml_root
+        :param elements_only: only count XPaths that select elements, as ElementTree.get_ele_by_xpath does,
+            otherwise XPaths that select text or attributes count too
+        :return: (set of the XPaths that select something, set of the XPaths that failed to evaluate)
+        """
+        matched = set()
+        failed = set()
+        if self.queries:
+            for element in root.iter():
+                if not isinstance(element.tag, str):
+                    continue
+                conditions = {('@' + name, value) for name, value in element.attrib.items()}
+                if element.text is not None:
+                    conditions.add(('text()', element.text))
+                for child in element:
+                    if child.tail is not None:
+                        conditions.add(('text()', child.tail))
+                hits = {}
+                for condition in conditions:
+                    for query_id in self.index.get(condition, ()):
+                        hits[query_id] = hits.get(query_id, 0) + 1
+                for query_id, count in hits.items():
+                    tag, num_conditions, xpaths = self.queries[query_id]
+                    if count == num_conditions and (tag == '*' or tag == element.tag):
+                        matched.update(xpaths)
+
+        for xpath in self.complex_xpaths:
+            try:
+                result = get_compiled_xpath(xpath)(root)
+            except Exception:
+                failed.add(xpath)
+                continue
+            if elements_only:
+                if isinstance(result, list) and result and isinstance(result[0], etree._Element):
+                    matched.add(xpath)
+            elif isinstance(result, (list, str)) and len(result) > 0:
+                matched.add(xpath)
+        return matched, failed
+
+
+class SubtreeView(object):
+    """
+    the subtree under one element of an ElementTree, queried like the ElementTree that extract_subtree builds but
+    without building one: it shares the nodes, the elements and the lxml tree of the ElementTree and returns the
+    EleAttrs of the ElementTree
+    """
+
+    def __init__(self, element_tree, node):
+        """
+        :param element_tree: ElementTree
+        :param node: ElementTree.node, the root of the subtree
+        """
+        self.element_tree = element_tree
+        self.root = node
+        self.lxml_element = element_tree.lxml_elements[node.id]
+        # the subtree copied into a document of its own, for the XPaths that are not matched on the shared tree
+        self._lxml_root = None
+
+    @property
+    def lxml_root(self):
+        if self._lxml_root is None:
+            self._lxml_root = copy.deepcopy(self.lxml_element)
+        return self._lxml_root
+
+    def get_eles(self):
+        """
+        :return: list of the EleAttrs in the subtree, in preorder
+        """
+        eles = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            eles.append(self.element_tree.ele_map[node.id])
+            stack.extend(reversed(node.children))
+        return eles
+
+    def match_str(self, key):
+        """
+        :return: list of the EleAttrs in the subtree that match the text, in preorder
+        """
+        return [ele for ele in self.get_eles() if ele.is_match(key)]
+
+    def _find_simple(self, tag, conditions):
+        # //tag[...] in the document of the subtree selects the root of the subtree and its descendants
+        for element in self.lxml_element.iter():
+            if not isinstance(element.tag, str) or (tag != '*' and element.tag != tag):
+                continue
+            for name, value in conditions:
+                if name == 'text()':
+                    if element.text != value and all(child.tail != value for child in element):
+                        break
+                elif element.get(name[1:]) != value:
+                    break
+            else:
+                return element
+        return None
+
+    def _get_ele_by_xpath(self, xpath):
+        parsed = parse_simple_xpath(xpath)
+        if parsed is not None and parsed[1]:
+            element = self._find_simple(*parsed)
+        else:
+            eles = get_compiled_xpath(xpath)(self.lxml_root)
+            if not eles:
+                return None
+            if not isinstance(eles[0], etree._Element):
+                raise TypeError(f'xpath {xpath} does not select an element')
+            element = eles[0]
+        if element is None:
+            return None
+        return self.element_tree.ele_map.get(int(element.get('id')), None)
+
+    def get_ele_by_xpath(self, xpath):
+        """
+        :param xpath: str or list of str, the first XPath that selects an element is used
+        :return: the EleAttr of the first element the XPath selects in the subtree, None if there is none
+        """
+        if not isinstance(xpath, list):
+            return self._get_ele_by_xpath(xpath)
+        for xp in xpath:
+            try:
+                target_ele = self._get_ele_by_xpath(xp)
+            except Exception:
+                continue
+            if target_ele:
+                return target_ele
+        return None
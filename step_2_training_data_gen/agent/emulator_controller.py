@@ -1,6 +1,11 @@
 import subprocess
 import logging
 
+from agent.droidbot.readiness import ReadinessProbes
+
+# emulator options without a value, passed when set to "true"
+FLAG_PARAMS = ("no-window", "read-only")
+
 class EmulatorController:
     def __init__(self,avd_name,device_serial,params):
         self.avd_name = avd_name
@@ -8,17 +13,22 @@ class EmulatorController:
         self.params = params
         self.logger = logging.getLogger(self.__class__.__name__)
         self.state = "off"
+        # waits on the emulator, shared with the Device so that all wait times are in one place
+        self.readiness = ReadinessProbes(device_serial)
 
     def load_emulator_with_snapshot(self,snapshot_name="default_boot"):
         """
-        start the emulator and load the specified snapshot.
+        start the emulator and load the specified snapshot, then wait until it has booted.
 
         Args:
         snapshot_name (str): the name of snapshot。
+
+        Returns:
+        bool: whether the emulator is ready.
         """
         cmd = ["emulator", "-avd", self.avd_name,"-no-snapshot-save"]
         for key, value in self.params.items():
-            if key == "no-window":
+            if key in FLAG_PARAMS:
                 if value == "true":
                     cmd.append(f"-{key}")
             else:
@@ -32,6 +42,8 @@ class EmulatorController:
             self.state = "on"
         except Exception as e:
             self.logger.error(f"Error loading emulator with snapshot: {e}")
+            return False
+        return self.readiness.wait_for_boot_completed()
 
     def exit_emulator(self):
         """
@@ -41,9 +53,16 @@ class EmulatorController:
             self.logger.info(f"Exiting emulator '{self.avd_name}'.")
             subprocess.run(["adb", "-s", f"{self.device_serial}", "emu", "kill"], check=True)
             self.state = "off"
+            self.readiness.wait_for_adb_offline()
         except Exception as e:
             self.logger.error(f"Error exiting emulator: {e}")
 
+    def is_running(self):
+        """
+        check whether the emulator is still up.
+        """
+        return self.state == "on" and self.readiness.is_adb_online()
+
     def run_adb_command(self, command):
         """
         run the specified adb command.
@@ -59,19 +78,20 @@ class EmulatorController:
             
     def reload_snapshot(self, snapshot_name="default_boot"):
         """
-        reload the specified snapshot.
+        reload the specified snapshot and wait until the emulator resumed from it.
 
         Args:
         snapshot_name (str): the name of snapshot。
+
+        Returns:
+        bool: whether the emulator is ready.
         """
         if self.state == "on":
-            cmd = ["adb", "emu", "avd", "snapshot", "load", snapshot_name]
-            self.logger.info(f"cmd: {cmd}")
             try:
                 self.logger.info(f"Loading emulator '{self.avd_name}' with snapshot '{snapshot_name}'.")
-                subprocess.Popen(cmd)
-                self.state = "on"
+                return self.readiness.load_snapshot(snapshot_name)
             except Exception as e:
                 self.logger.error(f"Error reseting emulator with snapshot: {snapshot_name}, error: {e}")
+                return False
         else:
-            self.load_emulator_with_snapshot(snapshot_name)
+            return self.load_emulator_with_snapshot(snapshot_name)
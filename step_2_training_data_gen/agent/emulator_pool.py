@@ -0,0 +1,250 @@
+import logging
+import os
+import queue
+import threading
+import time
+import traceback
+
+from agent.emulator_controller import EmulatorController
+
+# console port of the first emulator, every emulator takes a console/adb port pair
+BASE_EMULATOR_PORT = 5554
+# how often a task is tried before it is given up, each retry goes to another worker if there is one
+MAX_TASK_ATTEMPTS = 2
+# seconds an idle worker waits on the queue before checking whether all tasks are done
+QUEUE_POLL_INTERVAL = 0.5
+
+
+class WorkerCrashed(Exception):
+    """
+    the emulator of a worker died while it was running a task
+    """
+    pass
+
+
+class StubEmulatorController:
+    """
+    stands in for EmulatorController, so that an EmulatorPool can be run on a machine without emulators,
+    e.g. EmulatorPool(2, output_dir, lambda worker_id, port: StubEmulatorController(None, f"emulator-{port}", {}))
+    """
+    def __init__(self, avd_name, device_serial, params):
+        self.avd_name = avd_name
+        self.device_serial = device_serial
+        self.params = params
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.state = "off"
+
+    def load_emulator_with_snapshot(self, snapshot_name="default_boot"):
+        self.logger.info(f"Loading stub emulator '{self.device_serial}' with snapshot '{snapshot_name}'.")
+        self.state = "on"
+        return True
+
+    def reload_snapshot(self, snapshot_name="default_boot"):
+        return self.load_emulator_with_snapshot(snapshot_name)
+
+    def exit_emulator(self):
+        self.state = "off"
+
+    def is_running(self):
+        return self.state == "on"
+
+
+class EmulatorWorker:
+    """
+    one emulator of an EmulatorPool, on its own port and with its own output directory.
+    """
+    def __init__(self, worker_id, port, controller, output_dir):
+        self.worker_id = worker_id
+        self.port = port
+        self.serial = f"emulator-{port}"
+        self.controller = controller
+        self.output_dir = output_dir
+        # whatever the set_up hook of the pool returned, e.g. the environment driving this emulator
+        self.context = None
+        self.crashes = 0
+        self.alive = False
+
+
+class EmulatorPool:
+    """
+    runs tasks on several emulators at once.
+
+    Tasks are handed out through a shared queue. When a worker crashes on a task, the worker is
+    restarted and the task is retried on another worker. Results are returned in the order of the tasks,
+    whichever worker ran them.
+    """
+    def __init__(self, num_workers, output_dir, controller_factory, set_up=None, tear_down=None,
+                 is_healthy=None, base_port=BASE_EMULATOR_PORT, max_attempts=MAX_TASK_ATTEMPTS):
+        """
+        Args:
+        num_workers (int): the number of emulators.
+        output_dir (str): the per-worker directories are created in it.
+        controller_factory (callable): (worker_id, port) -> controller, see emulator_controller_factory,
+            or StubEmulatorController to run without emulators.
+        set_up (callable): worker -> context, starts the emulator of a worker, stored in worker.context.
+        tear_down (callable): worker -> None, stops the emulator of a worker.
+        is_healthy (callable): worker -> bool, checked after a task failed, a worker that is not healthy
+            is restarted and the task is retried.
+        base_port (int): the console port of the first emulator.
+        max_attempts (int): how often a task is tried before it is given up.
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.output_dir = output_dir
+        self.controller_factory = controller_factory
+        self.set_up_hook = set_up
+        self.tear_down_hook = tear_down
+        self.is_healthy_hook = is_healthy
+        self.max_attempts = max_attempts
+        self.workers = []
+        for worker_id in range(num_workers):
+            # emulators use an even console port and the odd port after it for adb
+            port = base_port + 2 * worker_id
+            worker_output_dir = os.path.join(output_dir, f"worker_{worker_id}")
+            os.makedirs(worker_output_dir, exist_ok=True)
+            self.workers.append(EmulatorWorker(worker_id, port, controller_factory(worker_id, port),
+                                               worker_output_dir))
+
+        self.__queue = queue.Queue()
+        self.__lock = threading.Lock()
+        self.__records = {}
+
+    @staticmethod
+    def emulator_controller_factory(avd_name, params):
+        """
+        make EmulatorControllers that run read-only instances of one AVD, each on the port of its worker.
+
+        Args:
+        avd_name (str): the name of the AVD.
+        params (dict): emulator arguments, the port is replaced by the port of the worker.
+        """
+        def make_controller(worker_id, port):
+            worker_params = dict(params, port=str(port))
+            # several instances of one AVD can only run when none of them writes to it
+            worker_params["read-only"] = "true"
+            return EmulatorController(avd_name=avd_name, device_serial=f"emulator-{port}", params=worker_params)
+        return make_controller
+
+    def _set_up(self, worker):
+        if self.set_up_hook is not None:
+            worker.context = self.set_up_hook(worker)
+        else:
+            worker.controller.load_emulator_with_snapshot()
+        worker.alive = True
+
+    def _tear_down(self, worker):
+        worker.alive = False
+        try:
+            if self.tear_down_hook is not None:
+                self.tear_down_hook(worker)
+            else:
+                worker.controller.exit_emulator()
+        except Exception as e:
+            self.logger.warning(f"failed to tear down worker {worker.worker_id}: {e}")
+        worker.context = None
+
+    def _is_healthy(self, worker):
+        if self.is_healthy_hook is not None:
+            return self.is_healthy_hook(worker)
+        return worker.controller.is_running()
+
+    def _restart(self, worker):
+        worker.crashes += 1
+        self.logger.warning(f"restarting worker {worker.worker_id} on {worker.serial}")
+        self._tear_down(worker)
+        try:
+            self._set_up(worker)
+        except Exception:
+            self.logger.error(f"worker {worker.worker_id} failed to restart, retiring it")
+            traceback.print_exc()
+
+    def _finish(self, index, record):
+        with self.__lock:
+            self.__records[index] = record
+
+    def _pending(self, num_tasks):
+        with self.__lock:
+            return num_tasks - len(self.__records)
+
+    def _live_workers(self):
+        return [worker for worker in self.workers if worker.alive]
+
+    def _work(self, worker, run_task, num_tasks):
+        if not worker.alive:
+            try:
+                self._set_up(worker)
+            except Exception:
+                self.logger.error(f"worker {worker.worker_id} failed to start")
+                traceback.print_exc()
+                return
+
+        while worker.alive and self._pending(num_tasks) > 0:
+            try:
+                index, task, attempts, failed_on = self.__queue.get(timeout=QUEUE_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            if worker.worker_id in failed_on and \
+                    any(w.worker_id not in failed_on for w in self._live_workers()):
+                # leave the retry to a worker that has not crashed on it
+                self.__queue.put((index, task, attempts, failed_on))
+                time.sleep(QUEUE_POLL_INTERVAL)
+                continue
+
+            attempts += 1
+            start_time = time.time()
+            try:
+                result = run_task(worker, task)
+                if isinstance(result, dict) and result.get("failed") and not self._is_healthy(worker):
+                    raise WorkerCrashed(f"emulator {worker.serial} is not running")
+            except Exception as e:
+                traceback.print_exc()
+                self.logger.warning(f"task {index} crashed on worker {worker.worker_id} (attempt {attempts}): {e}")
+                if attempts < self.max_attempts:
+                    self.__queue.put((index, task, attempts, failed_on | {worker.worker_id}))
+                else:
+                    self._finish(index, {"index": index, "worker": worker.worker_id, "attempts": attempts,
+                                         "time": time.time() - start_time, "error": str(e), "result": None})
+                self._restart(worker)
+                continue
+            self._finish(index, {"index": index, "worker": worker.worker_id, "attempts": attempts,
+                                 "time": time.time() - start_time, "error": None, "result": result})
+
+    def run(self, tasks, run_task):
+        """
+        run the tasks on the workers, workers that are not running yet are started first.
+
+        Args:
+        tasks (list): the tasks, each one is passed to run_task as it is.
+        run_task (callable): (worker, task) -> result, an exception means that the worker crashed.
+
+        Returns:
+        list: one record per task, in the order of the tasks, with keys
+            index, worker, attempts, time, error and result.
+        """
+        tasks = list(tasks)
+        with self.__lock:
+            self.__records = {}
+        for index, task in enumerate(tasks):
+            self.__queue.put((index, task, 0, frozenset()))
+
+        threads = [threading.Thread(target=self._work, args=(worker, run_task, len(tasks)),
+                                    name=f"emulator-worker-{worker.worker_id}")
+                   for worker in self.workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # no worker is left to run the remaining tasks
+        while True:
+            try:
+                index, _, attempts, _ = self.__queue.get_nowait()
+            except queue.Empty:
+                break
+            self._finish(index, {"index": index, "worker": None, "attempts": attempts, "time": 0,
+                                 "error": "no emulator worker available", "result": None})
+        return [self.__records[index] for index in range(len(tasks))]
+
+    def close(self):
+        for worker in self.workers:
+            if worker.alive:
+                self._tear_down(worker)
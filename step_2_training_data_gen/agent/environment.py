@@ -12,6 +12,36 @@ import pandas as pd
 
 from agent.droidbot.device_state import ElementTree
 from agent.emulator_controller import EmulatorController
+from agent.reset_ladder import ResetLadder, RESET_TIERS, RESET_TIER_CLEAR_DATA, RESET_TIER_SNAPSHOT
+
+# device state fields needed to compare ui trees while waiting for the screen to settle
+STABILITY_POLL_FIELDS = ("views", "foreground_activity", "activity_stack")
+
+# how the environments wait for the screen to settle:
+# "poll" compares consecutive device states, "idle" waits for a pause in the accessibility events
+STABILITY_MODE_POLL = "poll"
+STABILITY_MODE_IDLE = "idle"
+# seconds without accessibility events after which the UI is considered idle
+UI_IDLE_SECONDS = 0.3
+# quiet time after an action that caused no accessibility event yet, the first
+# event of a transition may come later than UI_IDLE_SECONDS
+UI_SETTLE_SECONDS = 0.8
+
+
+def wait_for_ui_idle(device, timeout: float) -> bool:
+  """Waits for a pause in the accessibility events of the device.
+
+  Returns:
+      False if the event stream is not available or the UI did not become idle
+      within the timeout, in which case callers fall back to polling.
+  """
+  idle = device.wait_for_idle(idle_time=UI_IDLE_SECONDS, timeout=timeout, settle_time=UI_SETTLE_SECONDS)
+  if idle is None:
+    logging.debug("accessibility events unavailable, falling back to polling")
+    return False
+  if not idle:
+    logging.warning(f"UI did not become idle within {timeout}s, falling back to polling")
+  return idle
 
 @dataclasses.dataclass(frozen=True)
 class State():
@@ -46,6 +76,9 @@ class AsyncEnv(abc.ABC):
   Changes from action execution may take some time to appear.
   """
 
+  # incremented by every action on the device, the states read within one epoch show the same screen
+  action_epoch: int = 0
+
   @abc.abstractmethod
   def reset(self, go_home: bool = False) -> State:
     """Go home on reset.
@@ -62,6 +95,14 @@ class AsyncEnv(abc.ABC):
       wipe_intermidiate_task_data: Whether to delete the intermidiate files (screenshot, activity, action, view - logs) created during the script execution steps.
     """
 
+  def pop_reset_times(self) -> list[dict]:
+    """Returns the resets done since the last call.
+
+    Each reset is a dict with the tier, the seconds it took and whether it
+    passed its verification.
+    """
+    return []
+
   @abc.abstractmethod
   def get_state(self) -> State:
     """Gets the state of the environment; i.e., screenshot path & UI tree.
@@ -144,15 +185,22 @@ class AsyncDroidBotEnvForLlamaTouch(AsyncEnv):
                  max_steps=30,
                  local_output_path="experiment",
                  instruction_fp="instructions/llamatouch_task_metadata.tsv",
-                 config = None):
+                 config = None,
+                 stability_mode = STABILITY_MODE_POLL,
+                 emulator_controller = None,
+                 device_logs_path = None):
     self.config = config
+    self.stability_mode = stability_mode
     self.device_serial = f"emulator-{emulator_controller_args['port']}"
     self._prior_state = None
     self.local_output_path = local_output_path
-    self.device_logs = f"{local_output_path}/device_logs"
+    # workers of an EmulatorPool pass their own controller and log directory
+    self.device_logs = device_logs_path if device_logs_path is not None else f"{local_output_path}/device_logs"
     self.logger = logging.getLogger(self.__class__.__name__)
     
-    self.emulator_controller = EmulatorController(avd_name=avd_name,device_serial=self.device_serial,params=emulator_controller_args)
+    if emulator_controller is None:
+      emulator_controller = EmulatorController(avd_name=avd_name,device_serial=self.device_serial,params=emulator_controller_args)
+    self.emulator_controller = emulator_controller
 
     self._state: DeviceState = None
     self._element_tree: ElementTree = None
@@ -166,6 +214,14 @@ class AsyncDroidBotEnvForLlamaTouch(AsyncEnv):
     self._actions_taken = []
     # self.home_screen = ""
     self.app_name = ""
+    self._apps = {}
+
+    # picks the cheapest reset between tasks, the snapshot is reloaded every time if disabled
+    self.reset_ladder = ResetLadder(f"{self.device_logs}/app_data_baselines") \
+        if getattr(config, "RESET_LADDER", False) else None
+    # packages seen in the foreground since the last reset
+    self._dirty_packages = set()
+    self._reset_times = []
 
     self.screenshot_dir_path = ""
     self.activity_dir_path = ""
@@ -198,19 +254,20 @@ class AsyncDroidBotEnvForLlamaTouch(AsyncEnv):
   def set_up(self) -> None:
     self.logger.info("loading emulator...")
     self.emulator_controller.load_emulator_with_snapshot()
-    time.sleep(30) # waiting for emulator to start
     self.logger.info("connecting to device...")
     self.device = Device(
         is_emulator=True,
         device_serial=self.device_serial,
-        output_dir=self.device_logs)
+        output_dir=self.device_logs,
+        readiness=self.emulator_controller.readiness)
     self.device.set_up()
     self.device.connect()
-    time.sleep(2)
     self.logger.info("AgentEnv setup over!")
+    self._log_wait_times()
 
   def reset(self, go_home: bool = False) -> State:
     if go_home:
+      self.action_epoch += 1
       self.device.send_event(input_event.KeyEvent('HOME'))
     return self.get_state()
   
@@ -219,47 +276,119 @@ class AsyncDroidBotEnvForLlamaTouch(AsyncEnv):
       return
     
     self.logger.info("resetting agent env...")
+    package = self._get_app(app_name).get_package_name()
+    tier = RESET_TIER_SNAPSHOT
+    if self.reset_ladder is not None:
+      try:
+        tier = self.reset_ladder.choose_tier(
+            self.device, package, self._dirty_packages, self._actions_taken)
+      except Exception as e:
+        self.logger.warning(f"failed to pick a reset tier: {e}")
     self.current_action = "None|None|None"
     self.state_history = []
     self.episode_end = False
     self._actions_taken = []
     self.app_name = app_name
-    self.device.disconnect()
-    time.sleep(15)
     # if wipe_intermidiate_task_data:
     #   self.logger.info("wiping intermidiate results...")
     #   # os.system(f"del  -rf {self.task_output_path}/*")
     #   os.system(f"rm -rf {self.task_output_path}/*")
     #   self.logger.info("intermidiate results wiped successfully!")
 
-    # if self.app_name != app_name or self.home_screen != self._element_tree.str:
-    self.emulator_controller.reload_snapshot(self.config.EMULATOR_CONTROLLER_AGRS["snapshot"])
-    time.sleep(15)
-    self.device.set_up()
-    self.device.connect()
-    time.sleep(5)
-    self.prepare(app_name)
+    for tier in RESET_TIERS[RESET_TIERS.index(tier):]:
+      t0 = time.time()
+      try:
+        verified = self._reset_with_tier(tier, app_name, package)
+      except Exception:
+        if tier == RESET_TIER_SNAPSHOT:
+          raise
+        traceback.print_exc()
+        verified = False
+      self._reset_times.append({"tier": tier, "seconds": time.time() - t0, "verified": verified})
+      self.logger.info(f"{tier} reset took {time.time() - t0:.1f}s, verified: {verified}")
+      if verified:
+        break
+    self._dirty_packages = set()
       
     self.logger.info("agent env reset successfully!")
+    self._log_wait_times()
+
+  def _reset_with_tier(self, tier: str, app_name: str, package: str) -> bool:
+    """Resets the device with one tier of the reset ladder.
+
+    Returns:
+        Whether the app shows the same first screen as after a snapshot reset,
+        always True for a snapshot reset.
+    """
+    if tier == RESET_TIER_SNAPSHOT:
+      self.device.disconnect()
+      self.emulator_controller.reload_snapshot(self.config.EMULATOR_CONTROLLER_AGRS["snapshot"])
+      self.device.set_up()
+      self.device.connect()
+      if self.reset_ladder is not None:
+        try:
+          self.reset_ladder.record_snapshot(self.device, package)
+        except Exception as e:
+          self.logger.warning(f"failed to record the snapshot baselines: {e}")
+      self.prepare(app_name)
+      if self.reset_ladder is not None:
+        self.reset_ladder.record_screen(package, self._state)
+      return True
+
+    if tier == RESET_TIER_CLEAR_DATA:
+      for dirty_package in self._dirty_packages | {package}:
+        if not self.reset_ladder.restore_app_data(self.device, dirty_package):
+          return False
+    self.prepare(app_name)
+    return self.reset_ladder.verify_screen(package, self._state)
+
+  def pop_reset_times(self) -> list[dict]:
+    reset_times, self._reset_times = self._reset_times, []
+    return reset_times
+
+  def _get_app(self, app_name) -> App:
+    if app_name not in self._apps:
+      apk_path = f"{self.config.BASE_APKS_PATH}/{self.config.APKS_PER_APP[app_name]}"
+      self._apps[app_name] = App(apk_path, f"{self.device_logs}/{app_name}")
+    return self._apps[app_name]
   
   def prepare(self, app_name = None):
     if app_name != None:
       self.app_name = app_name
 
     self._setup_directories(self.task_output_path)
-    apk_path = f"{self.config.BASE_APKS_PATH}/{self.config.APKS_PER_APP[self.app_name]}"
-    app = App(apk_path, f"{self.device_logs}/{self.app_name}")
+    app = self._get_app(self.app_name)
     
+    self.action_epoch += 1
     self.device.send_event(input_event.RestartAppEvent(app=app))
     self.device.start_app(app)
-    time.sleep(10)
+    self.device.wait_for_app(app.get_package_name())
     self._update_state()
 
   def close(self) -> None:
     self.logger.info(f"tear down the agent env...")
     self.device.disconnect()
-    time.sleep(5)
     self.emulator_controller.exit_emulator()
+    self._log_wait_times()
+
+  def _log_wait_times(self) -> None:
+    """Logs the seconds spent in each readiness probe so far."""
+    for probe, times in self.emulator_controller.readiness.get_wait_times().items():
+      self.logger.info(
+          f"readiness {probe}: last {times['last']:.1f}s, "
+          f"total {times['total']:.1f}s over {times['count']} waits")
+
+  def set_instruction(self, row) -> tuple[str, str]:
+    """Makes a row of the instruction file the current task.
+
+    Used when the rows are handed out by an EmulatorPool instead of being
+    fetched with get_instruction.
+
+    Returns:
+        The instruction and the app name of the row.
+    """
+    self.task_output_path = os.path.join(self.local_output_path, str(row['path']))
+    return row['description'], row['app']
 
   def get_instruction(self) -> str:
     try:
@@ -271,6 +400,7 @@ class AsyncDroidBotEnvForLlamaTouch(AsyncEnv):
         return None, None
 
   def execute_action(self, action: dict) -> None:
+    self.action_epoch += 1
     event = None
     action_type: str= action['action_type']
     action_params = None
@@ -348,8 +478,11 @@ class AsyncDroidBotEnvForLlamaTouch(AsyncEnv):
         with open(view_hierarchy_json_path, "w", encoding="utf-8") as vh_json_file:
             json.dump(self._state.views, vh_json_file, ensure_ascii=False, indent=4)
         
+        foreground_activity = self.foreground_activity_name
+        if foreground_activity:
+            self._dirty_packages.add(foreground_activity.split("/")[0])
         with open(activity_path, "w", encoding="utf-8") as activity_file:
-            activity_file.write(self.foreground_activity_name)
+            activity_file.write(foreground_activity)
         
         with open(action_path, "w", encoding="utf-8") as action_file:
             action_file.write(formatted_action)
@@ -362,10 +495,10 @@ class AsyncDroidBotEnvForLlamaTouch(AsyncEnv):
       # self.home_screen = self._element_tree.str
     # if wait_to_stabilize:
     #   return self._get_stable_state()
-    return State.create_and_infer_elements(screenshot=self._state.screenshot_path, element_tree=self._element_tree)
+    return State.create_and_infer_elements(screenshot=self._state.screenshot, element_tree=self._element_tree)
   
-  def _update_state(self) -> State:
-    self._state = self.device.get_current_state()
+  def _update_state(self, fields=None) -> State:
+    self._state = self.device.get_current_state(fields=fields)
     _, _, element_tree = self._state.text_representation
     self._element_tree = element_tree
 
@@ -388,24 +521,29 @@ class AsyncDroidBotEnvForLlamaTouch(AsyncEnv):
         True if UI is considered stable, False if it never stabilizes within the
         timeout.
     """
+    if self.stability_mode == STABILITY_MODE_IDLE and wait_for_ui_idle(self.device, timeout):
+      self._update_state()
+      return
+
     if self._state is None:
       self.get_state()
 
     stable_checks = 0
     elapsed_time = 0
-    prioir_element_tree = self._element_tree
+    prior_fingerprint = self._state.fingerprint
 
     while stable_checks < stability_threshold and elapsed_time < timeout:
       try:
-        self._update_state()
-        if prioir_element_tree.str == self._element_tree.str:
+        # compare fingerprints, the element tree is only built for the state we settle on
+        self._state = self.device.get_current_state(fields=STABILITY_POLL_FIELDS)
+        if prior_fingerprint == self._state.fingerprint:
           stable_checks += 1
           if stable_checks == stability_threshold:
             print("State updated!")
             break  # Exit early if stability is achieved.
         else:
           stable_checks = 0  # Reset if any change is detected
-          prioir_element_tree = self._element_tree
+          prior_fingerprint = self._state.fingerprint
 
         time.sleep(check_interval)
         elapsed_time += check_interval
@@ -415,6 +553,9 @@ class AsyncDroidBotEnvForLlamaTouch(AsyncEnv):
         elapsed_time += check_interval
         print("Error getting state! Trying again..",e)
 
+    if self._state is not None:
+      _, _, self._element_tree = self._state.text_representation
+
   
   def _do_dump_hierarchy(self, name, dump_location) -> str:
         device_dump_location = f"/sdcard/{name}.xml"
@@ -456,9 +597,10 @@ class AsyncDroidBotEnvForLlamaTouch(AsyncEnv):
 
 class AsyncDroidBotEnv(AsyncEnv):
   
-  def __init__(self, device: Device, app: App):
+  def __init__(self, device: Device, app: App, stability_mode: str = STABILITY_MODE_POLL):
     self.device = device
     self.app = app
+    self.stability_mode = stability_mode
     self._prior_state = None
     
     self.device.set_up()
@@ -474,6 +616,7 @@ class AsyncDroidBotEnv(AsyncEnv):
     
   def reset(self, go_home: bool = False) -> State:
     if go_home:
+      self.action_epoch += 1
       self.device.send_event(input_event.KeyEvent('HOME'))
     return self.get_state()
   
@@ -483,6 +626,7 @@ class AsyncDroidBotEnv(AsyncEnv):
     return self._get_state()
 
   def execute_action(self, action: dict) -> None:
+    self.action_epoch += 1
     event = None
     action_type: str= action['action_type']
     if action_type == 'click':
@@ -507,10 +651,12 @@ class AsyncDroidBotEnv(AsyncEnv):
     self.device.send_event(event)
     
   def _get_state(self) -> State:
-    state = self.device.get_current_state()
+    return self._to_state(self.device.get_current_state())
+
+  def _to_state(self, state: DeviceState) -> State:
     self._state = state
     _, element_list, element_tree = state.text_representation
-    return State.create_and_infer_elements(screenshot=state.screenshot_path, element_tree=element_tree)
+    return State.create_and_infer_elements(screenshot=state.screenshot, element_tree=element_tree)
   
   def _get_stable_state(
       self,
@@ -531,15 +677,19 @@ class AsyncDroidBotEnv(AsyncEnv):
         True if UI is considered stable, False if it never stabilizes within the
         timeout.
     """
+    if self.stability_mode == STABILITY_MODE_IDLE and wait_for_ui_idle(self.device, timeout):
+      return self._get_state()
+
+    # compare fingerprints, the element tree is only built for the returned state
     if not self._prior_state:
-      self._prior_state = self._get_state()
+      self._prior_state = self.device.get_current_state()
 
     stable_checks = 0
     elapsed_time = 0.0
-    current_state = self._get_state()
+    current_state = self.device.get_current_state()
 
     while stable_checks < stability_threshold and elapsed_time < timeout:
-      if self._prior_state.element_tree.str == current_state.element_tree.str:
+      if self._prior_state.fingerprint == current_state.fingerprint:
         stable_checks += 1
         if stable_checks == stability_threshold:
           break  # Exit early if stability is achieved.
@@ -549,9 +699,9 @@ class AsyncDroidBotEnv(AsyncEnv):
 
       time.sleep(sleep_duration)
       elapsed_time += sleep_duration
-      current_state = self._get_state()
+      current_state = self.device.get_current_state()
 
-    return current_state
+    return self._to_state(current_state)
   
   @property
   def foreground_activity_name(self) -> str:
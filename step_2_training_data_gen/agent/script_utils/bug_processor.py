@@ -237,10 +237,25 @@ class BugProcessorV2:
     if len(self.raw_log['records'])==0:
       return []
     ui_state = self.raw_log['records'][-1]['State']
-    for api_name, api_xpath in self.doc.api_xpath.items():
+    root = etree.fromstring(ui_state)
+    # only the apis with the attributes or the texts of the screen in their xpaths can be on it
+    candidate_api_names = set(self.doc.get_api_names_with_complex_xpath())
+    for element in root.iter():
+      if isinstance(element.tag, str):
+        for attribute, value in element.attrib.items():
+          candidate_api_names.update(self.doc.get_api_names_by_condition(('@' + attribute, value)))
+      for text in [element.text] + [child.tail for child in element]:
+        if text is not None:
+          candidate_api_names.update(self.doc.get_api_names_by_condition(('text()', text)))
 
-      root = etree.fromstring(ui_state)
-      eles = root.xpath(api_xpath)
+    for api_name, api_xpath in self.doc.api_xpath.items():
+      if api_name not in candidate_api_names:
+        continue
+      eles = []
+      for xpath in (api_xpath if isinstance(api_xpath, list) else [api_xpath]):
+        eles = root.xpath(xpath)
+        if eles:
+          break
       if not eles:
         continue
       ele_desc = etree.tostring(eles[0], pretty_print=True).decode(
@@ -721,7 +736,7 @@ Your answer should follow this JSON format:
       # todo:: only first miss match to trigger the navigating
       return False
     
-    element_tree_html_without_id = self._get_view_without_id(element_tree.str)
+    element_tree_html_without_id = element_tree.get_str(with_id=False)
     
     element_html = api.element
     element_html_without_id = self._get_view_without_id(element_html)
@@ -769,6 +784,5 @@ Your answer should follow this JSON format:
     if not ele:
       return False
     
-    api.xpath = [xpath]
-    self.doc.is_updated = True
+    self.doc.update_api_xpath(api_name, [xpath])
     return True
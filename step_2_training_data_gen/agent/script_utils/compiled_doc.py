@@ -0,0 +1,116 @@
+# Compile API docs into a format that ApiDoc loads without decoding the elements and the dependency paths of every
+# screen up front.
+#   python -m agent.script_utils.compiled_doc evaluation/droidtask/docs/*.json
+# writes <doc>.apidoc next to each doc, ApiDoc uses it instead of the JSON doc while it is up to date.
+import argparse
+import json
+import mmap
+import os
+import struct
+
+COMPILED_DOC_SUFFIX = '.apidoc'
+COMPILED_DOC_MAGIC = b'APIDOC\x00\x01'
+# the size of the header, after the magic
+HEADER_SIZE = struct.Struct('<Q')
+
+
+def get_compiled_doc_path(doc_path: str) -> str:
+  return os.path.splitext(doc_path)[0] + COMPILED_DOC_SUFFIX
+
+
+def is_compiled_doc(doc_path: str) -> bool:
+  return doc_path.endswith(COMPILED_DOC_SUFFIX)
+
+
+def compile_api_doc(doc_path: str, compiled_path: str = None) -> str:
+  '''
+  the compiled doc is the magic, the size of the header, the header and the data. the header is JSON with the
+  screens in order, their skeletons and the names and xpaths of their elements, and the offsets of the elements of
+  each screen and of the paths of each element in the data. the elements and the paths are JSON too.
+  @return: the path of the compiled doc, <doc>.apidoc by default
+  '''
+  if compiled_path is None:
+    compiled_path = get_compiled_doc_path(doc_path)
+  raw_api_doc = json.load(open(doc_path, 'r'))
+
+  data = bytearray()
+
+  def append(value) -> list:
+    blob = json.dumps(value).encode('utf-8')
+    offset = len(data)
+    data.extend(blob)
+    return [offset, len(blob)]
+
+  screens = []
+  for screen_name, screen in raw_api_doc.items():
+    apis = []
+    elements = {}
+    for api_name, raw in screen['elements'].items():
+      raw = dict(raw)
+      paths = raw.pop('paths', [])
+      elements[api_name] = raw
+      apis.append([api_name, raw.get('xpath', None), append(paths)])
+    screens.append({
+        'name': screen_name,
+        'skeleton': screen['skeleton'],
+        'elements': append(elements),
+        'apis': apis
+    })
+
+  header = json.dumps({
+      'source': os.path.basename(doc_path),
+      'screens': screens
+  }).encode('utf-8')
+  tmp_path = compiled_path + '.tmp'
+  with open(tmp_path, 'wb') as f:
+    f.write(COMPILED_DOC_MAGIC)
+    f.write(HEADER_SIZE.pack(len(header)))
+    f.write(header)
+    f.write(data)
+  os.replace(tmp_path, compiled_path)
+  return compiled_path
+
+
+class CompiledDoc():
+  '''
+  a compiled doc mapped into memory, the elements and the paths are decoded when they are read
+  '''
+
+  def __init__(self, compiled_path: str):
+    self.compiled_path = compiled_path
+    with open(compiled_path, 'rb') as f:
+      self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if self._data[:len(COMPILED_DOC_MAGIC)] != COMPILED_DOC_MAGIC:
+      raise ValueError(f'{compiled_path} is not a compiled doc')
+    header_start = len(COMPILED_DOC_MAGIC) + HEADER_SIZE.size
+    header_size, = HEADER_SIZE.unpack_from(self._data, len(COMPILED_DOC_MAGIC))
+    header = json.loads(self._data[header_start:header_start + header_size])
+    self._data_start = header_start + header_size
+
+    # the JSON doc it was compiled from
+    self.source_path = os.path.join(os.path.dirname(compiled_path), header['source'])
+    self.screens: list[dict] = header['screens']
+
+  def read(self, span: list):
+    '''
+    @param span: [offset, size] in the data
+    '''
+    offset, size = span
+    start = self._data_start + offset
+    return json.loads(self._data[start:start + size])
+
+  def close(self):
+    self._data.close()
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Compile API docs for faster loading.")
+  parser.add_argument("doc_paths", nargs="+", help="JSON docs, each is compiled to <doc>.apidoc")
+  args = parser.parse_args()
+  for doc_path in args.doc_paths:
+    compiled_path = compile_api_doc(doc_path)
+    print(f'{doc_path} -> {compiled_path}')
+
+
+if __name__ == "__main__":
+  main()
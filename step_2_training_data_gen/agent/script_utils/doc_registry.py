@@ -0,0 +1,127 @@
+import collections
+import hashlib
+import json
+import os
+import threading
+
+from agent.script_utils.api_doc import ApiDoc
+from agent.script_utils.compiled_doc import get_compiled_doc_path, is_compiled_doc
+
+# docs kept loaded, the least recently used doc is dropped first
+DEFAULT_MAX_DOCS = 8
+
+
+def _get_file_paths(doc_path: str) -> list[str]:
+  '''
+  the files a doc is loaded from, the JSON doc and the compiled doc next to it if there is one
+  '''
+  if is_compiled_doc(doc_path):
+    return [doc_path]
+  compiled_path = get_compiled_doc_path(doc_path)
+  if os.path.exists(compiled_path):
+    return [doc_path, compiled_path]
+  return [doc_path]
+
+
+def _get_signature(file_paths: list[str]) -> tuple:
+  signature = []
+  for file_path in file_paths:
+    stat = os.stat(file_path)
+    signature.append((file_path, stat.st_mtime_ns, stat.st_size))
+  return tuple(signature)
+
+
+def _get_digest(file_paths: list[str]) -> str:
+  digest = hashlib.blake2b(digest_size=16)
+  for file_path in file_paths:
+    digest.update(file_path.encode('utf-8'))
+    with open(file_path, 'rb') as f:
+      for chunk in iter(lambda: f.read(1 << 20), b''):
+        digest.update(chunk)
+  return digest.hexdigest()
+
+
+class _Entry():
+
+  def __init__(self, value, signature: tuple, digest: str):
+    self.value = value
+    self.signature = signature
+    self.digest = digest
+    # the first lookup loads the value, the others wait for it
+    self.lock = threading.Lock()
+
+
+class DocRegistry():
+  '''
+  the docs loaded in this process, shared by the agents of all tasks and threads. a doc is loaded once per app and
+  path and is loaded again when its files change, i.e. their mtime or size changed and so did their content. the
+  docs are shared read-only, an agent that updates its doc works on ApiDoc.fork() of it.
+  '''
+
+  def __init__(self, max_docs: int = DEFAULT_MAX_DOCS):
+    self.max_docs = max_docs
+    # (kind, path) -> _Entry, least recently used first
+    self._entries: collections.OrderedDict[tuple, _Entry] = collections.OrderedDict()
+    self._lock = threading.Lock()
+    self.loads = 0
+
+  def get_api_doc(self, doc_path: str, app_name: str = None) -> ApiDoc:
+    '''
+    @param app_name: the docs of different apps are not shared even if they are at the same path
+    @return: the shared ApiDoc of the doc, fork() it before updating it
+    '''
+    return self._get((app_name, os.path.abspath(doc_path)), doc_path, ApiDoc)
+
+  def get_json(self, json_path: str):
+    '''
+    @return: the shared content of a JSON file, e.g. a raw doc, which must not be modified
+    '''
+    def load_json(path):
+      with open(path, 'r') as f:
+        return json.load(f)
+    return self._get(('json', os.path.abspath(json_path)), json_path, load_json)
+
+  def _get(self, key: tuple, path: str, load):
+    file_paths = [path] if key[0] == 'json' else _get_file_paths(path)
+    signature = _get_signature(file_paths)
+    with self._lock:
+      entry = self._entries.get(key, None)
+      if entry is None:
+        entry = self._entries[key] = _Entry(None, None, None)
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.max_docs:
+        self._entries.popitem(last=False)
+
+    with entry.lock:
+      if entry.signature == signature:
+        return entry.value
+      digest = _get_digest(file_paths)
+      if entry.digest != digest:
+        # the files were changed, not only touched
+        entry.value = load(path)
+        self.loads += 1
+      entry.signature, entry.digest = signature, digest
+      return entry.value
+
+  def invalidate(self, path: str = None):
+    '''
+    drop the docs loaded from a path, or all docs
+    '''
+    with self._lock:
+      if path is None:
+        self._entries.clear()
+        return
+      path = os.path.abspath(path)
+      for key in [key for key in self._entries if key[1] == path]:
+        del self._entries[key]
+
+
+doc_registry = DocRegistry()
+
+
+def get_api_doc(doc_path: str, app_name: str = None) -> ApiDoc:
+  return doc_registry.get_api_doc(doc_path, app_name)
+
+
+def get_json(json_path: str):
+  return doc_registry.get_json(json_path)
@@ -14,9 +14,10 @@ import agent.environment as environment
 from agent.droidbot.device_state import ElementTree, EleAttr, DeviceState
 
 from agent.script_utils.api_doc import ApiDoc
+from agent.script_utils.navigation import NavigationEdge, NavigationPlanner
 from agent.script_utils.err import XPathError, APIError, ActionError, NotFoundError
 
-from . import MAX_SCROLL_NUM, MAX_ACTION_COUNT, LOGGING_ENABLED, MAX_DEPENDENCE_DEPTH, MAX_DEPENDENCE_WIDTH, WAIT_AFTER_ACTION_SECONDS
+from . import MAX_SCROLL_NUM, MAX_ACTION_COUNT, LOGGING_ENABLED, MAX_DEPENDENCE_WIDTH, WAIT_AFTER_ACTION_SECONDS
 
 api_names = [
     'long_tap', 'tap', 'set_text', 'scroll', 'get_text', 'get_attributes',
@@ -176,7 +177,8 @@ def _save2log(save_path,
     currently_executing_code=currently_executing_code,
     target=comment,
     effect_range=effect_range,
-    screenshot=screenshot
+    # the screenshot is captured and written here if it is still a lazy handle
+    screenshot=os.fspath(screenshot) if screenshot is not None else None
   )
 
 
@@ -186,6 +188,8 @@ class CodeConfig:
                doc: ApiDoc):
     self.app_name = app_name
     self.doc = doc
+    # kept across the scripts of a task, so the routes avoid the steps that failed before
+    self.navigation_planner = NavigationPlanner(doc)
     
     self.save_path = None
     self.log_file = None
@@ -214,11 +218,12 @@ class CodeStatus:
   def __init__(self):
     # internal
     self.action_count = 0
-    self.last_screen_html_str = None
+    # ElementTree.content_hash of the last checked screen
+    self.last_screen_hash: int = None
     
   def reset(self):
     self.action_count = 0
-    self.last_screen_html_str = None
+    self.last_screen_hash = None
     
   def check_action_count(self):
     if self.action_count >= MAX_ACTION_COUNT:
@@ -226,13 +231,11 @@ class CodeStatus:
       # pass
     self.action_count += 1
   
-  def check_last_screen(self, screen_html_str: str):
+  def check_last_screen(self, element_tree: ElementTree):
     is_same = False
-    if not self.last_screen_html_str:
-      self.last_screen_html_str = screen_html_str
-    else:
-      is_same = self.last_screen_html_str == screen_html_str
-      self.last_screen_html_str = screen_html_str
+    if self.last_screen_hash is not None:
+      is_same = self.last_screen_hash == element_tree.content_hash
+    self.last_screen_hash = element_tree.content_hash
     return is_same
 
 
@@ -251,13 +254,25 @@ class Verifier:
     self.status = status
     
     self._state = None
+    self._state_epoch: int = None # the env.action_epoch self._state was read in
     self._element_tree = None
 
     self.gpt_located_elements = []
 
   @property
   def state(self):
-    return self.env.get_state()
+    # the screen is dumped once per action epoch, only actions on the device or refresh() make it stale
+    if self._state is None or self._state_epoch != self.env.action_epoch:
+      action_epoch = self.env.action_epoch
+      self._state = self.env.get_state()
+      self._state_epoch = action_epoch
+    return self._state
+
+  def refresh(self):
+    '''
+    drop the cached state, the next access dumps the screen again
+    '''
+    self._state = None
 
   @property
   def element_tree(self):
@@ -273,7 +288,7 @@ class Verifier:
   
   @property
   def last_screen(self):
-    return self.status.last_screen_html_str
+    return self.status.last_screen_hash
   
   def get_cached_element_tree(self):
     if self._element_tree:
@@ -282,28 +297,34 @@ class Verifier:
   
   def get_fresh_state(self):
     self.env.wait_for_stable_state(2,0)
+    self.refresh()
     return self.state
   
   def update_state(self):
     self.env.wait_for_stable_state()
+    self.refresh()
+
+  def wait_after_action(self):
+    # in idle mode, stop as soon as the accessibility events pause, never later than the fixed wait
+    start_time = time.time()
+    if self.env.stability_mode == environment.STABILITY_MODE_IDLE and \
+        environment.wait_for_ui_idle(self.env.device, timeout=WAIT_AFTER_ACTION_SECONDS):
+      return
+    time.sleep(max(0, WAIT_AFTER_ACTION_SECONDS - (time.time() - start_time)))
 
   def check_last_screen_html(self):
-    is_same = self.status.check_last_screen(self.element_tree.str)
+    is_same = self.status.check_last_screen(self.element_tree)
     return is_same
 
   def get_unique_xpath_on_screen(self, api_name, xpaths):
     if isinstance(api_name,list):
       api_name = api_name[0]
-    screen = api_name.split('__')[0]
+    screen = self.doc.get_api_screen_name(api_name)
     unique = []
     for xpath in xpaths:
-      is_duplicate = False
-      for el in self.doc.doc[screen].values():
-        if el.api_name == api_name:
-          continue
-        if xpath in el.xpath:
-          is_duplicate = True
-          break
+      is_duplicate = any(
+          other != api_name and self.doc.get_api_screen_name(other) == screen
+          for other in self.doc.get_api_names_by_xpath(xpath))
       if not is_duplicate:
         unique.append(xpath)
     return unique
@@ -366,7 +387,7 @@ class Verifier:
                   "view": scrollable_element.view,
                   "direction": scrolling_direction
               })
-          time.sleep(WAIT_AFTER_ACTION_SECONDS)
+          self.wait_after_action()
           self.update_state()
 
           is_same = self.check_last_screen_html()
@@ -457,109 +478,103 @@ Please output only answer that is in the format of the json above and nothing el
       element_id = int(re.search(r"id='(\d+)'", element).group(1))
       return self.element_tree.get_ele_by_id(element_id)
 
+  def _execute_navigation_edge(self, edge: NavigationEdge, statement):
+    '''
+    @return: whether all the actions of the edge were executed
+    '''
+    for action in edge.actions:
+      element_tree = self.element_tree
+      if action.action_type == 'back' or action.action_type == 'enter':
+        _save2log(
+          save_path=self.save_path,
+          log_file=self.config.log_file,
+          element_tree=element_tree,
+          idx=None,
+          inputs=None,
+          action_type=action.action_type,
+          api_name=None,
+          xpath=None,
+          currently_executing_code=statement,
+          comment='device action',
+          screenshot=self.state.screenshot)
+        self.env.execute_action(
+            {
+                "action_type": action.action_type
+            })
+        self.update_state()
+        continue
+
+      _action_xpath = self.doc.api_xpath.get(action.name, None)
+      if not _action_xpath:
+        return False
+      _action_xpaths = _action_xpath if isinstance(_action_xpath, list) else [_action_xpath]
+      _target_ele = self.locate_element(action.name, _action_xpaths)
+      if not _target_ele:
+        return False
+
+      _save2log(
+        save_path=self.save_path,
+        log_file=self.config.log_file,
+        element_tree=element_tree,
+        idx=_target_ele.id,
+        inputs=None,
+        action_type=action.action_type,
+        api_name=action.api_name,
+        xpath=_action_xpath,
+        currently_executing_code=statement,
+        comment='navigate',
+        screenshot=self.state.screenshot)
+
+      executable_action = agent_utils.convert_action(action.action_type, _target_ele, action.text)
+      self.env.execute_action(executable_action)
+      self.wait_after_action()
+      self.update_state()
+      self.check_last_screen_html()
+    return True
+
   def _track_element_by_dependencies(self, api_name, xpath, statement):
-    counter = 0
-    target_ele = None
-    while target_ele is None and counter < MAX_DEPENDENCE_WIDTH:
-      _, dependency_action = self.doc.get_dependency(api_name)
-      
-      if not dependency_action:
+    '''
+    navigate from the current screen to the screen of the element along the cheapest route of the doc paths, see
+    NavigationPlanner. when a step fails, it is recorded and the route is planned again from the screen reached
+    '''
+    planner: NavigationPlanner = self.config.navigation_planner
+    target_screen_name = self.doc.get_api_screen_name(api_name)
+    failed_edges = set()
+    for _ in range(MAX_DEPENDENCE_WIDTH):
+      element_tree = self.element_tree
+      target_ele = element_tree.get_ele_by_xpath(xpath)
+      if target_ele != None:
+        return target_ele
+
+      current_screen_name = self.doc.get_screen_name_by_skeleton(element_tree.skeleton)
+      if not current_screen_name:
+        break
+      if current_screen_name == target_screen_name:
+        # on the screen but the element is not shown, e.g. it is in another tab
+        route = planner.get_reveal_edges(api_name, failed_edges)[:1]
+      else:
+        route = planner.plan(current_screen_name, target_screen_name, failed_edges)
+      if not route:
         break
-      
-      count = 0
-      for action_list in dependency_action[:MAX_DEPENDENCE_DEPTH]:
-        count += 1
-
-        is_match = False
-        dep_id = -1
-        for idx, action in enumerate(reversed(action_list)):
-          element_tree = self.element_tree
-          
-          # try to find the target element in the current UI
-          target_ele = element_tree.get_ele_by_xpath(xpath)
-          if target_ele != None:
-            break
-          
-          current_screen_name = self.doc.get_screen_name_by_skeleton(element_tree.skeleton)
-          if action.screen_name != current_screen_name:
-            continue
-          
-          if action.action_type == 'back' or action.action_type == 'enter':
-            is_match = True
-            dep_id = idx
-            _save2log(
-              save_path=self.save_path,
-              log_file=self.config.log_file,
-              element_tree=element_tree,
-              idx=None,
-              inputs=None,
-              action_type=action.action_type,
-              api_name=None,
-              xpath=None,
-              currently_executing_code=statement,
-              comment='device action',
-              screenshot=self.state.screenshot)
-            self.env.execute_action(
-                {
-                    "action_type": action.action_type
-                })
-            # time.sleep(WAIT_AFTER_ACTION_SECONDS)
-            self.update_state()
-            continue
-          
-          _action_xpath = self.doc.api_xpath.get(action.name, None)
-          if not _action_xpath:
-            continue
-          _target_ele = self.find_and_scroll_target_ele(_action_xpath, statement)
-          
-          if not _target_ele:
-            if is_match:
-              break
-            else:
-              continue
-
-          # execute the action
-          is_match = True
-          dep_id = idx
-          _save2log(
-            save_path=self.save_path,
-            log_file=self.config.log_file,
-            element_tree=element_tree,
-            idx=_target_ele.id if _target_ele else None,
-            inputs=None,
-            action_type=action.action_type,
-            api_name=action.api_name,
-            xpath=_action_xpath,
-            currently_executing_code=statement,
-            comment='navigate',
-            screenshot=self.state.screenshot)
-          
-          executable_action = agent_utils.convert_action(action.action_type, _target_ele, action.text)
-          # finding dependency can tolerate the action error
-          # if executable_action.get('action_type') == 'wait':
-          #   raise ActionError(f'Fail to {action.action_type}({action.api_name})', None, None, action.action_type, action.api_name)
-          self.env.execute_action(executable_action)
-          time.sleep(WAIT_AFTER_ACTION_SECONDS)
-          self.update_state()
-          self.check_last_screen_html()
 
-        if dep_id >= len(action_list) - 1:
-          element_tree = self.element_tree
-          target_ele = element_tree.get_ele_by_xpath(xpath)              
-          break
-          # if target_ele is None, continue to find the next dependency
-        
-        # executed action and changed the screen, we need to find new dependency
-        if is_match:
+      for edge in route:
+        start_time = time.time()
+        is_executed = self._execute_navigation_edge(edge, statement)
+        reached_screen_name = self.doc.get_screen_name_by_skeleton(self.element_tree.skeleton)
+        target_ele = self.element_tree.get_ele_by_xpath(xpath)
+        # the actions of a reveal edge stay on the screen, they only succeed if they show the element
+        is_reveal_edge = edge.from_screen == edge.to_screen
+        if is_executed and (target_ele != None or (not is_reveal_edge and reached_screen_name == edge.to_screen)):
+          planner.record_success(edge, time.time() - start_time)
+        else:
+          planner.record_failure(edge)
+          failed_edges.add(edge.key)
+        if target_ele != None:
+          return target_ele
+        if edge.key in failed_edges:
           break
+    return self.element_tree.get_ele_by_xpath(xpath)
 
-      if count == len(dependency_action):
-        # fail to solve the dependency
-        # target_ele still is None
-        break
-      
-      counter += 1
-    return target_ele
   def get_and_navigate_target_element(self, api_name, xpath, statement):
     # print(f"Looking for xpaths:{xpath}")
     # print(self.element_tree.str)
@@ -663,7 +678,7 @@ Please output only answer that is in the format of the json above and nothing el
                 "direction": 'down', # it happens nothing when it is not scrollable,
                 "time_spent_locating": time_spend_locating
             })
-        time.sleep(WAIT_AFTER_ACTION_SECONDS)
+        self.wait_after_action()
         self.update_state()
         element_tree = self.element_tree
         target_ele = element_tree.get_ele_by_xpath(xpath)
@@ -681,12 +696,31 @@ Please output only answer that is in the format of the json above and nothing el
         comment='action',
         screenshot=self.state.screenshot)
     
+    element_tree = self.element_tree
     executable_action = agent_utils.convert_action(action_type, target_ele, text)
     self.env.execute_action(executable_action)
-    time.sleep(WAIT_AFTER_ACTION_SECONDS)
+    self.wait_after_action()
     self.update_state()
     # print(f"action executed {api_name} {target_ele.full_desc}")
     self.check_action_count()
+    # the element and the tree the action was done on
+    return target_ele, element_tree
+
+  def is_scroll_exhausted(self, element_tree: ElementTree, scrolled_ele: EleAttr, xpath) -> bool:
+    '''
+    whether a scroll left the scrolled element as it was, changes outside of it, e.g. a clock, a toast or a
+    ripple, do not count. the whole screen is compared if the element can not be found after the scroll.
+    '''
+    try:
+      scrolled_ele_after = self.element_tree.get_ele_by_xpath(xpath)
+    except Exception:
+      scrolled_ele_after = None
+    if scrolled_ele_after is not None and scrolled_ele.id in element_tree.node_map and \
+        scrolled_ele_after.id in self.element_tree.node_map:
+      diff = element_tree.diff(self.element_tree, scrolled_ele.id, scrolled_ele_after.id)
+    else:
+      diff = element_tree.diff(self.element_tree)
+    return not (diff['added'] or diff['removed'] or diff['changed'])
   
   def tap(self, button_api):
     # get the currently executing code
@@ -762,8 +796,6 @@ Please output only answer that is in the format of the json above and nothing el
     lineno_in_original_script = self.config.line_mappings[lineno - 1]
     original_code_line = self.config.code_lines[lineno_in_original_script]
 
-    last_screen = self.last_screen
-    
     statement = {
         'current_code': current_code_line,
         'original_lineno': lineno_in_original_script,
@@ -790,8 +822,8 @@ Please output only answer that is in the format of the json above and nothing el
     action_type = f'scroll {direction_str}'
     
     api_name, xpath = self.check_api(scroller_api, action_type, statement)
-    self._execute_action(api_name, xpath, statement, action_type)
-    is_to_bottom = False if not last_screen else self.last_screen == last_screen
+    scrolled_ele, element_tree = self._execute_action(api_name, xpath, statement, action_type)
+    is_to_bottom = self.is_scroll_exhausted(element_tree, scrolled_ele, xpath)
     return is_to_bottom
 
   def get_text(self, element_selector):
@@ -942,7 +974,7 @@ Please output only answer that is in the format of the json above and nothing el
         screenshot=self.state.screenshot)
 
     self.env.execute_action({"action_type": "enter"})
-    time.sleep(WAIT_AFTER_ACTION_SECONDS)
+    self.wait_after_action()
     
     self.check_action_count()
 
@@ -982,13 +1014,13 @@ Please output only answer that is in the format of the json above and nothing el
         screenshot=self.state.screenshot)
 
     self.env.execute_action({"action_type": "back"})
-    time.sleep(WAIT_AFTER_ACTION_SECONDS)
+    self.wait_after_action()
     
     foreground_activity_name = self.env.foreground_activity_name
     # out of the app
     if foreground_activity_name and foreground_activity_name.startswith('com.google.android.apps.nexuslauncher'):
       self.env.execute_action({"action_type": "open_app", "app_name": self.app_name})
-      time.sleep(WAIT_AFTER_ACTION_SECONDS)
+      self.wait_after_action()
     
     self.check_action_count()
 
@@ -1246,7 +1278,7 @@ class ElementList:
                 "view": scrollable_element.view,
                 "direction": direction
             })
-        time.sleep(WAIT_AFTER_ACTION_SECONDS)
+        self.verifier.wait_after_action()
         self.update_state()
 
         is_same = self.check_last_screen_html()
@@ -1340,7 +1372,8 @@ class ElementList:
     target_ele_group, _ = self.verifier.get_and_navigate_target_element(self.api_name, self.element_list_xpath, statement)
     target_ele = None
     element_tree = self.element_tree
-    subtree = element_tree.extract_subtree(target_ele_group.id)
+    # a view of the group in the current tree, so that looking up a child of each item of a list is cheap
+    subtree = element_tree.get_subtree(target_ele_group.id)
     if subtree:
       target_ele = subtree.get_ele_by_xpath(element_selector_xpath)
 
@@ -1406,7 +1439,7 @@ class ElementList:
     
     executable_action = agent_utils.convert_action(action_type, target_ele, text)
     self.env.execute_action(executable_action)
-    time.sleep(WAIT_AFTER_ACTION_SECONDS)
+    self.verifier.wait_after_action()
     self.update_state()
     self.check_action_count()
     
@@ -1602,8 +1635,6 @@ class ElementList:
       lineno_in_original_script = self.config.line_mappings[lineno - 1]
       original_code_line = self.config.code_lines[lineno_in_original_script]
 
-      last_screen = self.verifier.last_screen
-      
       statement = {
           'current_code': current_code_line,
           'original_lineno': lineno_in_original_script,
@@ -1625,8 +1656,8 @@ class ElementList:
         direction_str = 'down'
       action_type = f'scroll {direction_str}'
       
-      self.verifier._execute_action(api_name, xpath, statement, action_type)
-      is_to_bottom = False if not last_screen else self.verifier.last_screen == last_screen
+      scrolled_ele, element_tree = self.verifier._execute_action(api_name, xpath, statement, action_type)
+      is_to_bottom = self.verifier.is_scroll_exhausted(element_tree, scrolled_ele, xpath)
       return is_to_bottom
 
     return self.verifier.scroll(element_selector, direction)
@@ -15,7 +15,9 @@ import pkg_resources
 import shutil
 import subprocess
 from agent.droidbot.device import Device
+from agent.droidbot.readiness import ReadinessProbes
 from agent.droidbot.app import App
+from agent.droidbot.xpath_index import XPathIndex
 from agent.droidbot.input_event import RestartAppEvent
 from agent.environment import AsyncEnv, AsyncDroidBotEnv
 from agent import tools
@@ -24,6 +26,7 @@ from agent.script_utils.ui_apis import CodeConfig, CodeStatus, Verifier, Element
 from agent.script_utils import tools
 from agent.script_utils.bug_processor import BugProcessorV3
 from agent.script_utils.api_doc import ApiDoc
+from agent.script_utils.doc_registry import doc_registry
 from agent.script_utils.err import XPathError, APIError, ActionError, NotFoundError, TaskNotCompletedError
 from dotenv import load_dotenv
 
@@ -35,29 +38,29 @@ Tree Search
 def get_available_elements(doc_path, screen_html, screen_name, use_dash=False):
   # tree = etree.HTML(screen_html)
   # element_tree = etree.ElementTree(tree)
-  doc = tools.load_json_file(doc_path)
+  doc = doc_registry.get_json(doc_path)
   parser = etree.HTMLParser()
   element_tree = etree.fromstring(screen_html, parser)
+  elements = doc[screen_name]['elements']
+  # all xpaths of the screen are matched in one pass over the tree
+  xpath_index = XPathIndex(ele_xpath for element_data in elements.values() for ele_xpath in element_data['xpath'] or [])
+  matched_xpaths, failed_xpaths = xpath_index.match(element_tree, elements_only=False)
+  for ele_xpath in failed_xpaths:
+      print(f'Error in xpath: {ele_xpath}')
+
   available_elements = []
-  for element_name, element_data in doc[screen_name]['elements'].items():
+  for element_name, element_data in elements.items():
       ele_xpaths = element_data['xpath']
       if not ele_xpaths:
           continue
-      for ele_xpath in ele_xpaths:
-          try: 
-              element = element_tree.xpath(ele_xpath)
-          except:
-              print(f'Error in xpath: {ele_xpath}')
-              continue
-          if len(element) > 0:
-              new_element_name = element_name.replace(':', '__') if use_dash else element_name
-              available_elements.append(new_element_name)
-              break
+      if any(ele_xpath in matched_xpaths for ele_xpath in ele_xpaths):
+          new_element_name = element_name.replace(':', '__') if use_dash else element_name
+          available_elements.append(new_element_name)
   return available_elements
 
 def simplify_state(first_state, doc_path):
   # get the name of the first UI state by matching the skeleton structure
-  doc = tools.load_json_file(doc_path)
+  doc = doc_registry.get_json(doc_path)
   max_matched_elements, max_matched_screen_name = 0, ''
   for screen_name, screen_data in doc.items():
       screen_skeleton = screen_data['skeleton']
@@ -248,7 +251,7 @@ class CodeAgent():
       raise ValueError(f'Unknown doc path: {doc_path}')
 
     self.app_name = app_name
-    self.doc = ApiDoc(doc_path)
+    self.doc = doc_registry.get_api_doc(doc_path, app_name).fork()
     self.save_dir = save_path
     
     self.save_path = save_path
@@ -293,19 +296,22 @@ Answer: (True if the task has been fully completed, else False.)
     }
 
   def run_code(self, code, goal):
-    subprocess.run(["adb", "-s", device_serial, "emu", "avd", "snapshot", "load", snapshot_name]) # load snapshot
+    readiness = ReadinessProbes(device_serial)
     print('waiting...')
-    time.sleep(3)
+    readiness.load_snapshot(snapshot_name)
     logging.info("Starting DroidBot")
 
     device = Device(
         device_serial=device_serial,
         is_emulator=True,
-        output_dir=self.output_dir)
+        output_dir=self.output_dir,
+        readiness=readiness)
     
     app = App(self.app_path, self.output_dir)
     env = SubscribableAsyncDroidBotEnv(device, app)
     device.send_event(RestartAppEvent(app=app))
+    device.wait_for_app(app.get_package_name())
+    logging.info(f"readiness wait times: {readiness.get_wait_times()}")
     # subscribe
     self.env = env
     env.add_event_listener(self)
@@ -0,0 +1,337 @@
+# This is a persistent transport to the adb server, it speaks the smart-socket protocol directly, see:
+# https://android.googlesource.com/platform/packages/modules/adb/+/refs/heads/main/SERVICES.TXT
+# https://android.googlesource.com/platform/packages/modules/adb/+/refs/heads/main/OVERVIEW.TXT
+import logging
+import os
+import select
+import socket
+import struct
+import threading
+import uuid
+
+ADB_SERVER_HOST = "127.0.0.1"
+ADB_SERVER_PORT = int(os.environ.get("ANDROID_ADB_SERVER_PORT", 5037))
+ADB_SOCKET_TIMEOUT_S = 60
+MAX_IDLE_SESSIONS_PER_DEVICE = 4
+
+# packet ids of the shell v2 protocol
+SHELL_ID_STDIN = 0
+SHELL_ID_STDOUT = 1
+SHELL_ID_STDERR = 2
+SHELL_ID_EXIT = 3
+SHELL_ID_CLOSE_STDIN = 4
+
+
+class ADBTransportException(Exception):
+    """
+    Exception in the adb server connection
+    """
+    pass
+
+
+class ADBCommandSentException(ADBTransportException):
+    """
+    Exception in the adb server connection after a command was sent, the command may have run on the device
+    """
+    pass
+
+
+class ADBServerConnection(object):
+    """
+    a socket connected to the adb server
+    """
+
+    def __init__(self, host=ADB_SERVER_HOST, port=ADB_SERVER_PORT, timeout=ADB_SOCKET_TIMEOUT_S):
+        try:
+            self.sock = socket.create_connection((host, port), timeout=timeout)
+            # commands are small writes waiting for a reply, do not let Nagle hold them back
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except socket.error as e:
+            raise ADBTransportException("cannot connect to adb server at %s:%d: %s" % (host, port, e))
+
+    def send_request(self, request):
+        """
+        send a service request and wait for the OKAY/FAIL status
+        @param request: str, e.g. host:transport:emulator-5554
+        """
+        self.write_request(request)
+        self.read_status(request)
+
+    def write_request(self, request):
+        if not isinstance(request, bytes):
+            request = request.encode()
+        self.write(b"%04x" % len(request) + request)
+
+    def read_status(self, request):
+        if isinstance(request, bytes):
+            request = request.decode()
+        status = self.read_exactly(4)
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            raise ADBTransportException("adb server refused %s: %s" % (request, self.read_string()))
+        raise ADBTransportException("unexpected adb server status: %r" % status)
+
+    def write(self, data):
+        try:
+            self.sock.sendall(data)
+        except socket.error as e:
+            raise ADBTransportException("failed to write to adb server: %s" % e)
+
+    def read_string(self):
+        """
+        read a hex length-prefixed string
+        """
+        length = int(self.read_exactly(4), 16)
+        return self.read_exactly(length).decode(errors="replace")
+
+    def read_exactly(self, length):
+        buf = bytearray()
+        while len(buf) < length:
+            try:
+                pkt = self.sock.recv(length - len(buf))
+            except socket.error as e:
+                raise ADBTransportException("failed to read from adb server: %s" % e)
+            if not pkt:
+                raise ADBTransportException("adb server closed the connection")
+            buf += pkt
+        return bytes(buf)
+
+    def is_alive(self):
+        """
+        check, without blocking, that the connection is open and has no unread data
+        """
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+        except (socket.error, ValueError):
+            return False
+        # an idle connection is readable only if the remote side closed it or sent data nobody waits for
+        return not readable
+
+    def read_all(self):
+        """
+        read until the remote side closes the connection
+        """
+        chunks = []
+        while True:
+            try:
+                pkt = self.sock.recv(65536)
+            except socket.error as e:
+                raise ADBTransportException("failed to read from adb server: %s" % e)
+            if not pkt:
+                break
+            chunks.append(pkt)
+        return b"".join(chunks)
+
+    def close(self):
+        try:
+            self.sock.close()
+        except socket.error:
+            pass
+
+
+class ShellSession(object):
+    """
+    a persistent `shell,v2,raw:` channel to one device.
+    Commands are written to the stdin of a remote sh and the end of each command is
+    found through a random marker followed by the exit code.
+    """
+
+    def __init__(self, serial, host=ADB_SERVER_HOST, port=ADB_SERVER_PORT):
+        self.serial = serial
+        self.marker = ("__droidbot_eoc_%s__" % uuid.uuid4().hex).encode()
+        self.conn = ADBServerConnection(host, port)
+        try:
+            self.conn.send_request("host:transport:%s" % serial)
+            self.conn.send_request("shell,v2,raw:")
+        except ADBTransportException:
+            self.conn.close()
+            raise
+
+    def run(self, command):
+        """
+        run a command in the session
+        @param command: str, a command line that is already quoted for sh
+        @return: (stdout, stderr, exit code), stdout and stderr are bytes
+        """
+        # stdin is redirected so that the command cannot consume the next command line
+        line = "(%s) </dev/null; echo \"%s$?\"\n" % (command, self.marker.decode())
+        # sh runs the line once its newline arrives, the newline is the last byte, so a failed write did not run it
+        self._write_packet(SHELL_ID_STDIN, line.encode())
+        try:
+            return self._read_output()
+        except ADBCommandSentException:
+            raise
+        except ADBTransportException as e:
+            raise ADBCommandSentException(str(e))
+
+    def _read_output(self):
+        stdout = bytearray()
+        stderr = bytearray()
+        while True:
+            packet_id, data = self._read_packet()
+            if packet_id == SHELL_ID_STDOUT:
+                stdout += data
+                marker_idx = stdout.find(self.marker)
+                if marker_idx < 0:
+                    continue
+                line_end = stdout.find(b"\n", marker_idx)
+                if line_end < 0:
+                    continue
+                exit_code = int(stdout[marker_idx + len(self.marker):line_end])
+                return bytes(stdout[:marker_idx]), bytes(stderr), exit_code
+            elif packet_id == SHELL_ID_STDERR:
+                stderr += data
+            elif packet_id == SHELL_ID_EXIT:
+                raise ADBCommandSentException("shell session on %s exited unexpectedly" % self.serial)
+
+    def _write_packet(self, packet_id, data):
+        self.conn.write(struct.pack("<BI", packet_id, len(data)) + data)
+
+    def is_alive(self):
+        return self.conn.is_alive()
+
+    def _read_packet(self):
+        packet_id, length = struct.unpack("<BI", self.conn.read_exactly(5))
+        return packet_id, self.conn.read_exactly(length)
+
+    def close(self):
+        try:
+            self._write_packet(SHELL_ID_CLOSE_STDIN, b"")
+        except ADBTransportException:
+            pass
+        self.conn.close()
+
+
+class ADBTransport(object):
+    """
+    talks to the adb server without spawning adb processes.
+    Keeps a pool of persistent shell sessions per device serial.
+    """
+
+    def __init__(self, host=ADB_SERVER_HOST, port=ADB_SERVER_PORT,
+                 max_idle_sessions=MAX_IDLE_SESSIONS_PER_DEVICE):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.host = host
+        self.port = port
+        self.max_idle_sessions = max_idle_sessions
+        self.__lock = threading.Lock()
+        self.__idle_sessions = {}
+        self.__features = {}
+
+    def _connect(self):
+        return ADBServerConnection(self.host, self.port)
+
+    def _host_query(self, request):
+        conn = self._connect()
+        try:
+            conn.send_request(request)
+            return conn.read_string()
+        finally:
+            conn.close()
+
+    def get_state(self, serial):
+        """
+        same as `adb -s <serial> get-state`
+        """
+        return self._host_query("host-serial:%s:get-state" % serial)
+
+    def get_features(self, serial):
+        """
+        get the features supported by both adb server and device, e.g. shell_v2
+        """
+        if serial not in self.__features:
+            self.__features[serial] = set(self._host_query("host-serial:%s:features" % serial).split(","))
+        return self.__features[serial]
+
+    def open_service(self, serial, service):
+        """
+        open a one-shot service on the device and read its whole output
+        @param service: str, e.g. shell:ls or exec:screencap -p
+        @return: bytes
+        """
+        conn = self._connect()
+        try:
+            conn.send_request("host:transport:%s" % serial)
+            conn.write_request(service)
+            try:
+                conn.read_status(service)
+                return conn.read_all()
+            except ADBTransportException as e:
+                raise ADBCommandSentException(str(e))
+        finally:
+            conn.close()
+
+    def shell(self, serial, command):
+        """
+        run a shell command on the device
+        @param command: str, a command line that is already quoted for sh
+        @return: (stdout, exit code), stdout is bytes
+        """
+        if "shell_v2" not in self.get_features(serial):
+            # legacy devices have no exit code and mix stderr into stdout
+            return self.open_service(serial, "shell:%s" % command), 0
+
+        session = self.__acquire(serial)
+        try:
+            stdout, stderr, exit_code = session.run(command)
+        except Exception:
+            session.close()
+            raise
+        if stderr:
+            self.logger.debug("stderr of `%s`: %s" % (command, stderr.decode(errors="replace")))
+        self.__release(session)
+        return stdout, exit_code
+
+    def __acquire(self, serial):
+        while True:
+            with self.__lock:
+                sessions = self.__idle_sessions.get(serial)
+                if not sessions:
+                    break
+                session = sessions.pop()
+            # e.g. the adb server restarted, a command written to the session would not be run
+            if session.is_alive():
+                return session
+            session.close()
+        return ShellSession(serial, self.host, self.port)
+
+    def __release(self, session):
+        with self.__lock:
+            sessions = self.__idle_sessions.setdefault(session.serial, [])
+            if len(sessions) < self.max_idle_sessions:
+                sessions.append(session)
+                return
+        session.close()
+
+    def close(self, serial=None):
+        """
+        close the idle sessions of a device, or of all devices if serial is None
+        """
+        with self.__lock:
+            if serial is None:
+                serials = list(self.__idle_sessions.keys())
+                self.__features.clear()
+            else:
+                serials = [serial]
+                self.__features.pop(serial, None)
+            sessions = []
+            for s in serials:
+                sessions += self.__idle_sessions.pop(s, [])
+        for session in sessions:
+            session.close()
+
+
+_default_transport = None
+_default_transport_lock = threading.Lock()
+
+
+def get_default_transport():
+    """
+    get the process-wide transport shared by all ADB adapters
+    """
+    global _default_transport
+    with _default_transport_lock:
+        if _default_transport is None:
+            _default_transport = ADBTransport()
+        return _default_transport
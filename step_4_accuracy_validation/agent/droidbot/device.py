@@ -4,6 +4,7 @@ import re
 import subprocess
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 from .adapter.adb import ADB
 from .adapter.droidbot_app import DroidBotAppConn
@@ -15,9 +16,17 @@ from .adapter.user_input_monitor import UserInputMonitor
 from .adapter.droidbot_ime import DroidBotIme
 from .app import App
 from .intent import Intent
+from .screenshot import Screenshot
+from .frame_gate import FrameDiffGate
+from .readiness import ReadinessProbes
 
 DEFAULT_NUM = '1234567890'
 DEFAULT_CONTENT = 'Hello world!'
+# fields of a DeviceState that can be acquired by get_current_state
+STATE_FIELDS = ("views", "foreground_activity", "activity_stack", "background_services", "screenshot_path")
+MAX_STATE_PROBE_WORKERS = 4
+ACTIVITY_LINE_RE = re.compile(r'\*\s*Hist\s*#\d+:\s*ActivityRecord\{[^ ]+\s*[^ ]+\s*([^ ]+)\s*t(\d+)}')
+ACTIVITY_LINE_TASK_RE = re.compile(r'^\s*Task\s*id\s*#(\d+)|^\s*Task\{\w+\s*#(\d+)')
 
 
 class Device(object):
@@ -27,11 +36,12 @@ class Device(object):
 
     def __init__(self, device_serial=None, is_emulator=False, output_dir=None,
                  cv_mode=False, grant_perm=False, telnet_auth_token=None,
-                 enable_accessibility_hard=False, humanoid=None, ignore_ad=False):
+                 enable_accessibility_hard=False, humanoid=None, ignore_ad=False, readiness=None):
         """
         initialize a device connection
         :param device_serial: serial number of target device
         :param is_emulator: boolean, type of device, True for emulator, False for real device
+        :param readiness: instance of ReadinessProbes to record the waits in, e.g. the one of the emulator controller
         :return:
         """
         self.logger = logging.getLogger(self.__class__.__name__)
@@ -47,6 +57,7 @@ class Device(object):
             self.logger.warning("Seems like you are using an emulator. If so, please add is_emulator option.")
         self.serial = device_serial
         self.is_emulator = is_emulator
+        self.readiness = readiness if readiness is not None else ReadinessProbes(device_serial)
         self.cv_mode = cv_mode
         self.output_dir = output_dir
         if output_dir is not None:
@@ -69,6 +80,10 @@ class Device(object):
         self.last_know_state = None
         self.__used_ports = []
         self.pause_sending_event = False
+        self.__state_probe_executor = None
+        # skips acquiring a new state while the minicap frames show an unchanged screen
+        self.frame_gate = FrameDiffGate()
+        self.__last_state_fields = set()
 
         # adapters
         self.adb = ADB(device=self)
@@ -122,17 +137,7 @@ class Device(object):
         :return:
         """
         self.logger.info("waiting for device")
-        try:
-            subprocess.check_call(["adb", "-s", self.serial, "wait-for-device"])
-            # while True:
-            #     out = subprocess.check_output(
-            #         ["adb", "-s", self.serial, "shell", "getprop", "init.svc.bootanim"]).split()[0]
-            #     if not isinstance(out, str):
-            #         out = out.decode()
-            #     if out == "stopped":
-            #         break
-            #     time.sleep(1)
-        except:
+        if not self.readiness.wait_for_boot_completed():
             self.logger.warning("error waiting for device")
 
     def set_up(self):
@@ -157,6 +162,8 @@ class Device(object):
             if not adapter_enabled:
                 continue
             adapter.connect()
+        # the droidbot app socket is connected by its listener thread
+        self.readiness.wait_for_adapters(self)
 
         self.get_sdk_version()
         self.get_release_version()
@@ -192,6 +199,9 @@ class Device(object):
             if not adapter_enabled:
                 continue
             adapter.tear_down()
+        if self.__state_probe_executor is not None:
+            self.__state_probe_executor.shutdown(wait=False)
+            self.__state_probe_executor = None
 
     def is_foreground(self, app):
         """
@@ -476,6 +486,7 @@ class Device(object):
             cmd = intent.get_cmd()
         else:
             cmd = intent
+        self.frame_gate.reset()
         return self.adb.shell(cmd)
 
     def send_event(self, event):
@@ -484,6 +495,8 @@ class Device(object):
         :param event: the event to be sent
         :return:
         """
+        # the next frame may not show the effect of the event yet
+        self.frame_gate.reset()
         event.send(self)
 
     def start_app(self, app):
@@ -527,26 +540,19 @@ class Device(object):
         """
         Get current activity
         """
-        r = self.adb.shell("dumpsys activity activities")
-        activity_line_re = re.compile(r'\*\s*Hist\s*#\d+:\s*ActivityRecord\{[^ ]+\s*[^ ]+\s*([^ ]+)\s*t(\d+)}')
-        m = activity_line_re.search(r)
-        if m:
-            return m.group(1)
-        # data = self.adb.shell("dumpsys activity top").splitlines()
-        # regex = re.compile("\s*ACTIVITY ([A-Za-z0-9_.]+)/([A-Za-z0-9_.]+)")
-        # m = regex.search(data[1])
-        # if m:
-        #     return m.group(1) + "/" + m.group(2)
-        self.logger.warning("Unable to get top activity name.")
-        return None
+        top_activity, _ = self.__get_activities()
+        if top_activity is None:
+            self.logger.warning("Unable to get top activity name.")
+        return top_activity
 
     def get_current_activity_stack(self):
         """
         Get current activity stack
         :return: a list of str, each str is an activity name, the first is the top activity name
         """
-        task_to_activities = self.get_task_activities()
-        top_activity = self.get_top_activity_name()
+        return self.__get_activity_stack(*self.__get_activities())
+
+    def __get_activity_stack(self, top_activity, task_to_activities):
         if top_activity:
             for task_id in task_to_activities:
                 activities = task_to_activities[task_id]
@@ -562,15 +568,27 @@ class Device(object):
         Get current tasks and corresponding activities.
         :return: a dict mapping each task id to a list of activities, from top to down.
         """
-        task_to_activities = {}
+        _, task_to_activities = self.__get_activities()
+        return task_to_activities
 
-        lines = self.adb.shell("dumpsys activity activities").splitlines()
-        activity_line_re = re.compile(r'\*\s*Hist\s*#\d+:\s*ActivityRecord\{[^ ]+\s*[^ ]+\s*([^ ]+)\s*t(\d+)}')
+    def __get_activities(self):
+        """
+        Run `dumpsys activity activities` once and parse both the top activity and the tasks.
+        :return: (top activity name or None, dict mapping each task id to a list of activities from top to down)
+        """
+        r = self.adb.shell("dumpsys activity activities")
+        m = ACTIVITY_LINE_RE.search(r)
+        top_activity = m.group(1) if m else None
+        # data = self.adb.shell("dumpsys activity top").splitlines()
+        # regex = re.compile("\s*ACTIVITY ([A-Za-z0-9_.]+)/([A-Za-z0-9_.]+)")
+        # m = regex.search(data[1])
+        # if m:
+        #     return m.group(1) + "/" + m.group(2)
 
-        for line in lines:
+        task_to_activities = {}
+        for line in r.splitlines():
             line = line.strip()
-            activity_line_task_re = re.compile(r'^\s*Task\s*id\s*#(\d+)|^\s*Task\{\w+\s*#(\d+)')
-            activity_line_task_m = activity_line_task_re.match(line)
+            activity_line_task_m = ACTIVITY_LINE_TASK_RE.match(line)
             if activity_line_task_m:
                 if activity_line_task_m.group(1):
                     task_id = activity_line_task_m.group(1)
@@ -578,7 +596,7 @@ class Device(object):
                     task_id = activity_line_task_m.group(2)
                 task_to_activities[task_id] = []
             elif re.match(r'\*\s*Hist\s*#', line):
-                m = activity_line_re.match(line)
+                m = ACTIVITY_LINE_RE.match(line)
                 if m:
                     activity = m.group(1)
                     task_id = m.group(2)
@@ -586,7 +604,7 @@ class Device(object):
                         task_to_activities[task_id] = []
                     task_to_activities[task_id].append(activity)
 
-        return task_to_activities
+        return top_activity, task_to_activities
 
     def get_service_names(self):
         """
@@ -787,66 +805,56 @@ class Device(object):
     def pull_file(self, remote_file, local_file):
         self.adb.run_cmd(["pull", remote_file, local_file])
 
-    def take_screenshot(self, image_path=None, name=None):
-        # image = None
-        #
-        # received = self.adb.shell("screencap -p").replace("\r\n", "\n")
-        # import StringIO
-        # stream = StringIO.StringIO(received)
-        #
-        # try:
-        #     from PIL import Image
-        #     image = Image.open(stream)
-        # except IOError as e:
-        #     self.logger.warning("exception in take_screenshot: %s" % e)
-        # return image
-        from datetime import datetime
-        tag = datetime.now().strftime("%Y-%m-%d_%H%M%S")
-        
-        local_image_dir = image_path if image_path is not None else os.path.join(self.output_dir, "temp")
-        
-        if not os.path.exists(local_image_dir):
-            os.makedirs(local_image_dir)
-
-        if self.adapters[self.minicap] and self.minicap.last_screen:
+    def capture_screenshot(self):
+        """
+        capture the screen into memory, from the latest minicap frame if available, otherwise via exec-out screencap
+        :return: (bytes, image format), the format is "jpg" for minicap and "png" for screencap
+        """
+        if self.adapters.get(self.minicap) and self.minicap.last_screen:
             # minicap use jpg format
-            image_name = name if f"{name}.jpg" is not None else "screen_%s.jpg" % tag
-            local_image_path = os.path.join(local_image_dir, image_name)
-            with open(local_image_path, 'wb') as local_image_file:
-                local_image_file.write(self.minicap.last_screen)
-            return local_image_path
-        else:
-            # screencap use png format
-            image_name = f"{name}.png" if name is not None else "screen_%s.png" % tag
-            local_image_path = os.path.join(local_image_dir, image_name)
-            remote_image_path = f"/sdcard/{image_name}"
-            self.adb.shell("screencap -p %s" % remote_image_path)
-            self.pull_file(remote_image_path, local_image_path)
-            self.adb.shell("rm %s" % remote_image_path)
+            return self.minicap.last_screen, "jpg"
+        # screencap use png format
+        return self.adb.exec_out("screencap -p"), "png"
 
-        return local_image_path
+    def take_screenshot(self, image_path=None, name=None):
+        """
+        capture the screen and write it to a file
+        :param image_path: directory of the image, <output_dir>/temp by default
+        :param name: file name without extension, screen_<time> by default
+        :return: path of the image file
+        """
+        return Screenshot(self).save(image_path=image_path, name=name)
 
-    def get_current_state(self):
+    def get_current_state(self, fields=None):
+        """
+        get the current state of the device
+        :param fields: names in STATE_FIELDS to acquire, None for all of them. views are always acquired,
+                       the others are set to None when not requested. The screenshot is only captured when
+                       the screenshot_path of the state is read
+        :return: DeviceState
+        """
         self.logger.debug("getting current device state...")
+        fields = set(STATE_FIELDS if fields is None else fields)
+        fields.add("views")
+        frame = self.get_screen_frame()
+        if self.last_know_state is not None and fields <= self.__last_state_fields \
+                and not self.frame_gate.is_changed(frame):
+            self.logger.debug("screen unchanged, reusing the last state")
+            self.frame_gate.skip()
+            return self.last_know_state
         current_state = None
         while True:
             try:
-                views = self.get_views()
-                foreground_activity = self.get_top_activity_name()
-                activity_stack = self.get_current_activity_stack()
-                background_services = self.get_service_names()
-                screenshot_path = self.take_screenshot()
+                state_fields = self.__acquire_state_fields(fields)
+                self.__check_display_info(state_fields["views"])
                 self.logger.debug("finish getting current device state...")
                 from .device_state import DeviceState
-                
-                current_state = DeviceState(self,
-                                            views=views,
-                                            foreground_activity=foreground_activity,
-                                            activity_stack=activity_stack,
-                                            background_services=background_services,
-                                            screenshot_path=screenshot_path)
+
+                current_state = DeviceState(self, **state_fields)
                 self.logger.debug("finish getting current device state...")
                 self.last_know_state = current_state
+                self.__last_state_fields = fields
+                self.frame_gate.accept(frame)
                 if not current_state:
                     self.logger.warning("Failed to get current state!")
                 return current_state
@@ -859,10 +867,88 @@ class Device(object):
                 traceback.print_exc()
                 return current_state
 
+    def __acquire_state_fields(self, fields):
+        """
+        run each distinct probe needed by the fields once, concurrently
+        :param fields: set of names in STATE_FIELDS
+        :return: dict mapping each name in STATE_FIELDS to its value, None if not requested
+        """
+        probes = {"views": self.get_views}
+        if "foreground_activity" in fields or "activity_stack" in fields:
+            # foreground activity and activity stack share one dumpsys
+            probes["activities"] = self.__get_activities
+        if "background_services" in fields:
+            probes["background_services"] = self.get_service_names
+
+        if self.__state_probe_executor is None:
+            self.__state_probe_executor = ThreadPoolExecutor(max_workers=MAX_STATE_PROBE_WORKERS,
+                                                             thread_name_prefix="state_probe")
+        futures = {name: self.__state_probe_executor.submit(probe) for name, probe in probes.items()}
+        results = {name: future.result() for name, future in futures.items()}
+
+        state_fields = dict.fromkeys(STATE_FIELDS)
+        state_fields["views"] = results["views"]
+        if "activities" in results:
+            top_activity, task_to_activities = results["activities"]
+            if top_activity is None:
+                self.logger.warning("Unable to get top activity name.")
+            if "foreground_activity" in fields:
+                state_fields["foreground_activity"] = top_activity
+            if "activity_stack" in fields:
+                state_fields["activity_stack"] = self.__get_activity_stack(top_activity, task_to_activities)
+        state_fields["background_services"] = results.get("background_services")
+        if "screenshot_path" in fields:
+            # captured when the state's screenshot_path is first read
+            state_fields["screenshot_path"] = Screenshot(self)
+        return state_fields
+
+    def __check_display_info(self, views):
+        """
+        drop the cached display info if the root view does not fit in it, i.e. the screen has rotated
+        """
+        if self.display_info is None or not views:
+            return
+        (x1, y1), (x2, y2) = views[0]["bounds"]
+        if x2 - x1 > self.display_info.get("width", 0) or y2 - y1 > self.display_info.get("height", 0):
+            self.display_info = None
+
+    def wait_for_idle(self, idle_time, timeout, settle_time=0):
+        """
+        wait for the UI to settle, using the accessibility event stream of the droidbot app
+        :param idle_time: seconds without window or content changes for the UI to be considered idle
+        :param timeout: maximum seconds to wait
+        :param settle_time: seconds without any change since the call for the UI to be considered idle
+        :return: True if the UI became idle, False on timeout, None if the event stream is not available
+        """
+        if not self.adapters.get(self.droidbot_app) or not self.droidbot_app.check_connectivity():
+            return None
+        return self.droidbot_app.wait_for_idle(idle_time, timeout, settle_time)
+
+    def wait_for_app(self, package_name, timeout=None):
+        """
+        wait until the app is in the foreground and its views are available
+        :param package_name: str
+        :param timeout: maximum seconds to wait, the probe default if None
+        :return: True if the app is ready
+        """
+        if timeout is None:
+            return self.readiness.wait_for_app_foreground(self, package_name)
+        return self.readiness.wait_for_app_foreground(self, package_name, timeout)
+
+    def get_screen_frame(self):
+        """
+        get the latest frame streamed by minicap
+        :return: bytes of a jpg image, None if minicap is not running
+        """
+        if self.adapters.get(self.minicap) and self.minicap.check_connectivity():
+            return self.minicap.last_screen
+        return None
+
     def get_last_known_state(self):
         return self.last_know_state
 
     def view_touch(self, x, y):
+        self.frame_gate.reset()
         self.adb.touch(x, y)
 
     def view_long_touch(self, x, y, duration=2000):
@@ -871,21 +957,25 @@ class Device(object):
         @param duration: duration in ms
         This workaround was suggested by U{HaMi<http://stackoverflow.com/users/2571957/hami>}
         """
+        self.frame_gate.reset()
         self.adb.long_touch(x, y, duration)
 
     def view_drag(self, start_xy, end_xy, duration):
         """
         Sends drag event n PX (actually it's using C{input swipe} command.
         """
+        self.frame_gate.reset()
         self.adb.drag(start_xy, end_xy, duration)
 
     def view_append_text(self, text):
+        self.frame_gate.reset()
         if self.droidbot_ime.connected:
             self.droidbot_ime.input_text(text=text, mode=1)
         else:
             self.adb.type(text)
 
     def view_set_text(self, text):
+        self.frame_gate.reset()
         if self.droidbot_ime.connected:
             self.droidbot_ime.input_text(text=text, mode=0)
         else:
@@ -893,6 +983,7 @@ class Device(object):
             self.adb.type(text)
 
     def key_press(self, key_code):
+        self.frame_gate.reset()
         self.adb.press(key_code)
 
     def shutdown(self):
@@ -932,6 +1023,8 @@ class Device(object):
         return port
 
     def handle_rotation(self):
+        self.display_info = None
+        self.frame_gate.reset()
         if not self.adapters[self.minicap]:
             return
         self.pause_sending_event = True
@@ -1,14 +1,68 @@
 import copy
+import hashlib
 import math
 import os
 import json
 import re
+import sys
+import threading
+from functools import cached_property
+from html.parser import HTMLParser
 import tools as tools
 
 from lxml import etree
 
 from .utils import md5
 from .input_event import TouchEvent, LongTouchEvent, ScrollEvent, SetTextEvent, KeyEvent
+from .screenshot import Screenshot
+
+# view properties rendered by ElementTree.str, the fingerprint changes whenever one of them changes
+FINGERPRINT_VIEW_KEYS = ('temp_id', 'parent', 'children', 'class', 'resource_id', 'text', 'content_description',
+                         'visible', 'checked', 'selected', 'clickable', 'checkable', 'long_clickable', 'scrollable',
+                         'editable')
+# view properties that repeat across the views and states, one copy of each value is kept
+INTERNED_VIEW_KEYS = ('class', 'resource_id', 'package')
+# EleAttr attributes shown in the html descriptions of the element
+HTML_DESC_ATTRS = frozenset(('id', 'resource_id', 'type_', 'alt', 'status', 'content'))
+# compiled XPath expressions by expression, per thread because lxml XPath objects must not be shared between threads
+_compiled_xpaths = threading.local()
+
+
+def get_compiled_xpath(xpath: str) -> etree.XPath:
+    """
+    compile an XPath expression once per process and thread
+    :param xpath: str, the XPath expression
+    :return: etree.XPath, raises etree.XPathSyntaxError if the expression is invalid
+    """
+    compiled_xpaths = getattr(_compiled_xpaths, 'xpaths', None)
+    if compiled_xpaths is None:
+        compiled_xpaths = _compiled_xpaths.xpaths = {}
+    compiled_xpath = compiled_xpaths.get(xpath)
+    if compiled_xpath is None:
+        compiled_xpath = compiled_xpaths[xpath] = etree.XPath(xpath)
+    return compiled_xpath
+
+
+def get_hash64(value) -> int:
+    """
+    a 64-bit hash of a value made of str, int, None, tuples and lists, the same in every process
+    """
+    data = repr(value).encode('utf-8', 'surrogatepass')
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'big')
+
+
+# the root of the skeleton of a screen, named as the BeautifulSoup document the skeletons used to be parsed to
+SKELETON_DOCUMENT_TAG = '[document]'
+# tags html.parser closes right after their start tag, as BeautifulSoup does
+SKELETON_VOID_TAGS = frozenset(('area', 'base', 'basefont', 'bgsound', 'br', 'col', 'command', 'embed', 'frame', 'hr',
+                                'image', 'img', 'input', 'isindex', 'keygen', 'link', 'menuitem', 'meta', 'nextid',
+                                'param', 'source', 'spacer', 'track', 'wbr'))
+# tags whose contents BeautifulSoup.prettify does not indent
+SKELETON_PRESERVE_WHITESPACE_TAGS = frozenset(('pre', 'textarea'))
+# tags whose contents html.parser reads as text
+SKELETON_CDATA_TAGS = frozenset(('script', 'style'))
+# html.parser only reads '<' followed by a letter as a start tag
+SKELETON_TAG_NAME_RE = re.compile(r'[a-zA-Z][^\t\n\r\f />\x00]*')
 
 class DeviceState(object):
     """
@@ -24,23 +78,71 @@ class DeviceState(object):
             from datetime import datetime
             tag = datetime.now().strftime("%Y-%m-%d_%H%M%S")
         self.tag = tag
-        self.screenshot_path = screenshot_path
-        self.views = self.__parse_views(views)
-        self.view_tree = {}
-        self.__assemble_view_tree(self.view_tree, self.views)
-        self.__generate_view_strs()
-        self.state_str_ = self.__get_state_str()[:6]
-        self.structure_str_ = self.__get_content_free_state_str()[:6]
-        self.search_content = self.__get_search_content()
-        
-        self.text_representation = self.get_text_representation()
+        # screenshot_path is either a path or a Screenshot that is captured and written on first read
+        self.screenshot = screenshot_path
+        self.__screenshot_path = None if isinstance(screenshot_path, Screenshot) else screenshot_path
+        self.__views = self.__parse_views(views)
+        # a cheap fingerprint for comparing states, the other representations are derived on first access
+        self.fingerprint = self.__get_fingerprint()
+        # the views as parsed for view_tree, the views get derived keys, e.g. bound_box and allowed_actions,
+        # and EleAttr prunes their children lists. the values are not modified, so a shallow copy is enough
+        self.__raw_views = [dict(view, children=list(view.get('children', []))) for view in self.__views]
+        self.__view_strs_generated = False
         self.possible_events = None
         if self.device is not None:
-            self.width = device.get_width(refresh=True)
+            self.width = device.get_width(refresh=False)
             self.height = device.get_height(refresh=False)
             self.is_popup = self.is_popup_window()
             self.parent_state = None
 
+    @property
+    def screenshot_path(self):
+        if self.__screenshot_path is None and isinstance(self.screenshot, Screenshot):
+            self.__screenshot_path = self.screenshot.path
+        return self.__screenshot_path
+
+    @screenshot_path.setter
+    def screenshot_path(self, screenshot_path):
+        self.__screenshot_path = screenshot_path
+
+    @property
+    def views(self):
+        """
+        the parsed views with the keys derived from them, e.g. view_str, bound_box and allowed_actions.
+        the keys are derived on first access, polling a state, e.g. for its fingerprint, does not derive them
+        """
+        self.state_str_
+        self.structure_str_
+        self.search_content
+        self.text_representation
+        return self.__views
+
+    @cached_property
+    def view_tree(self):
+        if not len(self.__views): # to fix if views is empty
+            return {}
+        view_tree = copy.deepcopy(self.__raw_views[0])
+        self.__assemble_view_tree(view_tree, self.__raw_views)
+        return view_tree
+
+    @cached_property
+    def state_str_(self):
+        self.__generate_view_strs()
+        return self.__get_state_str()[:6]
+
+    @cached_property
+    def structure_str_(self):
+        self.__generate_view_strs()
+        return self.__get_content_free_state_str()[:6]
+
+    @cached_property
+    def search_content(self):
+        return self.__get_search_content()
+
+    @cached_property
+    def text_representation(self):
+        return self.get_text_representation()
+
     @property
     def state_str(self):
         if self.is_popup and self.parent_state is not None:
@@ -61,10 +163,10 @@ class DeviceState(object):
     
     @property
     def root_view_bounds(self):
-        return self.views[0]['bounds']
+        return self.__views[0]['bounds']
     
     def is_popup_window(self):
-        root_view = self.views[0]
+        root_view = self.__views[0]
         root_width = DeviceState.get_view_width(root_view)
         root_height = DeviceState.get_view_height(root_view)
         if root_width < self.width or root_height < self.height:
@@ -93,6 +195,10 @@ class DeviceState(object):
             return views
 
         for view_dict in raw_views:
+            for key in INTERNED_VIEW_KEYS:
+                value = view_dict.get(key)
+                if isinstance(value, str):
+                    view_dict[key] = sys.intern(value)
             # # Simplify resource_id
             # resource_id = view_dict['resource_id']
             # if resource_id is not None and ":" in resource_id:
@@ -102,24 +208,68 @@ class DeviceState(object):
         return views
 
     def __assemble_view_tree(self, root_view, views):
-        if not len(self.view_tree): # bootstrap
-            if not len(views): # to fix if views is empty
-                return
-            self.view_tree = copy.deepcopy(views[0])
-            self.__assemble_view_tree(self.view_tree, views)
-        else:
-            children = list(enumerate(root_view["children"]))
-            if not len(children):
-                return
-            for i, j in children:
-                root_view["children"][i] = copy.deepcopy(self.views[j])
-                self.__assemble_view_tree(root_view["children"][i], views)
+        children = list(enumerate(root_view["children"]))
+        if not len(children):
+            return
+        for i, j in children:
+            root_view["children"][i] = copy.deepcopy(views[j])
+            self.__assemble_view_tree(root_view["children"][i], views)
+
+    def __get_fingerprint(self):
+        """
+        hash the properties of all views that are rendered in the element tree, without building it
+        :return: str
+        """
+        return md5(repr([[view.get(key) for key in FINGERPRINT_VIEW_KEYS] for view in self.__views]))
 
     def __generate_view_strs(self):
-        for view_dict in self.views:
-            self.__get_view_str(view_dict)
+        if self.__view_strs_generated:
+            return
+        self.__view_strs_generated = True
+        # "//"-joined signatures from the root down to each view
+        signature_paths = self.__fold_ancestors(
+            lambda parent_path, view_dict: DeviceState.__get_view_signature(view_dict) if parent_path is None
+            else parent_path + "//" + DeviceState.__get_view_signature(view_dict), None)
+        for view_dict in self.__views:
+            parent_id = self.__safe_dict_get(view_dict, 'parent', -1)
+            parent_str = signature_paths[parent_id] if 0 <= parent_id < len(self.__views) else ""
+            self.__get_view_str(view_dict, parent_str)
             # self.__get_view_structure(view_dict)
 
+    def __fold_ancestors(self, fold, initial):
+        """
+        compute a value for every view from the value of its parent, visiting each view once
+        :param fold: callable (value of the parent, view_dict) -> value of the view
+        :param initial: the value passed to fold for the root views
+        :return: list, the value of each view by temp id
+        """
+        values = [None] * len(self.__views)
+        done = [False] * len(self.__views)
+        for view_id in range(len(self.__views)):
+            # climb to the closest ancestor that has its value already, then fold back down
+            path = []
+            ancestor_id = view_id
+            while 0 <= ancestor_id < len(self.__views) and not done[ancestor_id]:
+                path.append(ancestor_id)
+                ancestor_id = self.__safe_dict_get(self.__views[ancestor_id], 'parent', -1)
+            value = values[ancestor_id] if 0 <= ancestor_id < len(self.__views) else initial
+            for path_id in reversed(path):
+                value = fold(value, self.__views[path_id])
+                values[path_id] = value
+                done[path_id] = True
+        return values
+
+    def get_inherited_properties(self, keys=('clickable', 'checkable', 'long_clickable')):
+        """
+        get the properties views inherit from their ancestors, the same as _get_self_ancestors_property for each view
+        :param keys: the view properties
+        :return: list by temp id of tuples, the first truthy value of each key on the view and its ancestors, or None
+        """
+        return self.__fold_ancestors(
+            lambda parent_values, view_dict: tuple(view_dict.get(key) or parent_value
+                                                   for key, parent_value in zip(keys, parent_values)),
+            (None,) * len(keys))
+
     @staticmethod
     def __calculate_depth(views):
         root_view = None
@@ -151,7 +301,7 @@ class DeviceState(object):
             }))
         else:
             view_signatures = set()
-            for view in self.views:
+            for view in self.__views:
                 view_signature = DeviceState.__get_view_signature(view)
                 if view_signature:
                     view_signatures.add(view_signature)
@@ -169,7 +319,7 @@ class DeviceState(object):
             }))
         else:
             view_signatures = set()
-            for view in self.views:
+            for view in self.__views:
                 view_signature = DeviceState.__get_content_free_view_signature(view)
                 if view_signature:
                     view_signatures.add(view_signature)
@@ -192,7 +342,7 @@ class DeviceState(object):
         :return: a list of property values
         """
         property_values = set()
-        for view in self.views:
+        for view in self.__views:
             property_value = DeviceState.__safe_dict_get(view, property_name, None)
             if property_value:
                 property_values.add(property_value)
@@ -233,6 +383,7 @@ class DeviceState(object):
                     output_dir = os.path.join(self.device.output_dir, "views")
             if not os.path.exists(output_dir):
                 os.makedirs(output_dir)
+            self.__generate_view_strs()
             view_str = view_dict['view_str']
             if self.device.adapters[self.device.minicap]:
                 view_file_path = "%s/view_%s.jpg" % (output_dir, view_str)
@@ -303,25 +454,28 @@ class DeviceState(object):
         view_dict['content_free_signature'] = content_free_signature
         return content_free_signature
 
-    def __get_view_str(self, view_dict):
+    def __get_view_str(self, view_dict, parent_str=None):
         """
         get a string which can represent the given view
         @param view_dict: dict, an element of list DeviceState.views
+        @param parent_str: the "//"-joined signatures of the ancestors, from the root down, if already known
         @return:
         """
         if 'view_str' in view_dict:
             return view_dict['view_str']
         view_signature = DeviceState.__get_view_signature(view_dict)
-        parent_strs = []
-        for parent_id in self.get_all_ancestors(view_dict):
-            parent_strs.append(DeviceState.__get_view_signature(self.views[parent_id]))
-        parent_strs.reverse()
+        if parent_str is None:
+            parent_strs = []
+            for parent_id in self.get_all_ancestors(view_dict):
+                parent_strs.append(DeviceState.__get_view_signature(self.__views[parent_id]))
+            parent_strs.reverse()
+            parent_str = "//".join(parent_strs)
         child_strs = []
         for child_id in self.get_all_children(view_dict):
-            child_strs.append(DeviceState.__get_view_signature(self.views[child_id]))
+            child_strs.append(DeviceState.__get_view_signature(self.__views[child_id]))
         child_strs.sort()
         view_str = "Activity:%s\nSelf:%s\nParents:%s\nChildren:%s" % \
-                   (self.foreground_activity, view_signature, "//".join(parent_strs), "||".join(child_strs))
+                   (self.foreground_activity, view_signature, parent_str, "||".join(child_strs))
         import hashlib
         view_str = hashlib.md5(view_str.encode('utf-8')).hexdigest()
         view_dict['view_str'] = view_str
@@ -348,7 +502,7 @@ class DeviceState(object):
         child_view_ids = self.__safe_dict_get(view_dict, 'children')
         if child_view_ids:
             for child_view_id in child_view_ids:
-                child_view = self.views[child_view_id]
+                child_view = self.__views[child_view_id]
                 child_x = child_view['bounds'][0][0]
                 child_y = child_view['bounds'][0][1]
                 relative_x, relative_y = child_x - root_x, child_y - root_y
@@ -407,9 +561,9 @@ class DeviceState(object):
         """
         result = []
         parent_id = self.__safe_dict_get(view_dict, 'parent', -1)
-        if 0 <= parent_id < len(self.views):
+        if 0 <= parent_id < len(self.__views):
             result.append(parent_id)
-            result += self.get_all_ancestors(self.views[parent_id])
+            result += self.get_all_ancestors(self.__views[parent_id])
         return result
 
     def get_all_children(self, view_dict):
@@ -421,11 +575,9 @@ class DeviceState(object):
         children = self.__safe_dict_get(view_dict, 'children')
         if not children:
             return set()
-        children = set(children)
-        for child in children:
-            children_of_child = self.get_all_children(self.views[child])
-            children.union(children_of_child)
-        return children
+        # the descendants were never merged in (set.union returns a new set), and the view_str
+        # of the views depends on the direct children only, so the subtree is not walked
+        return set(children)
 
     def get_app_activity_depth(self, app):
         """
@@ -450,7 +602,7 @@ class DeviceState(object):
         possible_events = []
         enabled_view_ids = []
         touch_exclude_view_ids = set()
-        for view_dict in self.views:
+        for view_dict in self.__views:
             # exclude navigation bar if exists
             if self.__safe_dict_get(view_dict, 'enabled') and \
                     self.__safe_dict_get(view_dict, 'visible') and \
@@ -461,31 +613,31 @@ class DeviceState(object):
         # enabled_view_ids.reverse()
 
         for view_id in enabled_view_ids:
-            if self.__safe_dict_get(self.views[view_id], 'clickable'):
-                possible_events.append(TouchEvent(view=self.views[view_id]))
+            if self.__safe_dict_get(self.__views[view_id], 'clickable'):
+                possible_events.append(TouchEvent(view=self.__views[view_id]))
                 touch_exclude_view_ids.add(view_id)
-                touch_exclude_view_ids.union(self.get_all_children(self.views[view_id]))
+                touch_exclude_view_ids.union(self.get_all_children(self.__views[view_id]))
 
         for view_id in enabled_view_ids:
-            if self.__safe_dict_get(self.views[view_id], 'scrollable'):
-                possible_events.append(ScrollEvent(view=self.views[view_id], direction="up"))
-                possible_events.append(ScrollEvent(view=self.views[view_id], direction="down"))
-                possible_events.append(ScrollEvent(view=self.views[view_id], direction="left"))
-                possible_events.append(ScrollEvent(view=self.views[view_id], direction="right"))
+            if self.__safe_dict_get(self.__views[view_id], 'scrollable'):
+                possible_events.append(ScrollEvent(view=self.__views[view_id], direction="up"))
+                possible_events.append(ScrollEvent(view=self.__views[view_id], direction="down"))
+                possible_events.append(ScrollEvent(view=self.__views[view_id], direction="left"))
+                possible_events.append(ScrollEvent(view=self.__views[view_id], direction="right"))
 
         for view_id in enabled_view_ids:
-            if self.__safe_dict_get(self.views[view_id], 'checkable'):
-                possible_events.append(TouchEvent(view=self.views[view_id]))
+            if self.__safe_dict_get(self.__views[view_id], 'checkable'):
+                possible_events.append(TouchEvent(view=self.__views[view_id]))
                 touch_exclude_view_ids.add(view_id)
-                touch_exclude_view_ids.union(self.get_all_children(self.views[view_id]))
+                touch_exclude_view_ids.union(self.get_all_children(self.__views[view_id]))
 
         for view_id in enabled_view_ids:
-            if self.__safe_dict_get(self.views[view_id], 'long_clickable'):
-                possible_events.append(LongTouchEvent(view=self.views[view_id]))
+            if self.__safe_dict_get(self.__views[view_id], 'long_clickable'):
+                possible_events.append(LongTouchEvent(view=self.__views[view_id]))
 
         for view_id in enabled_view_ids:
-            if self.__safe_dict_get(self.views[view_id], 'editable'):
-                possible_events.append(SetTextEvent(view=self.views[view_id], text="Hello World"))
+            if self.__safe_dict_get(self.__views[view_id], 'editable'):
+                possible_events.append(SetTextEvent(view=self.__views[view_id], text="Hello World"))
                 touch_exclude_view_ids.add(view_id)
                 # TODO figure out what event can be sent to editable views
                 pass
@@ -493,10 +645,10 @@ class DeviceState(object):
         for view_id in enabled_view_ids:
             if view_id in touch_exclude_view_ids:
                 continue
-            children = self.__safe_dict_get(self.views[view_id], 'children')
+            children = self.__safe_dict_get(self.__views[view_id], 'children')
             if children and len(children) > 0:
                 continue
-            possible_events.append(TouchEvent(view=self.views[view_id]))
+            possible_events.append(TouchEvent(view=self.__views[view_id]))
 
         # For old Android navigation bars
         # possible_events.append(KeyEvent(name="MENU"))
@@ -508,8 +660,9 @@ class DeviceState(object):
         """
         Get a text representation of current state
         """
+        self.__generate_view_strs()
         enabled_view_ids = []
-        for view_dict in self.views:
+        for view_dict in self.__views:
             # exclude navigation bar if exists
             if self.__safe_dict_get(view_dict, 'visible') and \
                 self.__safe_dict_get(view_dict, 'resource_id') not in \
@@ -518,28 +671,29 @@ class DeviceState(object):
                 enabled_view_ids.append(view_dict['temp_id'])
         
 
+        enabled_view_id_set = set(enabled_view_ids)
+        inherited_properties = self.get_inherited_properties(('clickable', 'checkable', 'long_clickable'))
+
         view_descs = []
         indexed_views = []
         # available_actions = []
-        removed_view_ids = []
+        removed_view_ids = set()
         element_tree = None
         element_attr = {}
         for view_id in enabled_view_ids:
-            view = self.views[view_id]
+            view = self.__views[view_id]
             idx = view.get('temp_id', -1)
             child_ids = view.get('children', [])
-            ele_attr = EleAttr(idx, child_ids, view, self.views,  enabled_view_ids=enabled_view_ids)
+            ele_attr = EleAttr(idx, child_ids, view, self.__views,  enabled_view_ids=enabled_view_id_set)
             element_attr[view_id] = ele_attr
             ele_attr.set_type('div')
             if view_id in removed_view_ids:
                 continue
             # print(view_id)
-            clickable = self._get_self_ancestors_property(view, 'clickable')
+            clickable, checkable, long_clickable = inherited_properties[view_id]
             self_clickable = self.__safe_dict_get(view, 'clickable')
             scrollable = self.__safe_dict_get(view, 'scrollable')
             class_type = self.__safe_dict_get(view, 'class')
-            checkable = self._get_self_ancestors_property(view, 'checkable')
-            long_clickable = self._get_self_ancestors_property(view, 'long_clickable')
             editable = self.__safe_dict_get(view, 'editable')
             actionable = clickable or scrollable or checkable or long_clickable or editable
             checked = self.__safe_dict_get(view, 'checked', default=False)
@@ -571,8 +725,8 @@ class DeviceState(object):
                     view_text, content_description = self._merge_text(clickable_children_ids)
                     checked = self._get_children_checked(clickable_children_ids)
                     for clickable_child in clickable_children_ids:
-                        if clickable_child in enabled_view_ids and clickable_child != view_id:
-                            removed_view_ids.append(clickable_child)
+                        if clickable_child in enabled_view_id_set and clickable_child != view_id:
+                            removed_view_ids.add(clickable_child)
             elif scrollable:
                 ele_attr.set_type('scrollbar')
             else:
@@ -613,11 +767,11 @@ class DeviceState(object):
             element_attr[view_id] = ele_attr
             
         state_desc = '\n'.join(view_descs)
-        element_tree = ElementTree(ele_attrs=element_attr,views=self.views, valid_ele_ids=[view['temp_id'] for view in indexed_views])
+        element_tree = ElementTree(ele_attrs=element_attr,views=self.__views, valid_ele_ids=[view['temp_id'] for view in indexed_views])
         return state_desc, indexed_views, element_tree
 
     def _get_self_ancestors_property(self, view, key, default=None):
-        all_views = [view] + [self.views[i] for i in self.get_all_ancestors(view)]
+        all_views = [view] + [self.__views[i] for i in self.get_all_ancestors(view)]
         for v in all_views:
             value = self.__safe_dict_get(v, key)
             if value:
@@ -627,14 +781,14 @@ class DeviceState(object):
     def _merge_text(self, children_ids):
         texts, content_descriptions = [], []
         for childid in children_ids:
-            if not self.__safe_dict_get(self.views[childid], 'visible') or \
-                self.__safe_dict_get(self.views[childid], 'resource_id') in \
+            if not self.__safe_dict_get(self.__views[childid], 'visible') or \
+                self.__safe_dict_get(self.__views[childid], 'resource_id') in \
                ['android:id/navigationBarBackground',
                 'android:id/statusBarBackground']:
                 # if the successor is not visible, then ignore it!
                 continue          
 
-            text = self.__safe_dict_get(self.views[childid], 'text', default='')
+            text = self.__safe_dict_get(self.__views[childid], 'text', default='')
             if len(text) > 50:
                 text = text[:50]
 
@@ -642,7 +796,7 @@ class DeviceState(object):
                 # text = text + '  {'+ str(childid)+ '}'
                 texts.append(text)
 
-            content_description = self.__safe_dict_get(self.views[childid], 'content_description', default='')
+            content_description = self.__safe_dict_get(self.__views[childid], 'content_description', default='')
             if len(content_description) > 50:
                 content_description = content_description[:50]
 
@@ -654,21 +808,21 @@ class DeviceState(object):
         return merged_text, merged_desc
     
     def get_scrollable_elements(self):
+        self.__generate_view_strs()
         scrollable_views, scrollable_view_properties = [], []
         enabled_view_ids = []
-        for view_dict in self.views:
+        for view_dict in self.__views:
             # exclude navigation bar if exists
             if self.__safe_dict_get(view_dict, 'visible') and \
                 self.__safe_dict_get(view_dict, 'resource_id') not in \
                ['android:id/navigationBarBackground',
                 'android:id/statusBarBackground']:
                 enabled_view_ids.append(view_dict['temp_id'])
+        inherited_properties = self.get_inherited_properties(('clickable', 'checkable', 'long_clickable'))
         for view_id in enabled_view_ids:
-            view = self.views[view_id]
-            clickable = self._get_self_ancestors_property(view, 'clickable')
+            view = self.__views[view_id]
+            clickable, checkable, long_clickable = inherited_properties[view_id]
             scrollable = self.__safe_dict_get(view, 'scrollable')
-            checkable = self._get_self_ancestors_property(view, 'checkable')
-            long_clickable = self._get_self_ancestors_property(view, 'long_clickable')
             editable = self.__safe_dict_get(view, 'editable')
             
             bound_box = self.__safe_dict_get(view, 'bound_box')
@@ -688,6 +842,11 @@ class DeviceState(object):
         return scrollable_views, scrollable_view_properties
 
 class EleAttr(object):
+    # many states are kept alive in UTGs and logs, slots keep the elements small
+    __slots__ = ('id', 'children', 'resource_id', 'class_name', 'text', 'content_description', 'bound_box', 'action',
+                 'local_id', 'type', 'alt', 'status', 'content', 'selected', 'checked', 'scrollable', 'editable',
+                 'clickable', 'long_clickable', 'checkable', 'type_', 'view', 'is_visible', 'enabled_view_ids',
+                 'img_path', '_html_start', '_html_end', '_visible_html_start')
 
     def __init__(self, idx: int, child_ids: list[int], view, views, enabled_view_ids=[]):
         '''
@@ -723,13 +882,20 @@ class EleAttr(object):
         self.view = view
         
         self.is_visible = view.get('visible', False)
-        # used for removing the invalid children
+        # used for removing the invalid children, a set of temp ids keeps the lookups cheap
         self.enabled_view_ids = enabled_view_ids
         for child in self.children:
             valid = self.check_if_el_is_valid(views, child)
             if not valid:
                 self.children.remove(child)
 
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in HTML_DESC_ATTRS:
+            object.__setattr__(self, '_html_start', None)
+            object.__setattr__(self, '_html_end', None)
+            object.__setattr__(self, '_visible_html_start', None)
+
     def check_if_el_is_valid(self, views, id):
         valid = id in self.enabled_view_ids
         if valid:
@@ -860,42 +1026,42 @@ class EleAttr(object):
     def desc_end(self) -> str:
         return f'</{self.type}>'
 
-    # generate the html description
-    @property
-    def desc_html_start(self) -> str:
+    def _get_html_attrs(self) -> str:
         # add double quote to resource_id and other properties
-        if self.resource_id:
-            resource_id = self.resource_id.split('/')[-1]
-        else:
-            resource_id = ''
-        resource_id = tools.escape_xml_chars(resource_id)
-        typ = tools.escape_xml_chars(self.type_)
         alt = tools.escape_xml_chars(self.alt)
         status = None if not self.status else [tools.escape_xml_chars(s) for s in self.status]
         content = tools.escape_xml_chars(self.content)
-        return '<' + typ + f' id=\'{self.id}\'' + \
-            (f" resource_id='{resource_id}'" if resource_id else '') + \
-            (f' alt=\'{alt}\'' if alt else '') + \
+        return (f' alt=\'{alt}\'' if alt else '') + \
             (f' status=\'{",".join(status)}\'' if status and len(status)>0 else '') + '>' + \
             (content if content else '')
 
+    # generate the html description, built once and again after an attribute it shows is assigned
+    @property
+    def desc_html_start(self) -> str:
+        if self._html_start is None:
+            if self.resource_id:
+                resource_id = self.resource_id.split('/')[-1]
+            else:
+                resource_id = ''
+            resource_id = tools.escape_xml_chars(resource_id)
+            self._html_start = '<' + tools.escape_xml_chars(self.type_) + f' id=\'{self.id}\'' + \
+                (f" resource_id='{resource_id}'" if resource_id else '') + self._get_html_attrs()
+        return self._html_start
+
     # generate the html description
     @property
     def desc_html_end(self) -> str:
-        return f'</{tools.escape_xml_chars(self.type_)}>'
-    
+        if self._html_end is None:
+            # a few tags are shared by all the elements
+            self._html_end = sys.intern(f'</{tools.escape_xml_chars(self.type_)}>')
+        return self._html_end
+
     @property
     def desc_visible_html_start(self) -> str:
-        # add double quote to resource_id and other properties
-        typ = tools.escape_xml_chars(self.type_)
-        alt = tools.escape_xml_chars(self.alt)
-        status = None if not self.status else [tools.escape_xml_chars(s) for s in self.status]
-        content = tools.escape_xml_chars(self.content)
-        return '<' + typ + \
-            (f' id=\'{self.id}\'' if self.id else '') + \
-            (f' alt=\'{alt}\'' if alt else '') + \
-            (f' status=\'{",".join(status)}\'' if status and len(status)>0 else '') + '>' + \
-            (content if content else '')
+        if self._visible_html_start is None:
+            self._visible_html_start = '<' + tools.escape_xml_chars(self.type_) + \
+                (f' id=\'{self.id}\'' if self.id else '') + self._get_html_attrs()
+        return self._visible_html_start
 
     def set_type(self, typ: str):
         self.type = typ
@@ -912,13 +1078,38 @@ class ElementTree(object):
         # member
         self.views = views
         self.scrollable_ele_ids: list[int] = []
+        # the nodes in preorder, with the leaves of the tree before the invalid leaves were dropped
+        # in the same order, so the leaves under a node are the slice leaf_ids[node.leaf_range]
+        self.nodes: list[ElementTree.node] = []
+        self.leaf_ids: list[int] = []
+        # element id -> node, for the nodes that are left after the invalid leaves were dropped
+        self.node_map: dict[int, ElementTree.node] = {}
         # tree
         self.root, self.ele_map, self.valid_ele_ids = self._build_tree(
             ele_attrs, views, valid_ele_ids, root_id)
         self.size = len(self.ele_map)
         # result
         self.str = self.get_str()
-        self.skeleton = HTMLSkeleton(self.str)
+
+    @cached_property
+    def skeleton(self):
+        return HTMLSkeleton.from_element_tree(self)
+
+    @cached_property
+    def content_hash(self) -> int:
+        """
+        equal for two trees if and only if their str is equal
+        """
+        self._hash_nodes()
+        return self.root.content_hash
+
+    @cached_property
+    def structure_hash(self) -> int:
+        """
+        equal for two trees with the same types and resource_ids in the same structure, regardless of texts and ids
+        """
+        self._hash_nodes()
+        return self.root.structure_hash
 
     def get_ele_by_id(self, index: int):
         return self.ele_map.get(index, None)
@@ -933,6 +1124,11 @@ class ElementTree(object):
             self.id = nid
             self.parent = pid
             self.leaves = set()
+            # the leaves under the node are ElementTree.leaf_ids[leaf_range[0]:leaf_range[1]]
+            self.leaf_range = (0, 0)
+            # Merkle hashes of the subtree, see ElementTree._hash_nodes
+            self.content_hash: int = None
+            self.structure_hash: int = None
 
         def get_leaves(self):
             for child in self.children:
@@ -980,31 +1176,25 @@ class ElementTree(object):
                     root_id: int) -> tuple[node, dict[int, EleAttr], set[int]]:
         _scrollable_ele_ids = set()
         _valid_ele_ids = set(valid_ele_ids)
-        
-        root = self.node(root_id, -1)
-        queue = [root]
 
         def check_if_el_is_valid(id):
-            attr = ele_map.get(id, None)
-            if attr:
-                return attr, id
-            
-            for child in views[id].get("children",[]):
-                child_attr, valid_id = check_if_el_is_valid(child)
-                if child_attr:
-                    return child_attr, valid_id
-                
+            # the view itself if it is an element, otherwise its first element descendant in preorder
+            stack = [id]
+            while stack:
+                view_id = stack.pop()
+                attr = ele_map.get(view_id, None)
+                if attr:
+                    return attr, view_id
+                stack.extend(reversed(views[view_id].get("children", [])))
             return None, None
-        
-        while queue:
-            node = queue.pop(0)
+
+        root = self.node(root_id, -1)
+        queue = [root]
+        # the queue is only appended to, walk it with an index instead of pop(0)
+        for node in queue:
             for child_id in ele_map[node.id].children:
                 # some views are not in the enable views
-                if node.id == 44:
-                    print("OPA")
                 attr, valid_id = check_if_el_is_valid(child_id)
-                if valid_id == 46:
-                    print("OPA")
                 if not attr and not valid_id:
                     continue
                 idx = ele_map[valid_id].id
@@ -1015,74 +1205,212 @@ class ElementTree(object):
                 queue.append(child)
 
         self.scrollable_ele_ids = list(_scrollable_ele_ids & _valid_ele_ids)
-        # get the leaves
-        root.get_leaves()
-        root.drop_invalid_nodes(_valid_ele_ids)
+        self._index_leaves(root)
+        # drop the leaves that are not valid, nodes that have children are kept even if all of them are dropped
+        for node in queue:
+            if node.children or node.id in _valid_ele_ids or node is root:
+                self.node_map.setdefault(node.id, node)
+        for node in queue:
+            node.children = [child for child in node.children if child.children or child.id in _valid_ele_ids]
 
         return root, ele_map, _valid_ele_ids
 
-    def get_str(self, is_color=False) -> str:
+    def _hash_nodes(self):
+        """
+        give every node, bottom-up, a content hash of everything str shows of its subtree and a structure hash of
+        the types and resource_ids of its subtree
+        """
+        if self.root.content_hash is not None:
+            return
+        # in reversed preorder the children of a node come before it
+        for node in reversed(self.nodes):
+            ele = self.ele_map[node.id]
+            node.content_hash = get_hash64((ele.desc_html_start, ele.desc_html_end,
+                                            [child.content_hash for child in node.children]))
+            node.structure_hash = get_hash64((ele.type_, ele.resource_id,
+                                              [child.structure_hash for child in node.children]))
+
+    def diff(self, other: 'ElementTree', root_id: int = None, other_root_id: int = None) -> dict:
+        """
+        find the subtrees that differ from another tree, e.g. the tree of the previous state.
+        The trees are walked top-down from the roots, subtrees with equal content hashes are not visited.
+        The children of two matched nodes are matched by equal content, then by equal structure,
+        then by equal type and resource_id, each in order.
+        :param other: ElementTree
+        :param root_id: compare only the subtree of this node, e.g. a scrolled list, with the subtree of
+            other_root_id in other
+        :return: dict, 'added': ids in other of the roots of the subtrees that are only in other,
+            'removed': ids of the roots of the subtrees that are only in this tree,
+            'changed': (id, id in other) of the matched nodes that are shown differently
+        """
+        self._hash_nodes()
+        other._hash_nodes()
+        added, removed, changed = [], [], []
+        if root_id is None:
+            stack = [(self.root, other.root)]
+        else:
+            stack = [(self.node_map[root_id], other.node_map[other_root_id])]
+        while stack:
+            node, other_node = stack.pop()
+            if node.content_hash == other_node.content_hash:
+                continue
+            ele, other_ele = self.ele_map[node.id], other.ele_map[other_node.id]
+            if ele.desc_html_start != other_ele.desc_html_start or ele.desc_html_end != other_ele.desc_html_end:
+                changed.append((node.id, other_node.id))
+
+            matches = self._match_children(node.children, other_node.children, other)
+            for child, other_child in matches:
+                if other_child is None:
+                    removed.append(child.id)
+                elif child is None:
+                    added.append(other_child.id)
+                else:
+                    stack.append((child, other_child))
+        return {'added': added, 'removed': removed, 'changed': changed}
+
+    def _match_children(self, children: list, other_children: list, other: 'ElementTree') -> list:
+        """
+        :return: list of (child, other child), None for a child without a match
+        """
+
+        def get_keys(tree, child):
+            ele = tree.ele_map[child.id]
+            return child.content_hash, child.structure_hash, (ele.type_, ele.resource_id)
+
+        keys = [get_keys(self, child) for child in children]
+        other_keys = [get_keys(other, other_child) for other_child in other_children]
+        matched = [None] * len(children)
+        other_matched = [False] * len(other_children)
+        for level in range(3):
+            other_indices = {}
+            for other_index in range(len(other_children) - 1, -1, -1):
+                if not other_matched[other_index]:
+                    other_indices.setdefault(other_keys[other_index][level], []).append(other_index)
+            for index in range(len(children)):
+                if matched[index] is None and other_indices.get(keys[index][level]):
+                    other_index = other_indices[keys[index][level]].pop()
+                    matched[index] = other_index
+                    other_matched[other_index] = True
+
+        matches = [(child, other_children[other_index] if other_index is not None else None)
+                   for child, other_index in zip(children, matched)]
+        matches.extend((None, other_child) for other_child, is_matched in zip(other_children, other_matched)
+                       if not is_matched)
+        return matches
+
+    def _index_leaves(self, root: node):
+        """
+        lay out the nodes in preorder and give each node the range of its leaves in self.leaf_ids
+        """
+        self.nodes = []
+        self.leaf_ids = []
+        stack = [(root, False)]
+        while stack:
+            node, visited = stack.pop()
+            if visited:
+                node.leaf_range = (node.leaf_range[0], len(self.leaf_ids))
+                continue
+            self.nodes.append(node)
+            if not node.children:
+                # a leaf has no leaves under it
+                node.leaf_range = (len(self.leaf_ids), len(self.leaf_ids))
+                if node is not root:
+                    self.leaf_ids.append(node.id)
+                continue
+            node.leaf_range = (len(self.leaf_ids), len(self.leaf_ids))
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(node.children))
+
+    @cached_property
+    def _renders(self) -> dict:
+        '''
+        render every variant of the tree in one traversal, they are kept since the tree is not changed once built
+        @return: dict, (visible_only, with_id, is_color) -> str
+        '''
+        full, full_without_id, colored, visible, visible_without_id = [], [], [], [], []
+        end_color = '\033[0m'
+        # (node, depth in the full tree, depth in the visible tree, whether the node is closed)
+        stack = [(self.root, 0, 0, False)]
+        while stack:
+            node, depth, visible_depth, closing = stack.pop()
+            attr = self.ele_map[node.id]
+            color = '\033[0;32m' if attr.type != 'div' else '\033[0;30m'
+            is_leaf = len(node.children) == 0
+            # the visible tree leaves out the invisible nodes and the containers without a description,
+            # their children take their place
+            is_shown = (is_leaf or attr.content_description or attr.scrollable) and attr.is_visible
+            if closing:
+                line = f'{"  "*depth}{attr.desc_html_end}\n'
+                full.append(line)
+                full_without_id.append(line)
+                colored += (color, line, end_color)
+                if is_shown:
+                    line = f'{"  "*visible_depth}{attr.desc_html_end}\n'
+                    visible.append(line)
+                    visible_without_id.append(line)
+                continue
+
+            html_end = attr.desc_html_end if is_leaf else ''
+            html_start = attr.desc_html_start
+            line = f'{"  "*depth}{html_start}{html_end}\n'
+            full.append(line)
+            colored += (color, line, end_color)
+            # the id directly follows the type, the quotes in the other attributes are escaped
+            id_attr = f"id='{attr.id}'"
+            full_without_id.append(f'{"  "*depth}{html_start.replace(" " + id_attr, "", 1)}{html_end}\n')
+            if is_shown:
+                html_start = attr.desc_visible_html_start
+                visible.append(f'{"  "*visible_depth}{html_start}{html_end}\n')
+                if attr.id:
+                    html_start = html_start.replace(id_attr, '', 1)
+                visible_without_id.append(f'{"  "*visible_depth}{html_start}{html_end}\n')
+            if not is_leaf:
+                stack.append((node, depth, visible_depth, True))
+                child_visible_depth = visible_depth + 1 if is_shown else visible_depth
+                stack.extend((child, depth + 1, child_visible_depth, False) for child in reversed(node.children))
+
+        return {
+            (False, True, False): ''.join(full),
+            (False, False, False): ''.join(full_without_id),
+            (False, True, True): ''.join(colored),
+            (True, True, False): ''.join(visible),
+            (True, False, False): ''.join(visible_without_id),
+        }
+
+    def get_str(self, is_color=False, with_id=True) -> str:
         '''
     use to print the tree in terminal with color
     '''
-
-        # output like the command of pstree to show all attribute of every node
-        def _str(node, depth=0):
-            attr = self.ele_map[node.id]
-            end_color = '\033[0m'
-            if attr.type != 'div':
-                color = '\033[0;32m'
-            else:
-                color = '\033[0;30m'
-            if not is_color:
-                end_color = ''
-                color = ''
-            if len(node.children) == 0:
-                return color + f'{"  "*depth}{attr.desc_html_start}{attr.desc_html_end}\n' + end_color
-            ret = color + f'{"  "*depth}{attr.desc_html_start}\n' + end_color
-            for child in node.children:
-                ret += _str(child, depth + 1)
-            ret += color + f'{"  "*depth}{attr.desc_html_end}\n' + end_color
-            return ret
-
-        return _str(self.root)
+        return self._renders[(False, with_id or is_color, is_color)]
 
     def get_str_with_visible(self, with_id=False) -> str:
         '''
-    use to print the tree in terminal with color
+    the tree of the visible elements, as shown in the prompts
     '''
+        return self._renders[(True, with_id, False)]
 
-        # output like the command of pstree to show all attribute of every node
-        def _str(node, depth=0):
-            attr = self.ele_map[node.id]
-            if (len(node.children) == 0 or attr.content_description or
-                    attr.scrollable) and attr.is_visible:
-                if len(node.children) == 0:
-                    return f'{"  "*depth}{attr.desc_visible_html_start}{attr.desc_html_end}\n'
-                ret = f'{"  "*depth}{attr.desc_visible_html_start}\n'
-                for child in node.children:
-                    ret += _str(child, depth + 1)
-                ret += f'{"  "*depth}{attr.desc_html_end}\n'
-            else:
-                ret = ''
-                for child in node.children:
-                    ret += _str(child, depth)
-            return ret
+    @cached_property
+    def lxml_root(self):
+        '''
+        the lxml tree of self.str, parsed on the first XPath lookup
+        '''
+        return etree.fromstring(self.str)
 
-        html_view = _str(self.root)
-        if not with_id:
-            html_view = re.sub(r"id='\d+'", '', html_view)
-        return html_view
+    @cached_property
+    def lxml_elements(self) -> dict:
+        '''
+        element id -> the element of lxml_root
+        '''
+        return {int(element.get('id')): element for element in self.lxml_root.iter() if isinstance(element.tag, str)}
 
     def _get_ele_by_xpath(self, xpath: str) -> EleAttr | None:
-        html_view = self.str
-        root = etree.fromstring(html_view)
-        eles = root.xpath(xpath)
+        eles = get_compiled_xpath(xpath)(self.lxml_root)
         if not eles:
             return None
-        ele_desc = etree.tostring(
-            eles[0], pretty_print=True).decode('utf-8')  # only for father node
-        id_str = re.search(r' id="(\d+)"', ele_desc).group(1)
+        if not isinstance(eles[0], etree._Element):
+            raise TypeError(f'xpath {xpath} does not select an element')
+        # the elements of self.str carry the id of their EleAttr
+        id_str = eles[0].get('id')
         try:
             id = int(id_str)
         except Exception as e:
@@ -1113,19 +1441,12 @@ class ElementTree(object):
     def get_children_by_ele(self, ele: EleAttr) -> list[EleAttr]:
         if ele.id not in self.ele_map:
             return []
-        que = [self.root]
-        target = None
-        while len(que) > 0:
-            node = que.pop(0)
-            if node.id == ele.id:
-                target = node
-                break
-            for child in node.children:
-                que.append(child)
+        target = self.node_map.get(ele.id, None)
         if target == None:
             return []
         # only for valid children, the sort is ascending order of the id
-        return [self.ele_map[idx] for idx in sorted(target.leaves)]
+        start, end = target.leaf_range
+        return [self.ele_map[idx] for idx in sorted(set(self.leaf_ids[start:end]))]
 
     def get_children_by_idx(self, ele: EleAttr, idx: int):
         for childid, child in enumerate(ele.children):
@@ -1271,6 +1592,18 @@ class ElementTree(object):
                 return ele.id
         return -1
     
+    def get_subtree(self, ele_id: int):
+        '''
+        a view of the subtree under the element for XPath and text queries, it shares the nodes and the lxml tree of
+        this tree, unlike extract_subtree
+        @return: SubtreeView, None if the element is not in the tree
+        '''
+        node = self.node_map.get(ele_id, None)
+        if node is None:
+            return None
+        from .xpath_index import SubtreeView
+        return SubtreeView(self, node)
+
     def extract_subtree(self, ele_id: int):
         ele = self.ele_map.get(ele_id, None)
         if not ele:
@@ -1292,69 +1625,150 @@ class ElementTree(object):
             ele_attrs=_ele_attr,views=self.views, valid_ele_ids=_valid_ele_ids, root_id=ele_id)
 
 
-from bs4 import BeautifulSoup, Tag, NavigableString
+def _make_skeleton_node(tag: str, resource_id: str | None, children: tuple) -> tuple:
+    """
+    :return: the skeleton node (hash, tag, resource_id, children), hash is a 64-bit Merkle hash of the tag,
+        the resource_id and the hashes of the children
+    """
+    return get_hash64((tag, resource_id, [child[0] for child in children])), tag, resource_id, children
 
-class HTMLSkeleton():
 
-    def __init__(self, html: str | BeautifulSoup, is_formatted=False):
-        if isinstance(html, str):
-            self.soup = BeautifulSoup(html, 'html.parser')
-        else:
-            self.soup = html
+def _remove_repeated_siblings(node: tuple) -> tuple:
+    """
+    keep the first of the children with the same tag and resource_id, recursively
+    """
+    seen_tags = set()
+    unique_children = []
+    for child in node[3]:
+        if (child[1], child[2]) not in seen_tags:
+            seen_tags.add((child[1], child[2]))
+            unique_children.append(_remove_repeated_siblings(child))
+    return _make_skeleton_node(node[1], node[2], tuple(unique_children))
 
-        if not is_formatted:
-            self._remove_attributes()
-            self._clean_repeated_siblings()
 
-        self.str = self.soup.prettify()
+class _SkeletonParser(HTMLParser):
+    """
+    parse html to a skeleton node, building the tree the way BeautifulSoup does with html.parser:
+    void tags are closed right after their start tag, and an end tag closes the innermost open tag with its name
+    """
 
-    def _remove_attributes(self):
-        '''
-    use bs4 to remove all other attributes except for the tag name and resource_id from the html
-    '''
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        # [tag, resource_id, children] of the open tags, the document first
+        self.open_tags = [[SKELETON_DOCUMENT_TAG, None, []]]
+        self.closed_void_tags = []
+
+    def handle_starttag(self, tag, attrs, close_void_tag=True):
+        resource_id = None
+        for key, value in attrs:
+            if key == 'resource_id':
+                resource_id = value if value is not None else ''
+        self.open_tags.append([tag, resource_id, []])
+        if close_void_tag and tag in SKELETON_VOID_TAGS:
+            self._close_tag()
+            self.closed_void_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs, close_void_tag=False)
+        self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self.closed_void_tags:
+            self.closed_void_tags.remove(tag)
+            return
+        if not any(open_tag[0] == tag for open_tag in self.open_tags[1:]):
+            return
+        while self._close_tag() != tag:
+            pass
+
+    def _close_tag(self):
+        tag, resource_id, children = self.open_tags.pop()
+        self.open_tags[-1][2].append(_make_skeleton_node(tag, resource_id, tuple(children)))
+        return tag
+
+    @classmethod
+    def parse(cls, html: str) -> tuple:
+        parser = cls()
+        parser.feed(html)
+        parser.close()
+        while len(parser.open_tags) > 1:
+            parser._close_tag()
+        return _make_skeleton_node(SKELETON_DOCUMENT_TAG, None, tuple(parser.open_tags[0][2]))
 
-        soup = self.soup
-        for tag in soup.find_all(True):
-            # Remove all attributes except for 'resource_id'
-            attributes = tag.attrs.copy()
-            for attr in attributes:
-                if attr != 'resource_id':
-                    del tag.attrs[attr]
 
-            # Remove all text nodes within tags
-            for content in tag.contents:
-                if isinstance(content, NavigableString):
-                    content.extract()
+class HTMLSkeleton():
+    '''
+    The structure of a screen, i.e. the tags and resource_ids of the elements without repeated siblings.
+    A node of the skeleton is the tuple (hash, tag, resource_id, children), the hash of a node is a
+    Merkle hash of its subtree, so skeletons and subtrees are compared by their hashes.
+    The skeleton of a screen is rooted at a document node whose children are the top-level tags,
+    str is the form of BeautifulSoup.prettify the skeletons of the API docs are stored in.
+    '''
+
+    def __init__(self, html: str | tuple, is_formatted=False):
+        '''
+    @param html: the html of a screen, a skeleton str, or a skeleton node
+    @param is_formatted: True if the repeated siblings are removed already
+    '''
+        if isinstance(html, str):
+            html = _SkeletonParser.parse(html)
+        if not is_formatted:
+            html = _remove_repeated_siblings(html)
+        self.root = html
+        self.hash = html[0]
 
-    def _clean_repeated_siblings(self):
+    @classmethod
+    def from_element_tree(cls, element_tree: ElementTree):
         '''
-    use bs4 to remove all repeated siblings from the html
+    build the skeleton from the nodes of an ElementTree, as if ElementTree.str was parsed
     '''
+        ele_map = element_tree.ele_map
+
+        def get_tag(node):
+            ele = ele_map[node.id]
+            resource_id = ele.resource_id.split('/')[-1] if ele.resource_id else None
+            return tools.escape_xml_chars(ele.type_).lower(), resource_id or None
+
+        for node in element_tree.nodes:
+            tag = tools.escape_xml_chars(ele_map[node.id].type_)
+            if not SKELETON_TAG_NAME_RE.fullmatch(tag) or tag.lower() in SKELETON_CDATA_TAGS:
+                # html.parser does not read the element as a tag
+                return cls(element_tree.str)
+
+        def get_children(nodes):
+            # void tags are closed right after their start tag, their children become their next siblings
+            children = []
+            for node in nodes:
+                tag, resource_id = get_tag(node)
+                if tag in SKELETON_VOID_TAGS:
+                    children.append((tag, resource_id, ()))
+                    children.extend(get_children(node.children))
+                else:
+                    children.append((tag, resource_id, node.children))
+            return children
 
-        def _remove_repeated_siblings(tag):
-            if not isinstance(tag, Tag):
-                return
-            unique_children = []
+        def build(tag, resource_id, nodes):
             seen_tags = set()
-            for child in tag.find_all(recursive=False):
-                child_signature = (child.name,
-                                   tuple(sorted(child.attrs.items())))
-                if child_signature not in seen_tags:
-                    unique_children.append(child)
-                    seen_tags.add(child_signature)
-            tag.clear()
-            for child in unique_children:
-                tag.append(child)
-                _remove_repeated_siblings(child)
-
-        _remove_repeated_siblings(self.soup)
+            unique_children = []
+            for child_tag, child_resource_id, child_nodes in get_children(nodes):
+                if (child_tag, child_resource_id) not in seen_tags:
+                    seen_tags.add((child_tag, child_resource_id))
+                    unique_children.append(build(child_tag, child_resource_id, child_nodes))
+            return _make_skeleton_node(tag, resource_id, tuple(unique_children))
+
+        return cls(build(SKELETON_DOCUMENT_TAG, None, [element_tree.root]), is_formatted=True)
 
     def count(self):
         """
     Count the number of tags in the HTML skeleton.
     For comparing the complexity of two HTML skeletons.
     """
-        return len(self.soup.find_all(recursive=True))
+        count = 0
+        stack = list(self.root[3])
+        while stack:
+            count += 1
+            stack.extend(stack.pop()[3])
+        return count
 
     def extract_common_skeleton(self, skeleton):
         '''
@@ -1363,41 +1777,80 @@ class HTMLSkeleton():
     '''
 
         def compare_and_extract_common(node1, node2):
-            if not (node1 and node2):
+            if node1[0] == node2[0]:
+                return node1
+            if node1[1] != node2[1]:
                 return None
-            if node1.name != node2.name:
-                return None
-            common_node = Tag(name=node1.name)
-            for attr in node1.attrs:
-                if attr in node2.attrs and node1.attrs[attr] == node2.attrs[
-                        attr]:
-                    common_node[attr] = node1.attrs[attr]
+            resource_id = node1[2] if node1[2] == node2[2] else None
             common_children = []
-            for child1, child2 in zip(
-                    node1.find_all(recursive=False),
-                    node2.find_all(recursive=False)):
+            for child1, child2 in zip(node1[3], node2[3]):
                 common_child = compare_and_extract_common(child1, child2)
-                if common_child:
+                if common_child is not None:
                     common_children.append(common_child)
-            common_node.extend(common_children)
-            return common_node
-
-        soup1 = self.soup
-        soup2 = skeleton.soup
+            return _make_skeleton_node(node1[1], resource_id, tuple(common_children))
 
-        common_structure = compare_and_extract_common(soup1.contents[0],
-                                                      soup2.contents[0])
-        if not common_structure:
+        if not (self.root[3] and skeleton.root[3]):
+            return HTMLSkeleton('', is_formatted=False)
+        common_structure = compare_and_extract_common(self.root[3][0], skeleton.root[3][0])
+        if common_structure is None:
             return HTMLSkeleton('', is_formatted=False)
         return HTMLSkeleton(common_structure, is_formatted=True)
 
     def __eq__(self, value: object) -> bool:
         if not isinstance(value, HTMLSkeleton):
             return False
-        return self.soup == value.soup
+        return self.hash == value.hash
 
     def __ne__(self, value: object) -> bool:
         return not self.__eq__(value)
 
     def __hash__(self) -> int:
-        return hash(self.str)    
\ No newline at end of file
+        return self.hash
+
+    @staticmethod
+    def _format_start_tag(node, is_empty=False):
+        _, tag, resource_id, _ = node
+        if resource_id is None:
+            return '<%s%s>' % (tag, '/' if is_empty else '')
+        resource_id = resource_id.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+        if '"' not in resource_id:
+            quoted = '"%s"' % resource_id
+        elif "'" not in resource_id:
+            quoted = "'%s'" % resource_id
+        else:
+            quoted = '"%s"' % resource_id.replace('"', '&quot;')
+        return '<%s resource_id=%s%s>' % (tag, quoted, '/' if is_empty else '')
+
+    def _format_inline(self, node):
+        # the contents of <pre> and <textarea> are not indented
+        if not node[3] and node[1] in SKELETON_VOID_TAGS:
+            return self._format_start_tag(node, is_empty=True)
+        return self._format_start_tag(node) + ''.join(self._format_inline(child) for child in node[3]) + \
+            '</%s>' % node[1]
+
+    def _format(self, node, depth, pieces, is_parsed):
+        indent = ' ' * depth
+        if is_parsed and not node[3] and node[1] in SKELETON_VOID_TAGS:
+            pieces.append(indent + self._format_start_tag(node, is_empty=True) + '\n')
+        elif is_parsed and node[1] in SKELETON_PRESERVE_WHITESPACE_TAGS:
+            pieces.append(indent + self._format_inline(node) + '\n')
+        else:
+            pieces.append(indent + self._format_start_tag(node) + '\n')
+            for child in node[3]:
+                self._format(child, depth + 1, pieces, is_parsed)
+            pieces.append(indent + '</%s>\n' % node[1])
+
+    @cached_property
+    def str(self):
+        '''
+    the skeleton in the format of BeautifulSoup.prettify, one tag per line indented by one space per level.
+    The tags of a parsed skeleton are formatted as html.parser treats them, the common structure of two
+    skeletons is formatted as plain tags
+    '''
+        pieces = []
+        if self.root[1] == SKELETON_DOCUMENT_TAG:
+            for child in self.root[3]:
+                self._format(child, 0, pieces, is_parsed=True)
+        else:
+            self._format(self.root, 0, pieces, is_parsed=False)
+        return ''.join(pieces)
@@ -0,0 +1,108 @@
+# Measure the memory of the elements of kept DeviceStates and the time to render their ElementTrees, on the recorded
+# states with the most views.
+#   python -m agent.droidbot.element_benchmark ../step_1_doc_generation/data
+# Without recorded states, synthetic long list screens are used.
+import argparse
+import contextlib
+import gc
+import io
+import statistics
+import time
+import tracemalloc
+
+from .device_state import DeviceState
+from .text_repr_benchmark import DEFAULT_STATES_DIR, SYNTHETIC_ROWS, clean_views, load_recorded_states, \
+    make_list_screen
+
+# states kept alive per measured state, as in a UTG that visits the same screen again and again
+DEFAULT_COPIES = 20
+DEFAULT_LARGEST = 5
+
+
+def build_element_tree(state):
+    device_state = DeviceState(None, clean_views(state['views']), state.get('foreground_activity'),
+                               state.get('activity_stack'), state.get('background_services'), tag=state.get('tag'))
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, _, element_tree = device_state.get_text_representation()
+    return device_state, element_tree
+
+
+def measure_memory(state, copies):
+    """
+    build the text representations of copies of the state and keep them alive, rendered as the agent does
+    :return: (bytes per state, bytes per element held by the ElementTrees)
+    """
+    gc.collect()
+    tracemalloc.start()
+    start_size, _ = tracemalloc.get_traced_memory()
+    kept = [build_element_tree(state) for _ in range(copies)]
+    for _, element_tree in kept:
+        element_tree.get_str()
+    size, _ = tracemalloc.get_traced_memory()
+    num_elements = sum(len(element_tree.ele_map) for _, element_tree in kept)
+    kept = [device_state for device_state, _ in kept]
+    gc.collect()
+    states_size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (size - start_size) / copies, (size - states_size) / max(num_elements, 1)
+
+
+def time_renders(element_tree, repeat):
+    """
+    :return: (median seconds to render the tree, median seconds of get_str and of get_str_with_visible once it was
+        rendered)
+    """
+    render_times, str_times, visible_times = [], [], []
+    for _ in range(repeat):
+        # the variants of the tree are rendered together on the first get_str and then kept
+        element_tree.__dict__.pop('_renders', None)
+        start_time = time.perf_counter()
+        element_tree.get_str()
+        render_times.append(time.perf_counter() - start_time)
+        start_time = time.perf_counter()
+        element_tree.get_str()
+        str_times.append(time.perf_counter() - start_time)
+        start_time = time.perf_counter()
+        element_tree.get_str_with_visible()
+        visible_times.append(time.perf_counter() - start_time)
+    return statistics.median(render_times), statistics.median(str_times), statistics.median(visible_times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the memory and render time of the elements of states.")
+    parser.add_argument("states_dir", nargs="?", default=DEFAULT_STATES_DIR,
+                        help="directory searched recursively for states/state_*.json, default: %(default)s")
+    parser.add_argument("-k", "--largest", type=int, default=DEFAULT_LARGEST,
+                        help="number of recorded states with the most views to measure")
+    parser.add_argument("-c", "--copies", type=int, default=DEFAULT_COPIES,
+                        help="states kept alive for the memory measurement")
+    parser.add_argument("-n", "--repeat", type=int, default=10, help="renders per state, the median is reported")
+    parser.add_argument("--synthetic", type=int, nargs="*", default=None, metavar="ROWS",
+                        help="also use synthetic list screens with these numbers of rows, default: %s"
+                             % " ".join(map(str, SYNTHETIC_ROWS)))
+    args = parser.parse_args()
+
+    states = load_recorded_states(args.states_dir)
+    states.sort(key=lambda named_state: len(named_state[1]['views']), reverse=True)
+    states = states[:args.largest]
+    if not states:
+        print("no recorded states in %s, using synthetic list screens" % args.states_dir)
+    if args.synthetic is not None or not states:
+        for num_rows in args.synthetic or SYNTHETIC_ROWS:
+            states.append(("synthetic list, %d rows" % num_rows, make_list_screen(num_rows)))
+
+    print("%8s %8s %10s %12s %10s %10s %12s %12s  %s" % ("views", "elements", "build ms", "KiB/state", "B/element",
+                                                        "render ms", "get_str ms", "visible ms", "state"))
+    for name, state in states:
+        build_start = time.perf_counter()
+        _, element_tree = build_element_tree(state)
+        build_time = time.perf_counter() - build_start
+        state_size, element_size = measure_memory(state, args.copies)
+        render_time, str_time, visible_time = time_renders(element_tree, args.repeat)
+        print("%8d %8d %10.2f %12.1f %10.0f %10.3f %12.3f %12.3f  %s" %
+              (len(state['views']), len(element_tree.ele_map), build_time * 1000, state_size / 1024, element_size,
+               render_time * 1000, str_time * 1000, visible_time * 1000, name))
+
+
+if __name__ == "__main__":
+    main()
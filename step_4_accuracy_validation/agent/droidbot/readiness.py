@@ -0,0 +1,163 @@
+import logging
+import subprocess
+import time
+
+from .adapter.adb_transport import ADBTransportException, get_default_transport
+
+# seconds between two checks of a probe
+READINESS_POLL_INTERVAL = 0.25
+# default timeouts of the probes, in seconds
+ADB_ONLINE_TIMEOUT = 120
+BOOT_COMPLETED_TIMEOUT = 180
+SNAPSHOT_LOAD_TIMEOUT = 120
+ADB_OFFLINE_TIMEOUT = 30
+ADAPTERS_CONNECTED_TIMEOUT = 30
+APP_FOREGROUND_TIMEOUT = 30
+
+
+class ReadinessProbes(object):
+    """
+    bounded waits on the conditions that the device lifecycle depends on.
+    Every wait is recorded per probe, so that it can be seen where the set up and reset time goes.
+    """
+
+    def __init__(self, serial, poll_interval=READINESS_POLL_INTERVAL):
+        """
+        :param serial: serial number of the device, e.g. emulator-5554
+        :param poll_interval: seconds between two checks of a probe
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.serial = serial
+        self.poll_interval = poll_interval
+        # probe name -> list of seconds waited
+        self.wait_times = {}
+
+    def wait(self, name, check, timeout):
+        """
+        poll a condition until it holds or the timeout expires
+        :param name: str, the probe name the wait time is recorded under
+        :param check: callable returning True once the condition holds, exceptions count as not ready
+        :param timeout: maximum seconds to wait
+        :return: True if the condition holds, False on timeout
+        """
+        start_time = time.monotonic()
+        deadline = start_time + timeout
+        while True:
+            try:
+                ready = bool(check())
+            except Exception as e:
+                self.logger.debug("probe %s failed: %s" % (name, e))
+                ready = False
+            if ready or time.monotonic() >= deadline:
+                break
+            time.sleep(self.poll_interval)
+        self.record(name, time.monotonic() - start_time)
+        if not ready:
+            self.logger.warning("%s is not ready after %.1fs" % (name, timeout))
+        return ready
+
+    def record(self, name, seconds):
+        self.wait_times.setdefault(name, []).append(seconds)
+
+    def get_wait_times(self):
+        """
+        :return: dict, probe name -> {"count", "total", "last"} in seconds
+        """
+        return {name: {"count": len(times), "total": sum(times), "last": times[-1]}
+                for name, times in self.wait_times.items()}
+
+    def reset_wait_times(self):
+        self.wait_times = {}
+
+    def __shell(self, command):
+        try:
+            out, _ = get_default_transport().shell(self.serial, command)
+            return out.decode(errors="replace")
+        except ADBTransportException:
+            return subprocess.check_output(["adb", "-s", self.serial, "shell", command],
+                                           stderr=subprocess.DEVNULL).decode(errors="replace")
+
+    def is_adb_online(self):
+        try:
+            state = get_default_transport().get_state(self.serial)
+        except ADBTransportException:
+            state = subprocess.run(["adb", "-s", self.serial, "get-state"],
+                                   stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode()
+        return state.strip() == "device"
+
+    def is_boot_completed(self):
+        boot_completed, boot_anim = (self.__shell("getprop sys.boot_completed; getprop init.svc.bootanim")
+                                     .splitlines() + ["", ""])[:2]
+        return boot_completed.strip() == "1" and boot_anim.strip() != "running"
+
+    def wait_for_adb_online(self, timeout=ADB_ONLINE_TIMEOUT):
+        return self.wait("adb_online", self.is_adb_online, timeout)
+
+    def wait_for_adb_offline(self, timeout=ADB_OFFLINE_TIMEOUT):
+        return self.wait("adb_offline", lambda: not self.is_adb_online(), timeout)
+
+    def wait_for_boot_completed(self, timeout=BOOT_COMPLETED_TIMEOUT):
+        """
+        wait until the device is online and has finished booting
+        """
+        start_time = time.monotonic()
+        if not self.wait_for_adb_online(timeout):
+            return False
+        return self.wait("boot_completed", self.is_boot_completed,
+                         max(0, timeout - (time.monotonic() - start_time)))
+
+    def load_snapshot(self, snapshot_name, timeout=SNAPSHOT_LOAD_TIMEOUT):
+        """
+        load an emulator snapshot and wait until the emulator resumed from it.
+        The emulator console only answers `snapshot load` once the snapshot is loaded.
+        :param snapshot_name: str
+        :param timeout: maximum seconds to wait
+        :return: True if the snapshot was loaded and the device is ready
+        """
+        start_time = time.monotonic()
+        cmd = ["adb", "-s", self.serial, "emu", "avd", "snapshot", "load", snapshot_name]
+        try:
+            out = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout).stdout
+            loaded = b"OK" in out
+            if not loaded:
+                self.logger.warning("failed to load snapshot %s: %s" % (snapshot_name, out.decode(errors="replace")))
+        except subprocess.TimeoutExpired:
+            self.logger.warning("snapshot %s is not loaded after %ds" % (snapshot_name, timeout))
+            loaded = False
+        self.record("snapshot_load", time.monotonic() - start_time)
+        if not loaded:
+            return False
+        return self.wait_for_boot_completed(max(0, timeout - (time.monotonic() - start_time)))
+
+    def wait_for_adapters(self, device, timeout=ADAPTERS_CONNECTED_TIMEOUT):
+        """
+        wait until the socket of the droidbot app is connected and the droidbot ime is selected
+        :param device: instance of Device
+        """
+        def adapters_connected():
+            droidbot_app = device.droidbot_app
+            if device.adapters.get(droidbot_app) and not droidbot_app.connected:
+                return False
+            droidbot_ime = device.droidbot_ime
+            if device.adapters.get(droidbot_ime) and not droidbot_ime.connected:
+                return False
+            return True
+        return self.wait("adapters_connected", adapters_connected, timeout)
+
+    def wait_for_app_foreground(self, device, package_name, timeout=APP_FOREGROUND_TIMEOUT):
+        """
+        wait until the app is in the foreground and its view tree is not empty
+        :param device: instance of Device
+        :param package_name: str
+        """
+        def app_foreground():
+            top_activity = device.get_top_activity_name()
+            if top_activity is None or not top_activity.startswith(package_name + "/"):
+                return False
+            droidbot_app = device.droidbot_app
+            if device.adapters.get(droidbot_app) and droidbot_app.last_acc_event is None:
+                # get_views would sleep waiting for the first event
+                return False
+            views = device.get_views()
+            return bool(views) and any(view.get("package") == package_name for view in views)
+        return self.wait("app_foreground", app_foreground, timeout)
@@ -0,0 +1,135 @@
+# Compare ElementTree.get_ele_by_xpath with the lookup it replaced, which parsed ElementTree.str and serialized the
+# hit for every XPath, on recorded states and the XPaths of the API docs.
+#   python -m agent.droidbot.xpath_benchmark ../step_1_doc_generation/data
+# Without recorded states, synthetic long list screens are used.
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import re
+import statistics
+import time
+
+from lxml import etree
+
+from .device_state import DeviceState
+from .text_repr_benchmark import DEFAULT_STATES_DIR, SYNTHETIC_ROWS, clean_views, load_recorded_states, \
+    make_list_screen
+
+# XPaths generated per screen from its own elements, so that a part of the lookups hit
+MAX_SCREEN_XPATHS = 200
+
+
+def load_doc_xpaths(data_dir):
+    """
+    :param data_dir: directory searched recursively for API docs, e.g. step_1_doc_generation/data/*/docs/*.json
+    :return: list of the XPaths of the documented elements
+    """
+    xpaths = []
+    for doc_path in sorted(glob.glob(os.path.join(data_dir, "**", "docs", "*.json"), recursive=True)):
+        with open(doc_path) as f:
+            doc = json.load(f)
+        for screen in doc.values():
+            if not isinstance(screen, dict):
+                continue
+            for element in (screen.get('elements') or {}).values():
+                xpaths.extend(element.get('xpath') or [])
+    return xpaths
+
+
+def get_screen_xpaths(element_tree):
+    """
+    make XPaths that select elements of the screen, the absolute tag path and the alt and resource_id of each element
+    """
+    xpaths = []
+    root = etree.fromstring(element_tree.str)
+    for element in root.iter():
+        path = [element.tag] + [ancestor.tag for ancestor in element.iterancestors()]
+        xpaths.append('/' + '/'.join(reversed(path)))
+        for key in ('alt', 'resource_id'):
+            if element.get(key) and "'" not in element.get(key):
+                xpaths.append("//%s[@%s='%s']" % (element.tag, key, element.get(key)))
+    return xpaths[:MAX_SCREEN_XPATHS]
+
+
+def legacy_get_ele_by_xpath(element_tree, xpath):
+    """
+    the lookup before the lxml tree and the compiled XPaths were cached
+    """
+    root = etree.fromstring(element_tree.str)
+    eles = root.xpath(xpath)
+    if not eles:
+        return None
+    ele_desc = etree.tostring(eles[0], pretty_print=True).decode('utf-8')
+    id_str = re.search(r' id="(\d+)"', ele_desc).group(1)
+    return element_tree.ele_map.get(int(id_str), None)
+
+
+def time_lookups(element_tree, xpaths, get_ele_by_xpath):
+    """
+    :return: (seconds, list of the ids found, None if not found or the XPath failed)
+    """
+    found = []
+    start_time = time.perf_counter()
+    for xpath in xpaths:
+        try:
+            ele = get_ele_by_xpath(element_tree, xpath)
+        except Exception:
+            ele = None
+        found.append(ele.id if ele is not None else None)
+    return time.perf_counter() - start_time, found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the XPath lookup of ElementTree with the previous one.")
+    parser.add_argument("data_dir", nargs="?", default=DEFAULT_STATES_DIR,
+                        help="directory searched recursively for states/state_*.json and docs/*.json, "
+                             "default: %(default)s")
+    parser.add_argument("-n", "--repeat", type=int, default=3, help="runs per state, the median is reported")
+    parser.add_argument("--synthetic", type=int, nargs="*", default=None, metavar="ROWS",
+                        help="also use synthetic list screens with these numbers of rows, default: %s"
+                             % " ".join(map(str, SYNTHETIC_ROWS)))
+    args = parser.parse_args()
+
+    states = load_recorded_states(args.data_dir)
+    if not states:
+        print("no recorded states in %s, using synthetic list screens" % args.data_dir)
+    if args.synthetic is not None or not states:
+        for num_rows in args.synthetic or SYNTHETIC_ROWS:
+            states.append(("synthetic list, %d rows" % num_rows, make_list_screen(num_rows)))
+    doc_xpaths = load_doc_xpaths(args.data_dir)
+
+    total_legacy, total_cached = 0, 0
+    print("%8s %8s %12s %12s  %s" % ("elements", "xpaths", "legacy ms", "cached ms", "state"))
+    for name, state in states:
+        device_state = DeviceState(None, clean_views(state['views']), state.get('foreground_activity'),
+                                   state.get('activity_stack'), state.get('background_services'),
+                                   tag=state.get('tag'))
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, _, element_tree = device_state.get_text_representation()
+        xpaths = doc_xpaths + get_screen_xpaths(element_tree)
+
+        legacy_times, cached_times = [], []
+        for _ in range(args.repeat):
+            legacy_time, legacy_found = time_lookups(element_tree, xpaths, legacy_get_ele_by_xpath)
+            legacy_times.append(legacy_time)
+            # a new tree for every run, so that parsing it is part of the time
+            element_tree.__dict__.pop('lxml_root', None)
+            cached_time, cached_found = time_lookups(element_tree, xpaths,
+                                                     lambda tree, xpath: tree.get_ele_by_xpath(xpath))
+            cached_times.append(cached_time)
+            if legacy_found != cached_found:
+                print("the lookups disagree on %s" % name)
+        legacy_time, cached_time = statistics.median(legacy_times), statistics.median(cached_times)
+        total_legacy += legacy_time
+        total_cached += cached_time
+        print("%8d %8d %12.2f %12.2f  %s" % (len(element_tree), len(xpaths), legacy_time * 1000, cached_time * 1000,
+                                              name))
+    print("%d states, legacy %.1f ms, cached %.1f ms in total" %
+          (len(states), total_legacy * 1000, total_cached * 1000))
+
+
+if __name__ == "__main__":
+    main()
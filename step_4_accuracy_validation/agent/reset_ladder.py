@@ -0,0 +1,144 @@
+import hashlib
+import logging
+import os
+import subprocess
+
+from agent.droidbot.adapter.adb import ADBException
+
+# resets from the cheapest to the most thorough, a reset that fails its
+# verification falls back to the next tier
+RESET_TIER_RESTART = "restart"  # force-stop and relaunch the app
+RESET_TIER_CLEAR_DATA = "clear_data"  # pm clear and restore the app data of the snapshot
+RESET_TIER_SNAPSHOT = "snapshot"  # reload the AVD snapshot
+RESET_TIERS = (RESET_TIER_RESTART, RESET_TIER_CLEAR_DATA, RESET_TIER_SNAPSHOT)
+
+# actions, in the format of actions_taken, that cannot change the data of an app. a swipe may delete or
+# archive an item and going back may save a form, so they are not read-only
+READ_ONLY_ACTIONS = ("PRESS_HOME", "STATUS_TASK_COMPLETE", "STATUS_TASK_IMPOSSIBLE")
+SETTINGS_NAMESPACES = ("system", "secure", "global")
+APP_DATA_DIR = "/data/data"
+APP_DATA_REMOTE_TMP_DIR = "/data/local/tmp"
+
+
+class ResetLadder:
+  """Picks the cheapest reset that brings the device back to the snapshot state.
+
+  The baselines it compares with are recorded after every snapshot reset:
+  the installed packages, the settings, the first screen of each app and,
+  on rooted images, the app data of each app.
+  """
+
+  def __init__(self, baseline_dir: str):
+    """
+    Args:
+        baseline_dir: Directory on the host for the app data archives.
+    """
+    self.logger = logging.getLogger(self.__class__.__name__)
+    self.baseline_dir = baseline_dir
+    self.baseline_packages = None
+    self.baseline_settings = None
+    # package -> structure_str of the first screen after a snapshot reset
+    self.baseline_screens = {}
+    # package -> local path of the app data archive, None if it cannot be captured
+    self.app_data_baselines = {}
+    self.__root_prefix = None
+    self.__root_checked = False
+
+  def _get_root_prefix(self, device):
+    """The command prefix to run as root, None on images without root."""
+    if not self.__root_checked:
+      self.__root_checked = True
+      for prefix in ([], ["su", "0"]):
+        try:
+          if device.adb.shell(prefix + ["id", "-u"]).strip() == "0":
+            self.__root_prefix = prefix
+            break
+        except (ADBException, subprocess.CalledProcessError):
+          continue
+      if self.__root_prefix is None:
+        self.logger.info("no root on the device, app data cannot be restored")
+    return self.__root_prefix
+
+  def _get_settings_digest(self, device) -> str:
+    settings = hashlib.md5()
+    for namespace in SETTINGS_NAMESPACES:
+      settings.update(device.adb.shell(["settings", "list", namespace]).encode())
+    return settings.hexdigest()
+
+  def record_snapshot(self, device, package: str) -> None:
+    """Records the baselines of the snapshot state, right after a snapshot load and before the app is started."""
+    if self.baseline_packages is None:
+      self.baseline_packages = frozenset(device.adb.get_installed_apps())
+      self.baseline_settings = self._get_settings_digest(device)
+    if package not in self.app_data_baselines:
+      self.app_data_baselines[package] = self._capture_app_data(device, package)
+
+  def record_screen(self, package: str, state) -> None:
+    """Records the first screen of the app after a snapshot reset."""
+    self.baseline_screens[package] = state.structure_str
+
+  def verify_screen(self, package: str, state) -> bool:
+    """Whether the app shows the same first screen as after a snapshot reset."""
+    return state is not None and self.baseline_screens.get(package) == state.structure_str
+
+  def _capture_app_data(self, device, package: str):
+    prefix = self._get_root_prefix(device)
+    if prefix is None:
+      return None
+    try:
+      data = device.adb.exec_out(prefix + ["tar", "-cz", "-C", APP_DATA_DIR, package])
+    except (ADBException, subprocess.CalledProcessError) as e:
+      self.logger.warning(f"failed to capture the app data of {package}: {e}")
+      return None
+    if not data:
+      return None
+    os.makedirs(self.baseline_dir, exist_ok=True)
+    local_path = os.path.join(self.baseline_dir, f"{package}.tgz")
+    with open(local_path, "wb") as f:
+      f.write(data)
+    return local_path
+
+  def restore_app_data(self, device, package: str) -> bool:
+    """Clears the app data and restores the data the app had in the snapshot."""
+    local_path = self.app_data_baselines.get(package)
+    prefix = self._get_root_prefix(device)
+    if local_path is None or prefix is None:
+      return False
+    remote_path = f"{APP_DATA_REMOTE_TMP_DIR}/{package}.tgz"
+    try:
+      if "Success" not in device.adb.shell(["pm", "clear", package]):
+        return False
+      device.push_file(local_path, remote_path)
+      device.adb.shell(prefix + ["tar", "-xzf", remote_path, "-C", APP_DATA_DIR])
+      device.adb.shell(prefix + ["restorecon", "-R", f"{APP_DATA_DIR}/{package}"])
+      device.adb.shell(["rm", remote_path])
+    except (ADBException, subprocess.CalledProcessError) as e:
+      self.logger.warning(f"failed to restore the app data of {package}: {e}")
+      return False
+    return True
+
+  def choose_tier(self, device, package: str, dirty_packages: set, actions: list) -> str:
+    """Picks the cheapest reset tier that undoes what the previous task touched.
+
+    Args:
+        device: The device.
+        package: The package of the app the next task starts.
+        dirty_packages: The packages seen in the foreground during the previous task.
+        actions: The actions_taken of the previous task.
+
+    Returns:
+        One of RESET_TIERS.
+    """
+    if package not in self.baseline_screens or self.baseline_packages is None:
+      return RESET_TIER_SNAPSHOT
+    if frozenset(device.adb.get_installed_apps()) != self.baseline_packages:
+      self.logger.info("installed packages changed, reloading snapshot")
+      return RESET_TIER_SNAPSHOT
+    if self._get_settings_digest(device) != self.baseline_settings:
+      self.logger.info("settings changed, reloading snapshot")
+      return RESET_TIER_SNAPSHOT
+    if all(action["action"].split("|")[0] in READ_ONLY_ACTIONS for action in actions):
+      return RESET_TIER_RESTART
+    if all(self.app_data_baselines.get(p) is not None for p in dirty_packages | {package}):
+      return RESET_TIER_CLEAR_DATA
+    return RESET_TIER_SNAPSHOT
@@ -1,9 +1,15 @@
+import copy
 import json
+import os
 import re
 import datetime
+from collections.abc import Mapping
 import agent.environment as environment
 
 from agent.droidbot.device_state import HTMLSkeleton, ElementTree, EleAttr
+from agent.droidbot.skeleton_index import SkeletonIndex
+from agent.droidbot.xpath_index import XPathIndex, parse_simple_xpath
+from agent.script_utils.compiled_doc import CompiledDoc, compile_api_doc, get_compiled_doc_path, is_compiled_doc
 
 UI_SCREEN_ELEMENT_DELIMITER = '__'
 class DependentAction():
@@ -19,18 +25,21 @@ class DependentAction():
     self.action_type: str = None
     self.argv: list[str] = None
     self.text: str = None
+    self.name: str = None
 
-    if 'back()' in action:
-      _action = "back()"
-    elif 'enter()' in action:
-      _action = "enter()"
+    m = re.fullmatch(r'(?:(\w+)\.)?(back|enter)\(\)', action)
+    if m:
+      # the doc may prefix back() and enter() with the screen they are done on, e.g. settings_screen.back()
+      self.screen_name = m.group(1)
+      _action = m.group(2) + '()'
     else:
-      m = re.search(r'(\w+)\.', action) # only first is screen name
+      m = re.search(r'(\w+(?::\w+)?)\.', action) # only first is screen name
       assert m is not None
       self.name = m.group(1)
       _action = action[:m.start()] + action[m.end():]
       
-      temp = self.name.split(UI_SCREEN_ELEMENT_DELIMITER)
+      # some docs delimit the screen and the element with ':'
+      temp = self.name.split(':' if ':' in self.name else UI_SCREEN_ELEMENT_DELIMITER)
       assert len(temp) == 2
       self.screen_name = temp[0]
       self.api_name = temp[1]
@@ -118,7 +127,10 @@ class DependentAction():
 
 class ApiEle():
 
-  def __init__(self, screen_name: str, raw: dict):
+  def __init__(self, screen_name: str, raw: dict, read_paths=None):
+    '''
+    @param read_paths: returns the paths of the element if they are not in raw, e.g. from a compiled doc
+    '''
     self.id = raw.get('id', None)
     self.element: str = raw['element']
     self.type: str = raw['type']
@@ -129,39 +141,96 @@ class ApiEle():
     self.api_name = raw['name']
     self.state_tag: str = raw['state_tag']
     self.xpath: str = raw.get('xpath', None) # todo:: maybe not exist, log this
-    self.paths: list[list[str]] = raw.get('paths', [])
-    self.dependency_action: list[list[DependentAction]] = []
+    # the paths and their actions are decoded on first access, a task navigates to a few elements only
+    self._paths: list[list[str]] = raw.get('paths', [])
+    self._read_paths = read_paths
+    self._dependency_action: list[list[DependentAction]] = None
 
-    for path in self.paths:
-      _path_actions = []
-      for action in path:
-        _path_actions.append(DependentAction(action))
-      
-      self.dependency_action.append(_path_actions)
+  @property
+  def paths(self) -> list[list[str]]:
+    if self._read_paths is not None:
+      self._paths = self._read_paths()
+      self._read_paths = None
+    return self._paths
+
+  @property
+  def dependency_action(self) -> list[list[DependentAction]]:
+    if self._dependency_action is None:
+      self._dependency_action = [[DependentAction(action) for action in path] for path in self.paths]
+    return self._dependency_action
   
-  def __dict__(self):
+  def to_dict(self):
+    '''
+    the element as it is stored in the doc
+    '''
     return {
         'id': self.id,
-        'element_type': self.element_type,
-        'api_name': self.raw_name,
         'element': self.element,
+        'type': self.type,
         'description': self.description,
         'effect': self.effect,
+        'options': self.options,
+        'name': self.api_name,
         'state_tag': self.state_tag,
         'xpath': self.xpath,
-        'paths': [action.raw_action for action in self.dependency_action]
+        'paths': self.paths
     }
 
 
+class LazyMapping(Mapping):
+  '''
+  a read-only dict whose values are loaded on first access
+  '''
+
+  def __init__(self, keys, load):
+    self._keys = dict.fromkeys(keys)
+    self._load = load
+    self._values = {}
+
+  def __getitem__(self, key):
+    if key not in self._values:
+      if key not in self._keys:
+        raise KeyError(key)
+      # the mapping may be shared by threads, the value loaded first is kept
+      return self._values.setdefault(key, self._load(key))
+    return self._values[key]
+
+  def __contains__(self, key):
+    return key in self._keys
+
+  def __iter__(self):
+    return iter(self._keys)
+
+  def __len__(self):
+    return len(self._keys)
+
+
 class ApiDoc():
 
   def __init__(self, doc_path: str):
+    '''
+    @param doc_path: a JSON doc or a doc compiled by compiled_doc.compile_api_doc, a compiled doc next to a JSON doc
+      is used instead while it is up to date
+    '''
     self.doc_path = doc_path
-    self.doc: dict[str, dict[str, ApiEle]] = {} # screen_name -> api_name -> ApiEle
+    self.json_path = doc_path # the JSON doc that save() writes
+    self.doc: Mapping[str, dict[str, ApiEle]] = {} # screen_name -> api_name -> ApiEle, decoded on first access
     self.api_xpath: dict[str, str] = {}
-    self.elements: list[ApiEle] = []
+    # reverse indexes, built when the doc is loaded without decoding the elements
+    self.api_name2screen_name: dict[str, str] = {}
+    self.xpath2api_names: dict[str, list[str]] = {}
+    self._condition2api_names: dict[tuple, list[str]] = None # see get_api_names_by_condition, built on first use
+    # (screen_name, is_show_xpath) -> api_name -> the description of the element in the prompts, rendered on first use
+    self.screen_name2element_desc: dict[tuple, dict[str, str]] = {}
     self.skeleton_str2screen_name: dict[str, str] = {}
-    self.screen_name2skeleton: dict[str, HTMLSkeleton] = {}
+    self.screen_name2skeleton: Mapping[str, HTMLSkeleton] = {} # parsed on first access
+    # indexes built from the doc on first use, shared by the forks of the doc, see get_shared_index
+    self._shared_indexes: dict[str, object] = {}
+    self.screen_name2xpath_index: dict[str, tuple[tuple, XPathIndex]] = {} # screen_name -> (xpaths, index), built on first use
+    self._compiled_doc: CompiledDoc = None
+    # the elements as loaded, and the elements updated in this doc by screen, see fork()
+    self._loaded_doc: Mapping[str, dict[str, ApiEle]] = {}
+    self._updated_elements: dict[str, dict[str, ApiEle]] = {}
 
     self.is_updated = False
     
@@ -169,37 +238,176 @@ class ApiDoc():
     self._load_api_doc()
 
   def _load_api_doc(self):
+    compiled_path = self.doc_path if is_compiled_doc(self.doc_path) else get_compiled_doc_path(self.doc_path)
+    if is_compiled_doc(self.doc_path) or (
+        os.path.exists(compiled_path) and os.path.getmtime(compiled_path) >= os.path.getmtime(self.doc_path)):
+      self._load_compiled_doc(CompiledDoc(compiled_path))
+      return
+
     raw_api_doc = json.load(open(self.doc_path, 'r'))
-    len_screen = len(raw_api_doc)
 
-    for k, v in raw_api_doc.items():
-      if not self.main_screen:
-        self.main_screen = k # first screen is the main screen
+    def load_elements(screen_name):
+      return {k_ele: ApiEle(screen_name, v_ele) for k_ele, v_ele in raw_api_doc[screen_name]['elements'].items()}
 
-      self.screen_name2skeleton[k] = HTMLSkeleton(v['skeleton'])
-      self.skeleton_str2screen_name[v['skeleton']] = k
-      _elements = {}
+    for screen_name, v in raw_api_doc.items():
       for k_ele, v_ele in v['elements'].items():
-        ele = ApiEle(k, v_ele)
-        _elements[k_ele] = ele
-        self.elements.append(ele)
-        self.api_xpath[k_ele] = ele.xpath
-      self.doc[k] = _elements
+        self._add_api(screen_name, k_ele, v_ele.get('xpath', None))
+    self._set_screens({k: v['skeleton'] for k, v in raw_api_doc.items()}, load_elements)
+
+  def _load_compiled_doc(self, compiled_doc: CompiledDoc):
+    self._compiled_doc = compiled_doc
+    self.json_path = compiled_doc.source_path
+    screens = {screen['name']: screen for screen in compiled_doc.screens}
+
+    def load_elements(screen_name):
+      screen = screens[screen_name]
+      raw_elements = compiled_doc.read(screen['elements'])
+      return {
+          k_ele: ApiEle(screen_name, raw_elements[k_ele], lambda span=paths_span: compiled_doc.read(span))
+          for k_ele, _, paths_span in screen['apis']
+      }
+
+    for screen in compiled_doc.screens:
+      for k_ele, xpath, _ in screen['apis']:
+        self._add_api(screen['name'], k_ele, xpath)
+    self._set_screens({k: v['skeleton'] for k, v in screens.items()}, load_elements)
+
+  def _add_api(self, screen_name: str, api_name: str, xpath):
+    self.api_xpath[api_name] = xpath
+    # an element in the screen of its name is found first, as the names are looked up by that screen
+    if api_name not in self.api_name2screen_name or \
+        api_name.split(UI_SCREEN_ELEMENT_DELIMITER)[0] == screen_name:
+      self.api_name2screen_name[api_name] = screen_name
+    for xpath in self._get_indexed_xpaths(xpath):
+      self.xpath2api_names.setdefault(xpath, []).append(api_name)
+
+  def _set_screens(self, screen_name2skeleton_str: dict[str, str], load_elements):
+    for k, skeleton_str in screen_name2skeleton_str.items():
+      if not self.main_screen:
+        self.main_screen = k # first screen is the main screen
+      self.skeleton_str2screen_name[skeleton_str] = k
+    self.screen_name2skeleton = LazyMapping(
+        screen_name2skeleton_str, lambda k: HTMLSkeleton(screen_name2skeleton_str[k]))
+    self.doc = self._loaded_doc = LazyMapping(screen_name2skeleton_str, load_elements)
 
     # ! screen and skeleton should be unique (but it's not)
     # assert len(self.skeleton_str2screen_name) == len_screen
 
+  def get_shared_index(self, name: str, build):
+    '''
+    @param build: builds the index from this doc, it must not depend on the xpaths, which a fork may change
+    @return: the index built on first use, by this doc or by another fork of the same doc
+    '''
+    index = self._shared_indexes.get(name, None)
+    if index is None:
+      # threads that build the index at the same time keep the first one
+      index = self._shared_indexes.setdefault(name, build(self))
+    return index
+
+  def _build_skeleton_index(self) -> SkeletonIndex:
+    skeleton_index = SkeletonIndex()
+    for screen_name, skeleton in self.screen_name2skeleton.items():
+      skeleton_index.add(screen_name, skeleton)
+    return skeleton_index
+
+  @property
+  def skeleton_index(self) -> SkeletonIndex:
+    # finds the screen of a skeleton that is not in the doc, built from all the skeletons on first use
+    return self.get_shared_index('skeleton_index', ApiDoc._build_skeleton_index)
+
+  @property
+  def elements(self) -> list[ApiEle]:
+    return [ele for elements in self.doc.values() for ele in elements.values()]
+
+  def fork(self) -> 'ApiDoc':
+    '''
+    a doc for one run, e.g. of a CodeAgent, that shares the loaded screens, skeletons and indexes of this doc, which
+    can be shared by the runs of other tasks and threads, see doc_registry. the elements updated in the run are only
+    seen by the forked doc.
+    '''
+    forked = copy.copy(self)
+    forked._updated_elements = {}
+    forked.doc = self._loaded_doc
+    forked.is_updated = False
+    return forked
+
+  def update_api_xpath(self, api_name: str, xpath: list[str]):
+    '''
+    change the xpath of an element in this doc, save() writes it to the doc
+    '''
+    api = self.get_api_by_name(api_name)
+    updated = copy.copy(api)
+    updated.xpath = xpath
+    screen_name = api.screen_name
+    if not self._updated_elements:
+      # the indexes of a forked doc are shared until its xpaths differ
+      self.screen_name2xpath_index = dict(self.screen_name2xpath_index)
+      self.screen_name2element_desc = dict(self.screen_name2element_desc)
+      self.xpath2api_names = dict(self.xpath2api_names)
+      self.api_xpath = dict(self.api_xpath)
+    for old_xpath in self._get_indexed_xpaths(api.xpath):
+      api_names = [name for name in self.xpath2api_names.get(old_xpath, []) if name != api_name]
+      if api_names:
+        self.xpath2api_names[old_xpath] = api_names
+      else:
+        self.xpath2api_names.pop(old_xpath, None)
+    for new_xpath in self._get_indexed_xpaths(xpath):
+      self.xpath2api_names[new_xpath] = self.xpath2api_names.get(new_xpath, []) + [api_name]
+    self.api_xpath[api_name] = xpath
+    self._condition2api_names = None
+    self.screen_name2element_desc.pop((screen_name, True), None)
+    self._updated_elements.setdefault(screen_name, {})[api_name] = updated
+
+    loaded_doc, updated_elements = self._loaded_doc, self._updated_elements
+    self.doc = LazyMapping(
+        loaded_doc, lambda screen_name: {**loaded_doc[screen_name], **updated_elements.get(screen_name, {})})
+    self.is_updated = True
+
   def get_api_xpath(self):
     return self.api_xpath
   
   def get_api_screen_name(self,api_name):
-    return api_name.split(UI_SCREEN_ELEMENT_DELIMITER)[0]
+    screen_name = self.api_name2screen_name.get(api_name, None)
+    return screen_name if screen_name is not None else api_name.split(UI_SCREEN_ELEMENT_DELIMITER)[0]
   
   def get_api_by_name(self, name: str):
     if not name:
       return None
-    _screen_name, _api_name = name.split(UI_SCREEN_ELEMENT_DELIMITER)[0], name
-    return self.doc[_screen_name].get(_api_name, None)
+    _screen_name = self.api_name2screen_name.get(name, None)
+    if _screen_name is None:
+      return None
+    return self.doc[_screen_name].get(name, None)
+
+  def get_api_names_by_xpath(self, xpath: str) -> list[str]:
+    return self.xpath2api_names.get(xpath, [])
+
+  def get_api_names_by_condition(self, condition: tuple) -> list[str]:
+    '''
+    @param condition: ('@<attribute>', value) or ('text()', value), e.g. ('@resource_id', 'menu_search')
+    @return: the apis with an xpath of the form //tag[@attribute='value' and text()='value'] that has the condition,
+      i.e. the apis that may be on a screen with the attribute or the text
+    '''
+    if self._condition2api_names is None:
+      condition2api_names = {}
+      for xpath, api_names in self.xpath2api_names.items():
+        parsed = parse_simple_xpath(xpath)
+        if parsed is None:
+          continue
+        for xpath_condition in parsed[1]:
+          condition2api_names.setdefault(xpath_condition, []).extend(api_names)
+      self._condition2api_names = condition2api_names
+    return self._condition2api_names.get(condition, [])
+
+  def get_api_names_with_complex_xpath(self) -> list[str]:
+    '''
+    the apis with an xpath that get_api_names_by_condition does not index
+    '''
+    api_names = []
+    for xpath, xpath_api_names in self.xpath2api_names.items():
+      parsed = parse_simple_xpath(xpath)
+      if parsed is None or not parsed[1]:
+        api_names.extend(xpath_api_names)
+    return api_names
 
   def get_dependency(self, api_name: str):
     api = self.get_api_by_name(api_name)
@@ -227,13 +435,10 @@ class ApiDoc():
     skeleton_str = skeleton if isinstance(skeleton, str) else skeleton.str
     screen_name = self.skeleton_str2screen_name.get(skeleton_str, None)
     if not screen_name:
-      count = 3 # todo::
-      for _screen_name, screen_skeleton in self.screen_name2skeleton.items():
-        common = screen_skeleton.extract_common_skeleton(skeleton)
-        _count = common.count()
-        if _count > count:
-          count = _count
-          screen_name = _screen_name
+      # the screen with the largest common structure, if it has more than 3 tags
+      if isinstance(skeleton, str):
+        skeleton = HTMLSkeleton(skeleton)
+      screen_name = self.skeleton_index.find(skeleton)
     
     # count is 0, screen_name is None
     return screen_name
@@ -258,34 +463,66 @@ class ApiDoc():
     if not elements:
       return valid_elements
     
+    # all xpaths of the screen are matched in one pass over the tree, the index is rebuilt when
+    # an xpath of the screen was changed, e.g. by the bug processor
+    screen_xpaths = tuple(xpath for ele in elements.values() for xpath in self._get_xpath_list(ele))
+    cached = self.screen_name2xpath_index.get(screen_name, None)
+    if cached is None or cached[0] != screen_xpaths:
+      cached = (screen_xpaths, XPathIndex(screen_xpaths))
+      self.screen_name2xpath_index[screen_name] = cached
+    xpath_index = cached[1]
+    matched_xpaths, failed_xpaths = xpath_index.match(element_tree.lxml_root)
+
     for ele in elements.values():
-      try:
-        target = element_tree.get_ele_by_xpath(ele.xpath)
-        if target:
-          valid_elements.append(ele)
-      except:
+      xpaths = self._get_xpath_list(ele)
+      if any(xpath in matched_xpaths for xpath in xpaths):
+        valid_elements.append(ele)
+      elif not isinstance(ele.xpath, list) and ele.xpath in failed_xpaths:
         print(ele.xpath)
         # raise Exception('internal error: Not Get Current Element, and Retry')
     
     return valid_elements
+
+  @staticmethod
+  def _get_xpath_list(ele: ApiEle) -> list:
+    return ele.xpath if isinstance(ele.xpath, list) else [ele.xpath]
+
+  @staticmethod
+  def _get_indexed_xpaths(xpath) -> list[str]:
+    if isinstance(xpath, list):
+      return [x for x in xpath if isinstance(x, str)]
+    return [xpath] if isinstance(xpath, str) else []
   
+  @staticmethod
+  def _get_one_element_description(ele: ApiEle, is_show_xpath=False):
+    parts = [f"\n\nelement: ${ele.api_name} \n\tDescription: {ele.description} \n\tType: {ele.type}"]
+    if ele.effect:
+      parts.append(f"\n\tEffect: {ele.effect}")
+    if ele.options:
+      parts.append(f"\n\tOptions: {ele.options}")
+    if is_show_xpath and ele.xpath:
+      parts.append(f"\n\tXPath: {ele.xpath}")
+    return ''.join(parts)
+
   @staticmethod
   def _get_element_description(ele_list: list[ApiEle], is_show_xpath=False):
-    elements_desc = ''
-    for ele in ele_list:
-      description = ele.description
-      elements_desc += f"\n\nelement: ${ele.api_name} \n\tDescription: {description} \n\tType: {ele.type}"
-      if ele.effect:
-        elements_desc += f"\n\tEffect: {ele.effect}"
-      if ele.options:
-        elements_desc += f"\n\tOptions: {ele.options}"
-      if is_show_xpath and ele.xpath:
-        elements_desc += f"\n\tXPath: {ele.xpath}"
-    
-    return elements_desc
+    return ''.join(ApiDoc._get_one_element_description(ele, is_show_xpath) for ele in ele_list)
+
+  def _get_screen_element_desc(self, screen_name: str, is_show_xpath=False) -> dict[str, str]:
+    # the descriptions of the elements of a screen, kept for the prompts of the next steps
+    key = (screen_name, is_show_xpath)
+    element_desc = self.screen_name2element_desc.get(key, None)
+    if element_desc is None:
+      element_desc = {
+          api_name: self._get_one_element_description(ele, is_show_xpath)
+          for api_name, ele in self.doc[screen_name].items()
+      }
+      self.screen_name2element_desc[key] = element_desc
+    return element_desc
   
   def get_all_element_desc(self, is_show_xpath=False):
-    return self._get_element_description(self.elements, is_show_xpath)
+    return ''.join(
+        desc for screen_name in self.doc for desc in self._get_screen_element_desc(screen_name, is_show_xpath).values())
   
   def get_current_element_desc(self, state: environment.State, is_show_xpath=False):
     element_tree = state.element_tree
@@ -295,8 +532,10 @@ class ApiDoc():
     
     # valid_elements
     valid_element_list = self.get_valid_element_list(current_screen_name, element_tree)
-    
-    return self._get_element_description(valid_element_list, is_show_xpath)
+    if not valid_element_list:
+      return ''
+    element_desc = self._get_screen_element_desc(current_screen_name, is_show_xpath)
+    return ''.join(element_desc[ele.api_name] for ele in valid_element_list)
   
   def save(self):
     if self.is_updated:
@@ -304,12 +543,14 @@ class ApiDoc():
       for screen_name in self.doc:
         doc_data[screen_name] = {
             'skeleton': self.screen_name2skeleton[screen_name].str,
-            'elements': {k: v.__dict__ for k, v in self.doc[screen_name].items()}
+            'elements': {k: v.to_dict() for k, v in self.doc[screen_name].items()}
         }
-      old_doc = json.load(open(self.doc_path, 'r'))
+      old_doc = json.load(open(self.json_path, 'r'))
       # bak
       timestamp = datetime.datetime.now().strftime('%m%d%H%M')
-      doc_path_bak = self.doc_path.replace('.json', f'_{timestamp}.json')
+      doc_path_bak = self.json_path.replace('.json', f'_{timestamp}.json')
       json.dump(old_doc, open(doc_path_bak, 'w'), indent=2)
       
-      json.dump(doc_data, open(self.doc_path, 'w'), indent=2)
\ No newline at end of file
+      json.dump(doc_data, open(self.json_path, 'w'), indent=2)
+      if self._compiled_doc is not None:
+        compile_api_doc(self.json_path, self._compiled_doc.compiled_path)
\ No newline at end of file
@@ -0,0 +1,81 @@
+# Measure the time to load the API docs and the memory they hold, from the JSON docs and from the compiled docs.
+#   python -m agent.script_utils.api_doc_benchmark evaluation
+# The memory is what the Python heap holds after loading, the pages of a compiled doc are mapped from the file.
+import argparse
+import gc
+import glob
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from agent.script_utils.api_doc import ApiDoc
+from agent.script_utils.compiled_doc import compile_api_doc, get_compiled_doc_path
+
+DEFAULT_DOCS_DIR = 'evaluation'
+
+
+def measure_load(doc_path: str, repeat: int):
+  '''
+  @return: (median seconds to load the doc, bytes held by the loaded doc, seconds to describe all its elements), None
+    if the doc fails to load
+  '''
+  load_times = []
+  for _ in range(repeat):
+    start_time = time.perf_counter()
+    try:
+      ApiDoc(doc_path)
+    except Exception:
+      return None
+    load_times.append(time.perf_counter() - start_time)
+
+  gc.collect()
+  tracemalloc.start()
+  start_size, _ = tracemalloc.get_traced_memory()
+  doc = ApiDoc(doc_path)
+  size, _ = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  # what the first prompt of a task needs
+  start_time = time.perf_counter()
+  doc.get_all_element_desc()
+  desc_time = time.perf_counter() - start_time
+  return statistics.median(load_times), size - start_size, desc_time
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Measure loading the JSON and the compiled API docs.")
+  parser.add_argument("docs_dir", nargs="?", default=DEFAULT_DOCS_DIR,
+                      help="directory searched recursively for docs/*.json, default: %(default)s")
+  parser.add_argument("-n", "--repeat", type=int, default=3, help="loads per doc, the median is reported")
+  args = parser.parse_args()
+
+  doc_paths = sorted(glob.glob(os.path.join(args.docs_dir, '**', 'docs', '*.json'), recursive=True))
+  print("%10s %10s %10s %10s %11s %11s %10s %10s  %s" % (
+      "JSON KiB", "comp KiB", "JSON ms", "comp ms", "JSON heap", "comp heap", "JSON desc", "comp desc", "doc"))
+  with tempfile.TemporaryDirectory() as compiled_dir:
+    json_dir = os.path.join(compiled_dir, 'json')
+    os.mkdir(json_dir)
+    for doc_path in doc_paths:
+      compiled_path = compile_api_doc(
+          doc_path, os.path.join(compiled_dir, os.path.basename(get_compiled_doc_path(doc_path))))
+      # the JSON doc is loaded from a copy, so that a compiled doc next to it is not used
+      json_copy_path = os.path.join(json_dir, os.path.basename(doc_path))
+      with open(doc_path, 'rb') as src, open(json_copy_path, 'wb') as dst:
+        dst.write(src.read())
+
+      json_result = measure_load(json_copy_path, args.repeat)
+      compiled_result = measure_load(compiled_path, args.repeat)
+      line = "%10.0f %10.0f " % (os.path.getsize(doc_path) / 1024, os.path.getsize(compiled_path) / 1024)
+      for result in (json_result, compiled_result):
+        line += "%10s " % ("failed" if result is None else "%.1f" % (result[0] * 1000))
+      for result in (json_result, compiled_result):
+        line += "%11s " % ("-" if result is None else "%.0f KiB" % (result[1] / 1024))
+      for result in (json_result, compiled_result):
+        line += "%10s " % ("-" if result is None else "%.1f" % (result[2] * 1000))
+      print(line + " %s" % doc_path)
+
+
+if __name__ == "__main__":
+  main()
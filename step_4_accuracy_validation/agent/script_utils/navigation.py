@@ -0,0 +1,180 @@
+import heapq
+import logging
+
+from agent.script_utils.api_doc import ApiDoc, DependentAction
+
+from . import WAIT_AFTER_ACTION_SECONDS
+
+
+class NavigationEdge():
+  '''
+  the actions of a doc path that lead from a screen to another screen. the actions that stay on the screen before the
+  one that leaves it, e.g. set_text() or enter(), are part of the edge, back() always leaves the screen.
+  '''
+
+  def __init__(self, from_screen: str, to_screen: str, actions: list[DependentAction]):
+    self.from_screen = from_screen
+    self.to_screen = to_screen
+    self.actions = actions
+    self.key = (from_screen, to_screen, tuple(action.raw_action for action in actions))
+
+  def __repr__(self):
+    return f'{self.from_screen} -> {self.to_screen}: {[action.raw_action for action in self.actions]}'
+
+
+class NavigationGraph():
+  '''
+  the screen transitions of all the dependency paths of a doc
+  '''
+
+  def __init__(self, doc: ApiDoc):
+    self.screen2edges: dict[str, list[NavigationEdge]] = {}
+    # the actions at the end of the paths of an element that stay on its screen, e.g. selecting a tab
+    self.api_name2reveal_edges: dict[str, list[NavigationEdge]] = {}
+    edge_keys = set()
+    skipped_paths = []
+    for elements in doc.doc.values():
+      for ele in elements.values():
+        for path in ele.paths:
+          dependency_action = self._parse_path(path)
+          if dependency_action is None:
+            skipped_paths.append(path)
+            continue
+          edges, reveal_edge = self.split_path(dependency_action, ele.screen_name)
+          for edge in edges:
+            if edge.key not in edge_keys:
+              edge_keys.add(edge.key)
+              self.screen2edges.setdefault(edge.from_screen, []).append(edge)
+          if reveal_edge is not None:
+            reveal_edges = self.api_name2reveal_edges.setdefault(ele.api_name, [])
+            if all(edge.key != reveal_edge.key for edge in reveal_edges):
+              reveal_edges.append(reveal_edge)
+    if skipped_paths:
+      logging.warning(f'{len(skipped_paths)} paths of {doc.doc_path} can not be parsed, e.g. {skipped_paths[0]}')
+
+  @staticmethod
+  def _parse_path(path: list[str]) -> list[DependentAction]:
+    # open_app(<app>) restarts the app, the route is the actions after the last one
+    for idx in range(len(path) - 1, -1, -1):
+      if path[idx].startswith('open_app('):
+        path = path[idx + 1:]
+        break
+    try:
+      return [DependentAction(action) for action in path]
+    except (AssertionError, TypeError, ValueError):
+      # e.g. 'None.tap()' in a generated path
+      logging.debug(f'can not parse the path {path}')
+      return None
+
+  @staticmethod
+  def split_path(dependency_action: list[DependentAction], target_screen: str):
+    '''
+    split the path into segments of the actions on one screen, a segment ends before an action on another screen and
+    after back(). a segment leads to the screen of the next segment, the last one to the target screen.
+    @return: (the edges of the path, the actions at its end on the target screen or None)
+    '''
+    # [screen, actions, whether the segment ended with back()], the screen is None if it is unknown
+    segments = []
+    for action in dependency_action:
+      if action.screen_name is None:
+        if action.action_type == 'enter' and segments and segments[-1][0] is not None and not segments[-1][2]:
+          # enter() is done on the screen of the action before it, e.g. set_text()
+          segments[-1][1].append(action)
+        else:
+          # the screen of back() is unknown, and so is the screen the segment before it leads to
+          segments.append([None, [action], True])
+        continue
+      if segments and segments[-1][0] == action.screen_name and not segments[-1][2]:
+        segments[-1][1].append(action)
+      else:
+        segments.append([action.screen_name, [action], False])
+      if action.action_type == 'back':
+        segments[-1][2] = True
+
+    edges, reveal_edge = [], None
+    for idx, (screen, actions, is_back) in enumerate(segments):
+      is_last = idx == len(segments) - 1
+      next_screen = target_screen if is_last else segments[idx + 1][0]
+      if screen is None or next_screen is None:
+        continue
+      if screen != next_screen:
+        edges.append(NavigationEdge(screen, next_screen, actions))
+      elif is_last and not is_back:
+        # the actions stay on the screen of the element, e.g. select a tab, a segment that ends with back() left it
+        reveal_edge = NavigationEdge(screen, screen, actions)
+    return edges, reveal_edge
+
+
+class NavigationPlanner():
+  '''
+  finds the cheapest actions to the screen of an element. an edge costs its expected latency over its success rate,
+  both observed in this run, so the failed edges are avoided by the next routes.
+  '''
+
+  def __init__(self, doc: ApiDoc):
+    self.doc = doc
+    # edge key -> [successes, failures, seconds of the successes]
+    self.edge_stats: dict[tuple, list] = {}
+
+  @property
+  def graph(self) -> NavigationGraph:
+    # the graph is the same for all the runs on the doc
+    return self.doc.get_shared_index('navigation_graph', NavigationGraph)
+
+  def get_cost(self, edge: NavigationEdge) -> float:
+    successes, failures, seconds = self.edge_stats.get(edge.key, (0, 0, 0.0))
+    latency = seconds / successes if successes else len(edge.actions) * WAIT_AFTER_ACTION_SECONDS
+    success_rate = (successes + 1) / (successes + failures + 2)
+    return latency / success_rate
+
+  def plan(self, from_screen: str, to_screen: str, excluded_edges=()) -> list[NavigationEdge]:
+    '''
+    @param excluded_edges: keys of edges that are not used, e.g. the edges that failed in this navigation
+    @return: the edges of the cheapest route, [] if from_screen is to_screen, None if there is no route
+    '''
+    if from_screen == to_screen:
+      return []
+    screen2edges = self.graph.screen2edges
+    costs = {from_screen: 0.0}
+    previous_edges: dict[str, NavigationEdge] = {}
+    queue = [(0.0, 0, from_screen)]
+    counter = 1
+    while queue:
+      cost, _, screen = heapq.heappop(queue)
+      if screen == to_screen:
+        route = []
+        while screen != from_screen:
+          edge = previous_edges[screen]
+          route.append(edge)
+          screen = edge.from_screen
+        return route[::-1]
+      if cost > costs[screen]:
+        continue
+      for edge in screen2edges.get(screen, ()):
+        if edge.key in excluded_edges:
+          continue
+        next_cost = cost + self.get_cost(edge)
+        if next_cost < costs.get(edge.to_screen, float('inf')):
+          costs[edge.to_screen] = next_cost
+          previous_edges[edge.to_screen] = edge
+          heapq.heappush(queue, (next_cost, counter, edge.to_screen))
+          counter += 1
+    return None
+
+  def get_reveal_edges(self, api_name: str, excluded_edges=()) -> list[NavigationEdge]:
+    '''
+    @return: the actions on the screen of the element that may show it, the cheapest first
+    '''
+    reveal_edges = [
+        edge for edge in self.graph.api_name2reveal_edges.get(api_name, []) if edge.key not in excluded_edges
+    ]
+    return sorted(reveal_edges, key=self.get_cost)
+
+  def record_success(self, edge: NavigationEdge, seconds: float):
+    stats = self.edge_stats.setdefault(edge.key, [0, 0, 0.0])
+    stats[0] += 1
+    stats[2] += seconds
+
+  def record_failure(self, edge: NavigationEdge):
+    stats = self.edge_stats.setdefault(edge.key, [0, 0, 0.0])
+    stats[1] += 1
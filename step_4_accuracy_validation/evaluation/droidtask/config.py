@@ -5,6 +5,8 @@ EMULATOR_AGRS = {
     "port" : "5554",
     # "no-window" : "true",  # Change this to "true" to run the emulator without GUI.
 }
+# number of emulators the tasks are spread over, read-only instances of AVD_NAME on consecutive ports
+NUM_EMULATORS = 1
 
 # NO NEED TO CHANGE
 DOC_PATH = "evaluation/droidtask/docs"
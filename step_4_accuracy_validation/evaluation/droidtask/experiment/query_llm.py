@@ -1,4 +1,7 @@
 from lxml import etree
+
+from agent.droidbot.xpath_index import XPathIndex
+
 def _get_all_element_names(doc):
     all_elements_desc = ''
     element_num = 0
@@ -93,19 +96,19 @@ def get_available_elements(doc, screen_html, screen_name, use_dash=True):
     parser = etree.HTMLParser()
     element_tree = etree.fromstring(screen_html, parser)
 
+    elements = doc[screen_name]['elements']
+    # all xpaths of the screen are matched in one pass over the tree
+    xpath_index = XPathIndex(ele_xpath for element_data in elements.values() for ele_xpath in element_data['xpath'] or [])
+    matched_xpaths, failed_xpaths = xpath_index.match(element_tree, elements_only=False)
+    for ele_xpath in failed_xpaths:
+        print(f'Error in xpath: {ele_xpath}')
+
     available_elements = []
-    for element_name, element_data in doc[screen_name]['elements'].items():
+    for element_name, element_data in elements.items():
         ele_xpaths = element_data['xpath']
         if not ele_xpaths:
             continue
-        for ele_xpath in ele_xpaths:
-            try: 
-                element = element_tree.xpath(ele_xpath)
-            except:
-                print(f'Error in xpath: {ele_xpath}')
-                continue
-            if len(element) > 0:
-                new_element_name = element_name.replace(':', '__') if use_dash else element_name
-                available_elements.append(new_element_name)
-                break
+        if any(ele_xpath in matched_xpaths for ele_xpath in ele_xpaths):
+            new_element_name = element_name.replace(':', '__') if use_dash else element_name
+            available_elements.append(new_element_name)
     return available_elements
\ No newline at end of file
@@ -15,11 +15,13 @@ import tools as tools
 from evaluation.droidtask.config import BASE_APK_PATH, DEBUG_MODE, DOC_PATH, EMULATOR_AGRS, FIRST_SCREEN_ELEMENTS_PATH, TASKS_PATH
 from evaluation.droidtask.experiment.query_llm import make_solution_prompt_droidtask_tune
 from agent.droidbot.device import Device
+from agent.droidbot.readiness import ReadinessProbes
 from agent.droidbot.app import App
 from agent.droidbot.input_event import RestartAppEvent
 from agent.code_agent import CodeAgent
 from agent.script_utils.ui_apis import CodeConfig, CodeStatus, Verifier, regenerate_script, _save2log, ElementList
 from agent.script_utils.api_doc import ApiDoc
+from agent.script_utils.doc_registry import doc_registry
 from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
 import torch
 
@@ -103,7 +105,7 @@ class CodeAgent():
       raise ValueError(f'Unknown doc path: {doc_path}')
 
     self.app_name = app_name
-    self.doc = ApiDoc(doc_path)
+    self.doc = doc_registry.get_api_doc(doc_path, app_name).fork()
     self.save_dir = save_path
     
     self.save_path = None
@@ -204,7 +206,7 @@ class CodeAgent():
     return result
 
 
-def check_code_executable(app_name, code, task_id, output_dir):
+def check_code_executable(app_name, code, task_id, output_dir, device_serial=None):
     output_dir = f"{output_dir}/{app_name}/{task_id}"
     if os.path.exists(output_dir):
       shutil.rmtree(output_dir)
@@ -225,22 +227,23 @@ def check_code_executable(app_name, code, task_id, output_dir):
 
     logging.info("Starting DroidBot")
     try:
-      device_serial = f"emulator-{EMULATOR_AGRS['port']}"
-      subprocess.run(["adb",  "-s", device_serial, "emu", "avd", "snapshot", "load", EMULATOR_AGRS['snapshot']])  
-      import time
-      time.sleep(3)
+      if device_serial is None:
+        device_serial = f"emulator-{EMULATOR_AGRS['port']}"
+      readiness = ReadinessProbes(device_serial)
+      readiness.load_snapshot(EMULATOR_AGRS['snapshot'])
       
       device = Device(
           device_serial=device_serial,
           is_emulator=True,
-          output_dir=output_dir)
+          output_dir=output_dir,
+          readiness=readiness)
       
       app = App(app_path, output_dir)
       env = environment.AsyncDroidBotEnv(device, app)
       device.send_event(RestartAppEvent(app=app))
-      if 'firefox' in app_name.lower():
-        import time
-        time.sleep(30)
+      # firefox takes much longer than the other apps to show its first screen
+      device.wait_for_app(app.get_package_name(), timeout=60 if 'firefox' in app_name.lower() else None)
+      logging.info(f"readiness wait times: {readiness.get_wait_times()}")
       code_agent = CodeAgent(env, app_name, doc_name, output_dir)
       
       print(task_id)
@@ -305,12 +308,71 @@ def query_autodroidv2(model, tokenizer, prompt: str):
     output = model.generate(**inputs, max_length=1000, pad_token_id=tokenizer.eos_token_id)
     return tokenizer.decode(output[0], skip_special_tokens=True)
 
-def run_all_tasks(app, output_dir, model_name="autodroidv2"):
+def solve_task(app_name, task_number, task_data, output_dir, model_name, model=None, tokenizer=None, encoder=None,
+               device_serial=None, model_lock=None):
+  """
+  generates the script of a task and runs it on the device
+  returns None if the task is skipped
+  """
+  task = task_data['task']
+  
+  # loaded once per app for all its tasks
+  first_screen_elements = doc_registry.get_json(f'{FIRST_SCREEN_ELEMENTS_PATH}/{app_name}_first_elements.json')
+  doc = doc_registry.get_json(f'{DOC_PATH}/{app_name}.json')
+  if DEBUG_MODE:
+    code = '''
+# $server_overview_screen__you_button.tap()
+# $personal_profile_screen__settings_button.tap()
+# $settings_screen__notifications_button.tap()
+# '''
+  else:
+    task_prompt = make_solution_prompt_droidtask_tune(doc, task, app_name, first_screen_elements)
+    print(task_prompt)
+    if model_name == "autodroidv2":
+      # workers of an emulator pool share the local model
+      if model_lock is not None:
+        with model_lock:
+          task_answer = query_autodroidv2(model, tokenizer, task_prompt)
+      else:
+        task_answer = query_autodroidv2(model, tokenizer, task_prompt)
+    else:
+      task_answer = tools.query_model(task_prompt, model_name)
+    print(task_answer)
+    if not os.path.exists(f'{output_dir}/{app_name}'):
+      os.makedirs(f'{output_dir}/{app_name}', exist_ok=True)
+    tools.dump_json_file(json_path=f'{output_dir}/{app_name}/{task_number}_qa.json', data=[task_prompt, task_answer])
+    # calculate the token number of the answer, if too long, we skip
+    tokens = encoder.encode(task_answer)
+    if len(tokens) > 2048:
+      print(f"Task answer too long: {len(tokens)}")
+      return None
+    
+    task_answer, _ = tools.convert_gpt_answer_to_json(task_answer, 'gpt-4o')
+    code = task_answer['script']
+  
+  
+  code = postprocess_code(code, doc)
+  print(f"Post processed code: {code}")
+  result = check_code_executable(
+    app_name=app_name,
+    code=code,
+    task_id=task_number, 
+    output_dir=output_dir,
+    device_serial=device_serial
+  )
+  result.update({"task": task, 'code': code, 'doc_path': f'{DOC_PATH}/{app_name}.json', })
+  return result
+
+def run_all_tasks(app, output_dir, model_name="autodroidv2", pool=None):
+  """
+  pool: an EmulatorPool to spread the tasks over, the tasks run one after another on EMULATOR_AGRS['port'] if None
+  """
   
   tasks_data = tools.load_json_file(TASKS_PATH)
   
   result_folder = 'results'
   
+  model, tokenizer = None, None
   if model_name == "autodroidv2":
     model, tokenizer = load_autodroidv2()
 
@@ -322,49 +384,39 @@ def run_all_tasks(app, output_dir, model_name="autodroidv2"):
       continue
     print("app_name:", app_name)
 
+    if pool is not None:
+      import threading
+      model_lock = threading.Lock()
+
+      def run_task(worker, task_item):
+        task_number, task_data = task_item
+        try:
+          return solve_task(app_name, task_number, task_data, output_dir, model_name, model, tokenizer, encoder,
+                            device_serial=worker.serial, model_lock=model_lock)
+        except Exception as e:
+          traceback.print_exc()
+          return {'failed': True}
+
+      records = pool.run(list(app_tasks.items()), run_task)
+      result_list = []
+      for record in records:
+        if record['error'] is not None:
+          result_list.append({'failed': True})
+        elif record['result'] is not None:
+          result_list.append(record['result'])
+      result_df = pandas.DataFrame(result_list)
+      if not os.path.exists(f'{output_dir}/{result_folder}'):
+        os.makedirs(f'{output_dir}/{result_folder}')
+      output_path = os.path.join(output_dir, result_folder, f"{app_name}.jsonl")
+      result_df.to_json(output_path, lines=True, orient='records')
+      continue
+
     result_list = []
     for task_number, task_data in app_tasks.items():
       try:
-        task = task_data['task']
-        
-        first_screen_elements = tools.load_json_file(f'{FIRST_SCREEN_ELEMENTS_PATH}/{app_name}_first_elements.json')
-        doc = tools.load_json_file(f'{DOC_PATH}/{app_name}.json')
-        if DEBUG_MODE:
-              code = '''
-# $server_overview_screen__you_button.tap()
-# $personal_profile_screen__settings_button.tap()
-# $settings_screen__notifications_button.tap()
-# '''
-        else:
-          task_prompt = make_solution_prompt_droidtask_tune(doc, task, app_name, first_screen_elements)
-          print(task_prompt)
-          if model_name == "autodroidv2":
-            task_answer = query_autodroidv2(model, tokenizer, task_prompt)
-          else:
-            task_answer = tools.query_model(task_prompt, model_name)
-          print(task_answer)
-          if not os.path.exists(f'{output_dir}/{app_name}'):
-            os.makedirs(f'{output_dir}/{app_name}')
-          tools.dump_json_file(json_path=f'{output_dir}/{app_name}/{task_number}_qa.json', data=[task_prompt, task_answer])
-          # calculate the token number of the answer, if too long, we skip
-          tokens = encoder.encode(task_answer)
-          if len(tokens) > 2048:
-            print(f"Task answer too long: {len(tokens)}")
-            continue
-          
-          task_answer, _ = tools.convert_gpt_answer_to_json(task_answer, 'gpt-4o')
-          code = task_answer['script']
-        
-        
-        code = postprocess_code(code, doc)
-        print(f"Post processed code: {code}")
-        result = check_code_executable(
-          app_name=app_name,
-          code=code,
-          task_id=task_number, 
-          output_dir=output_dir
-        )
-        result.update({"task": task, 'code': code, 'doc_path': f'{DOC_PATH}/{app_name}.json', })
+        result = solve_task(app_name, task_number, task_data, output_dir, model_name, model, tokenizer, encoder)
+        if result is None:
+          continue
       except KeyboardInterrupt as e:
         print(e)
         sys.exit(-1)
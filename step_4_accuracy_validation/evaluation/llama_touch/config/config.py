@@ -25,6 +25,18 @@ class AgentEnvConfig:
             - "port": Port number to use for adb connecting to the emulator.
             - "no-window": A boolean string ('true' or 'false') indicating whether the emulator should
               run without opening a GUI window. Useful for running tests in a headless environment.
+
+        STABILITY_MODE (str): How the environment waits for the screen to settle after an action.
+            "poll" compares consecutive device states, "idle" waits for a pause in the accessibility
+            events of the droidbot app and falls back to polling when they are unavailable.
+
+        NUM_EMULATORS (int): The number of emulators the instructions are spread over. With more than one,
+            read-only instances of the AVD are started on consecutive ports from EMULATOR_CONTROLLER_AGRS["port"],
+            and a task whose emulator crashed is retried on another one.
+
+        RESET_LADDER (bool): Whether resets between tasks pick the cheapest sufficient reset (relaunching the app,
+            clearing and restoring its data, reloading the snapshot) from what the previous task touched, verified
+            against the first screen of the app after a snapshot reload. If False, the snapshot is always reloaded.
     """
     LOCAL_OUTPUT_PATH = "evaluation/llama_touch/experiment/gpt_4o"
     MODEL = "gpt-4o" #gpt-4-0125-preview #autodroidv2
@@ -34,6 +46,9 @@ class AgentEnvConfig:
     AVD_NAME = "pixel_6a_api31"    
     BASE_APKS_PATH = f"evaluation/llama_touch/apks"
     MAX_STEPS = 30
+    STABILITY_MODE = "poll" # "poll" or "idle"
+    NUM_EMULATORS = 1
+    RESET_LADDER = True
     EMULATOR_CONTROLLER_AGRS = {
         "snapshot" : "snap_2024-11-12_14-17-11",
         "port" : "5554",
@@ -7,7 +7,8 @@ all_times = []
 for folder in data_folders:
     for trace in os.listdir(folder):
         runtime = json.load(open(f"{folder}/{trace}/agent_logs/runtime.json"))
-        if len(runtime) == 0:
+        # failed tasks have no runtime or only the times of their resets
+        if len(runtime) == 0 or "execution" not in runtime[0]:
             continue
         execution_time = runtime[0]["execution"]
         actions_save_time = json.load(open(f"{folder}/{trace}/agent_logs/agent_actions_save_time.json"))
@@ -27,6 +27,14 @@ class AgentEnvConfig:
             - "port": Port number to use for adb connecting to the emulator.
             - "no-window": A boolean string ('true' or 'false') indicating whether the emulator should
               run without opening a GUI window. Useful for running tests in a headless environment.
+
+        STABILITY_MODE (str): How the environment waits for the screen to settle after an action.
+            "poll" compares consecutive device states, "idle" waits for a pause in the accessibility
+            events of the droidbot app and falls back to polling when they are unavailable.
+
+        RESET_LADDER (bool): Whether resets between tasks pick the cheapest sufficient reset (relaunching the app,
+            clearing and restoring its data, reloading the snapshot) from what the previous task touched, verified
+            against the first screen of the app after a snapshot reload. If False, the snapshot is always reloaded.
     """
     LOCAL_OUTPUT_PATH = "minimal_experiment_output/gpt4o"
     MODEL = "gpt-4o" #gpt-4-0125-preview #autodroidv2
@@ -36,6 +44,8 @@ class AgentEnvConfig:
     INSTRUCTION_FILE_PATH = "minimal_setup/instruction.tsv"
     AVD_NAME = "pixel_6a_api_31"
     MAX_STEPS = 30
+    STABILITY_MODE = "poll" # "poll" or "idle"
+    RESET_LADDER = True
     EMULATOR_CONTROLLER_AGRS = {
         "snapshot" : "snap_2025-04-04_01-23-42",
         "port" : "5554",
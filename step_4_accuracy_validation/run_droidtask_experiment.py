@@ -3,8 +3,9 @@ import argparse
 import os
 import time
 import yaml
-from evaluation.droidtask.config import BASE_EXPERIMENT_PATH, BASELINE_PATH, GROUNDTRUTH_PATH, TASKS_GROUNDTRUTH_PATH, EMULATOR_AGRS
+from evaluation.droidtask.config import BASE_EXPERIMENT_PATH, BASELINE_PATH, GROUNDTRUTH_PATH, TASKS_GROUNDTRUTH_PATH, EMULATOR_AGRS, AVD_NAME, NUM_EMULATORS
 from evaluation.droidtask.experiment.test_all_tasks import run_all_tasks
+from agent.emulator_pool import EmulatorPool
 import tools as tools
 from dotenv import load_dotenv
 
@@ -67,13 +68,13 @@ def get_action_desc(html, id, action_type, input_text):
 
 all_tasks_gt = tools.load_json_file(TASKS_GROUNDTRUTH_PATH)
 
-def test_app_tasks(agent, app, output_dir, model_name, run_tasks_online=True):
+def test_app_tasks(agent, app, output_dir, model_name, run_tasks_online=True, pool=None):
     
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
     
     if run_tasks_online:
-        run_all_tasks(app, f"{BASE_EXPERIMENT_PATH}/{agent}", model_name)
+        run_all_tasks(app, f"{BASE_EXPERIMENT_PATH}/{agent}", model_name, pool=pool)
     
     app_accs, all_tasks, app_correct_action_num, app_all_action_num, app_redundancies = [], [], 0, 0, []
     stats = []
@@ -270,11 +271,21 @@ if __name__ == '__main__':
         "notes", 
         "voicerecorder"
     ]
+    # the emulators are started once and kept for all apps
+    pool = None
+    if not evaluation and NUM_EMULATORS > 1:
+        pool = EmulatorPool(
+            num_workers=NUM_EMULATORS,
+            output_dir=f"{BASE_EXPERIMENT_PATH}/{agent}/workers",
+            controller_factory=EmulatorPool.emulator_controller_factory(AVD_NAME, EMULATOR_AGRS),
+            base_port=int(EMULATOR_AGRS["port"]))
     all_stats = []
     for app in app_list:
-        app_acc, all_tasks, stats = test_app_tasks(agent, app, baseline_dir, model, run_tasks_online=not evaluation)
+        app_acc, all_tasks, stats = test_app_tasks(agent, app, baseline_dir, model, run_tasks_online=not evaluation, pool=pool)
         all_stats.append(stats)
         # show_app_failures(app, baseline_dir)
+    if pool is not None:
+        pool.close()
     stats_txt = ""
     for stats in all_stats:
         if stats != None:
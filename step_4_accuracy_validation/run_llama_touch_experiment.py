@@ -3,14 +3,65 @@ import sys
 import time
 import logging
 import logging
+import pandas as pd
 import tools as tools
 from agent.environment import AsyncDroidBotEnvForLlamaTouch
+from agent.emulator_pool import EmulatorPool
 from agent.code_agent import CodeAgent
 from evaluation.llama_touch.config.config import AgentEnvConfig, LogConfig
 from dotenv import load_dotenv
 
 load_dotenv()
 
+def run_with_emulator_pool():
+    """Spreads the instructions over AgentEnvConfig.NUM_EMULATORS emulators."""
+    instructions = pd.read_csv(AgentEnvConfig.INSTRUCTION_FILE_PATH, sep='\t')
+    pool = EmulatorPool(
+        num_workers=AgentEnvConfig.NUM_EMULATORS,
+        output_dir=f"{AgentEnvConfig.LOCAL_OUTPUT_PATH}/workers",
+        controller_factory=EmulatorPool.emulator_controller_factory(
+            AgentEnvConfig.AVD_NAME, AgentEnvConfig.EMULATOR_CONTROLLER_AGRS),
+        set_up=lambda worker: AsyncDroidBotEnvForLlamaTouch(
+            avd_name=AgentEnvConfig.AVD_NAME,
+            emulator_controller_args=worker.controller.params,
+            max_steps=AgentEnvConfig.MAX_STEPS,
+            local_output_path=AgentEnvConfig.LOCAL_OUTPUT_PATH,
+            instruction_fp=AgentEnvConfig.INSTRUCTION_FILE_PATH,
+            config=AgentEnvConfig,
+            stability_mode=AgentEnvConfig.STABILITY_MODE,
+            emulator_controller=worker.controller,
+            device_logs_path=f"{worker.output_dir}/device_logs"),
+        tear_down=lambda worker: worker.context.close() if worker.context is not None
+            else worker.controller.exit_emulator(),
+        base_port=int(AgentEnvConfig.EMULATOR_CONTROLLER_AGRS["port"]))
+
+    def run_task(worker, row):
+        agent_env = worker.context
+        instruction, app_name = agent_env.set_instruction(row)
+        logging.info(f"[worker {worker.worker_id}] Current instruction: {instruction}")
+        doc_name = f"{AgentEnvConfig.DOCS_BASE_DIR}/{app_name}.json"
+        agent_logs_path = f"{agent_env.task_output_path}/agent_logs"
+        code_agent = CodeAgent(agent_env, app_name, doc_name, agent_logs_path, AgentEnvConfig.MODEL)
+        code_agent.MAX_RETRY_TIMES = 2
+        agent_env.reset_env(app_name)
+        return code_agent.step(instruction)
+
+    try:
+        records = pool.run([row for _, row in instructions.iterrows()], run_task)
+    finally:
+        pool.close()
+
+    results = []
+    for record, (_, row) in zip(records, instructions.iterrows()):
+        result = record["result"] if record["result"] is not None else {"is_completed": False, "error": record["error"]}
+        result.update({"instruction": row["description"], "worker": record["worker"], "attempts": record["attempts"]})
+        results.append(result)
+    tools.dump_json_file(f"{AgentEnvConfig.LOCAL_OUTPUT_PATH}/results.json", {
+        "succeeded": sum(1 for res in results if res['is_completed']),
+        "results": results
+      })
+    logging.info("Llama Touch Experiment Finished!")
+
 def main():
     os.makedirs(LogConfig.LOG_FILE_PATH, exist_ok=True)
     # Setup logging using configuration settings
@@ -20,6 +71,10 @@ def main():
                         datefmt=LogConfig.LOGGING_DATE_FORMAT,
                         handlers=[logging.FileHandler(log_file_name, 'a'),
                                   logging.StreamHandler()])
+    if AgentEnvConfig.NUM_EMULATORS > 1:
+        run_with_emulator_pool()
+        sys.exit(0)
+
     logging.info("Starting environment!")
     agent_env = AsyncDroidBotEnvForLlamaTouch(
         avd_name=AgentEnvConfig.AVD_NAME,
@@ -27,7 +82,8 @@ def main():
         max_steps=AgentEnvConfig.MAX_STEPS,
         local_output_path=AgentEnvConfig.LOCAL_OUTPUT_PATH,
         instruction_fp=AgentEnvConfig.INSTRUCTION_FILE_PATH,
-        config=AgentEnvConfig
+        config=AgentEnvConfig,
+        stability_mode=AgentEnvConfig.STABILITY_MODE
     )
 
     results = []
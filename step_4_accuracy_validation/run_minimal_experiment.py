@@ -27,7 +27,8 @@ def main():
         max_steps=AgentEnvConfig.MAX_STEPS,
         local_output_path=AgentEnvConfig.LOCAL_OUTPUT_PATH,
         instruction_fp=AgentEnvConfig.INSTRUCTION_FILE_PATH,
-        config=AgentEnvConfig
+        config=AgentEnvConfig,
+        stability_mode=AgentEnvConfig.STABILITY_MODE
     )
 
     results = []